@@ -1,18 +1,17 @@
 from phi.assistant import Assistant
 from phi.tools import Toolkit
-from redis import Redis
 from api.controllers.news_controller import NewsController
 from dotenv import load_dotenv
 import json
 from monitoring.logging_config import setup_logging
+from services.llm_cache import cached_run
+from services.agent_memory import get_agent_memory, params_digest
 from phi.model.xai import xAI
 import os
 
 logger = setup_logging()
 load_dotenv()
 
-REDIS_HOST = "localhost"
-redis_client = Redis(host=REDIS_HOST, port=6379, db=0)
 XAI_API_KEY = os.getenv("XAI_API_KEY")
 
 class NewsToolkit(Toolkit):
@@ -39,43 +38,47 @@ class NewsAgent(Assistant):
             show_tool_calls=True
         )
 
-    def store_memory(self, data):
-        try:
-            redis_client.set(self.memory_key, json.dumps(data))
-            logger.info(f"Stored data in Redis for {self.name}: {data}")
-        except Exception as e:
-            logger.error(f"Error storing memory: {str(e)}")
+    def store_memory(self, data, stock_id=None, date=None, params=None, ttl=None):
+        """依 stock_id / date / params 分鍵寫入記憶（帶 TTL）"""
+        get_agent_memory().set(self.memory_key, data, stock_id, date, params, ttl)
 
-    def read_memory(self):
+    def read_memory(self, stock_id=None, date=None, params=None):
+        """讀取指定股票 / 日期 / 參數的記憶；不帶參數時回傳最近一次寫入"""
+        return get_agent_memory().get(self.memory_key, stock_id, date, params)
+
+    def search_news(self, stock_id: str, query: str, date: str = None, sentiment: str = None, tags: list = None):
+        """搜尋並摘要新聞；相同股票、日期、查詢條件且搜尋結果未變的摘要由記憶直接回傳
+
+        鍵中含搜尋結果的摘要，date 為 None（最新新聞）或當日新聞仍在增加時，不會沿用舊摘要。
+        """
         try:
-            data = redis_client.get(self.memory_key)
-            if data:
-                return json.loads(data)
-            return None
+            news_items = json.loads(self.tools[0].search_news(stock_id, query, date, sentiment, ",".join(tags) if tags else None))
         except Exception as e:
-            logger.error(f"Error reading memory: {str(e)}")
-            return None
+            logger.error(f"Error searching news: {str(e)}")
+            return []
+        if not news_items:
+            return []
+        params = {"query": query, "sentiment": sentiment, "tags": sorted(tags) if tags else None, "news_digest": params_digest(news_items)}
+        result = get_agent_memory().read_through(
+            self.memory_key, lambda: self._search_news(stock_id, news_items), stock_id, date, params
+        )
+        return result if result is not None else []
 
-    def search_news(self, stock_id: str, query: str, date: str = None, sentiment: str = None, tags: list = None):
+    def _search_news(self, stock_id, news_items):
         try:
-            news_json = self.tools[0].search_news(stock_id, query, date, sentiment, ",".join(tags) if tags else None)
-            news_items = json.loads(news_json)
             if not news_items:
-                return []
+                return None
 
             prompt = (
                 f"Analyze and summarize the following news items for stock {stock_id}:\n"
                 f"{json.dumps(news_items)}\n"
                 f"Return a JSON string with 'stock_id', 'summary', and 'key_insights'."
             )
-            response = self.run(prompt)
-            response_str = "".join([chunk for chunk in response if chunk is not None])
-            summary = json.loads(response_str)
-            self.store_memory(summary)
-            return summary
+            response_str = cached_run(self, prompt, validate=json.loads)
+            return json.loads(response_str)
         except Exception as e:
             logger.error(f"Error searching news: {str(e)}")
-            return []
+            return None
 
 if __name__ == "__main__":
     agent = NewsAgent()
@@ -0,0 +1,178 @@
+import asyncio
+import time
+from datetime import date as date_cls
+from dotenv import load_dotenv
+import os
+from monitoring.logging_config import setup_logging
+from models.trading_env import SENTIMENT_SCORES
+
+logger = setup_logging()
+load_dotenv()
+
+STAGE_TIMEOUT = float(os.getenv("ORCHESTRATOR_STAGE_TIMEOUT", 60))
+NEUTRAL_VIX = 20.0
+
+class Stage:
+    """DAG 中的一個階段：func(context) 為同步函式，context 含請求參數與上游階段結果
+
+    requires 中的上游失敗時本階段略過；uses 中的上游失敗時以 None 傳入，由本階段自行降級。
+    """
+
+    def __init__(self, name, func, requires=(), uses=(), timeout=STAGE_TIMEOUT):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+        self.uses = tuple(uses)
+        self.timeout = timeout
+
+    @property
+    def deps(self):
+        return self.requires + self.uses
+
+def _topological_order(stages):
+    """檢查相依關係並回傳拓撲順序；相依不存在或有環時拋出 ValueError"""
+    order, state = [], {}
+
+    def visit(name, path):
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"Dependency cycle: {' -> '.join(path + [name])}")
+        if name not in stages:
+            raise ValueError(f"Unknown stage dependency {name} (from {path[-1] if path else 'root'})")
+        state[name] = "visiting"
+        for dep in stages[name].deps:
+            visit(dep, path + [name])
+        state[name] = "done"
+        order.append(name)
+
+    for name in stages:
+        visit(name, [])
+    return order
+
+class AgentOrchestrator:
+    """以相依圖並行執行多個 agent 階段
+
+    每個階段在自己的上游完成後立即以 asyncio.to_thread 執行（agent 皆為阻塞呼叫），並受各自的逾時限制；
+    逾時或失敗的階段記錄狀態後繼續，回傳部分結果與各階段時間，端到端延遲取決於關鍵路徑而非各階段總和。
+    逾時的執行緒無法中斷，會在背景跑完但結果被捨棄。
+    """
+
+    def __init__(self, stages):
+        self.stages = {stage.name: stage for stage in stages}
+        self.order = _topological_order(self.stages)
+
+    async def _run_stage(self, stage, tasks, context, timings, origin):
+        outcomes = await asyncio.gather(*(tasks[dep] for dep in stage.deps))
+        upstream = dict(zip(stage.deps, outcomes))
+        failed = [dep for dep in stage.requires if upstream[dep]["status"] != "ok"]
+        if failed:
+            timings[stage.name] = {"status": "skipped", "reason": f"upstream failed: {', '.join(failed)}"}
+            return timings[stage.name]
+
+        stage_context = dict(context)
+        stage_context.update({dep: outcome["result"] if outcome["status"] == "ok" else None for dep, outcome in upstream.items()})
+        start = time.perf_counter()
+        outcome = {"started_ms": (start - origin) * 1000}
+        try:
+            outcome["result"] = await asyncio.wait_for(asyncio.to_thread(stage.func, stage_context), stage.timeout)
+            outcome["status"] = "ok" if outcome["result"] is not None else "empty"
+        except asyncio.TimeoutError:
+            outcome["status"] = "timeout"
+            logger.warning(f"Stage {stage.name} timed out after {stage.timeout}s")
+        except Exception as e:
+            outcome["status"] = "error"
+            outcome["error"] = str(e)
+            logger.error(f"Stage {stage.name} failed: {str(e)}")
+        outcome["elapsed_ms"] = (time.perf_counter() - start) * 1000
+        timings[stage.name] = {key: value for key, value in outcome.items() if key != "result"}
+        return outcome
+
+    def _critical_path(self, timings):
+        """依各階段完成時間回推關鍵路徑：從最晚完成的階段沿最晚完成的上游往回走"""
+        finished = {name: t["started_ms"] + t["elapsed_ms"] for name, t in timings.items() if "elapsed_ms" in t}
+        if not finished:
+            return []
+        path = [max(finished, key=finished.get)]
+        while True:
+            deps = [dep for dep in self.stages[path[-1]].deps if dep in finished]
+            if not deps:
+                break
+            path.append(max(deps, key=finished.get))
+        return path[::-1]
+
+    async def run(self, **context):
+        """執行全部階段，回傳 {"results", "stages", "total_ms", "sequential_ms", "critical_path"}"""
+        origin = time.perf_counter()
+        tasks, timings = {}, {}
+        for name in self.order:
+            tasks[name] = asyncio.ensure_future(self._run_stage(self.stages[name], tasks, context, timings, origin))
+        outcomes = dict(zip(self.order, await asyncio.gather(*(tasks[name] for name in self.order))))
+        total_ms = (time.perf_counter() - origin) * 1000
+        results = {name: outcome.get("result") for name, outcome in outcomes.items() if outcome["status"] == "ok"}
+        sequential_ms = sum(t.get("elapsed_ms", 0.0) for t in timings.values())
+        logger.info(f"Orchestrated {len(self.stages)} stages in {total_ms:.0f}ms (sequential sum {sequential_ms:.0f}ms), {len(results)} succeeded")
+        return {
+            "results": results,
+            "stages": {name: timings[name] for name in self.order},
+            "total_ms": total_ms,
+            "sequential_ms": sequential_ms,
+            "critical_path": self._critical_path(timings)
+        }
+
+def _sentiment_label(context):
+    sentiment = context.get("sentiment")
+    return sentiment.get("sentiment", "neutral") if isinstance(sentiment, dict) else "neutral"
+
+def build_stock_analysis(sentiment_agent=None, news_agent=None, prediction_agent=None, strategy_agent=None, report_agent=None,
+                         stock_controller=None, risk_management=None, ensemble=None, timeouts=None):
+    """組出單一股票完整分析的相依圖；未提供的元件對應階段不加入
+
+    情緒結果供預測、模型推論與策略使用；新聞、風險、價格與報告互相獨立並行執行。
+    context 需含 stock_id、date、start_date、end_date，可選 query 與 vix。
+    """
+    timeouts = timeouts or {}
+    stages = []
+
+    def add(name, func, requires=(), uses=()):
+        stages.append(Stage(name, func, requires, uses, timeouts.get(name, STAGE_TIMEOUT)))
+
+    if sentiment_agent is not None:
+        add("sentiment", lambda ctx: sentiment_agent.analyze(ctx["stock_id"], ctx["date"]))
+    if news_agent is not None:
+        add("news", lambda ctx: news_agent.search_news(ctx["stock_id"], ctx.get("query") or ctx["stock_id"], ctx["date"]) or None)
+    if risk_management is not None:
+        add("risk", lambda ctx: risk_management.calculate_risk_metrics(ctx["stock_id"], ctx["start_date"], ctx["end_date"]))
+    if report_agent is not None:
+        add("report", lambda ctx: report_agent.generate_report(ctx["stock_id"], ctx["start_date"], ctx["end_date"]))
+    if stock_controller is not None:
+        add("prices", lambda ctx: stock_controller.fetch_daily_prices(ctx["stock_id"], ctx["start_date"], ctx["end_date"]))
+
+    sentiment_uses = ("sentiment",) if sentiment_agent is not None else ()
+    if prediction_agent is not None:
+        add("prediction", lambda ctx: prediction_agent.predict(ctx["stock_id"], _sentiment_label(ctx)), uses=sentiment_uses)
+    if ensemble is not None:
+        def run_models(ctx):
+            sentiment_data = {ctx["stock_id"]: [{"date": ctx["date"], "sentiment": _sentiment_label(ctx)}]}
+            result = ensemble.run([ctx["stock_id"]], sentiment_data)
+            return result["stocks"].get(ctx["stock_id"]) if result else None
+        add("models", run_models, uses=sentiment_uses)
+
+    if strategy_agent is not None and ensemble is not None and stock_controller is not None:
+        def run_strategy(ctx):
+            scores = ctx["models"]
+            prices = ctx["prices"]
+            sentiment_score = SENTIMENT_SCORES.get(_sentiment_label(ctx), 0)
+            vix = ctx.get("vix") if ctx.get("vix") is not None else NEUTRAL_VIX
+            return strategy_agent.generate_strategy(
+                ctx["stock_id"], scores["transformer_pred"], scores["mamba_pred"], scores["drl_pred"],
+                [row["close"] for row in prices], None, sentiment_score, vix, [row["date"] for row in prices]
+            )
+        add("strategy", run_strategy, requires=("models", "prices"), uses=sentiment_uses)
+
+    return AgentOrchestrator(stages)
+
+async def analyze_stock(orchestrator, stock_id, date=None, start_date="2023-01-01", end_date=None, query=None, vix=None):
+    """以建好的 orchestrator 分析單一股票"""
+    date = date or date_cls.today().isoformat()
+    return await orchestrator.run(stock_id=stock_id, date=date, start_date=start_date, end_date=end_date or date, query=query, vix=vix)
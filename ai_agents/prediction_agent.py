@@ -1,32 +1,34 @@
 from phi.assistant import Assistant
 from phi.model.xai import xAI
-from redis import Redis
 import time
+from datetime import date
 from dotenv import load_dotenv
 import os
 import json
 import torch
-from models.transformer import train_transformer, predict_price
+from models.transformer import predict_price, predict_prices_batch
+from models.model_registry import get_model_registry
 from tools.fetch_historical import fetch_historical
 from services.technical_indicators import TechnicalIndicators
 from monitoring.logging_config import setup_logging
+from services.llm_cache import cached_run
+from services.llm_backend import get_llm_backend
+from services.agent_memory import get_agent_memory
 
 logger = setup_logging()
 load_dotenv()
 
-REDIS_HOST = "localhost"
-redis_client = Redis(host=REDIS_HOST, port=6379, db=0)
-
 XAI_API_KEY = os.getenv("XAI_API_KEY")
-if not XAI_API_KEY:
-    raise ValueError("XAI_API_KEY environment variable is not set. Please set it to use Grok.")
+
+# LLM 失敗時的預設結果只短暫保留，避免整天都回傳 0%
+FALLBACK_MEMORY_TTL = 300
 
 class PredictionToolkit():
     def __init__(self):
         super().__init__(name="prediction_tools")
         self.register(self.get_technical_indicator)
         self.register(self.fetch_historical_data)
-        self.model_cache = {}  # 緩存訓練好的模型和 scaler
+        self.model_registry = get_model_registry()  # 模型由背景訓練工作發佈，這裡只負責載入
 
     def get_technical_indicator(self, stock_id: str, indicator: str) -> float:
         try:
@@ -51,6 +53,9 @@ class PredictionAgent(Assistant):
     memory_key: str = "prediction_memory"
 
     def __init__(self):
+        # 在建構時才檢查，匯入模組或使用離線後端時不需要 API 金鑰
+        if not XAI_API_KEY and get_llm_backend().requires_api_key:
+            raise ValueError("XAI_API_KEY environment variable is not set. Please set it to use Grok.")
         toolkit = PredictionToolkit()
         super().__init__(
             name="PredictionAgent",
@@ -60,40 +65,32 @@ class PredictionAgent(Assistant):
             show_tool_calls=True
         )
 
-    def store_memory(self, data):
-        try:
-            redis_client.set(self.memory_key, json.dumps(data))
-            logger.info(f"Stored data in Redis for {self.name}: {data}")
-        except Exception as e:
-            logger.error(f"Error storing memory: {str(e)}")
+    def store_memory(self, data, stock_id=None, date=None, params=None, ttl=None):
+        """依 stock_id / date / params 分鍵寫入記憶（帶 TTL）"""
+        get_agent_memory().set(self.memory_key, data, stock_id, date, params, ttl)
 
-    def read_memory(self):
-        try:
-            data = redis_client.get(self.memory_key)
-            if data:
-                return json.loads(data)
-            return None
-        except Exception as e:
-            logger.error(f"Error reading memory: {str(e)}")
-            return None
+    def read_memory(self, stock_id=None, date=None, params=None):
+        """讀取指定股票 / 日期 / 參數的記憶；不帶參數時回傳最近一次寫入"""
+        return get_agent_memory().get(self.memory_key, stock_id, date, params)
 
     def predict(self, stock_id: str, sentiment: str):
         """預測股價，使用 Transformer 或 LLM"""
         try:
-            # 使用 Transformer 預測
-            if stock_id not in self.tools[0].model_cache:
-                model, scaler = train_transformer(stock_id)
-                if model and scaler:
-                    self.tools[0].model_cache[stock_id] = (model, scaler)
-                else:
-                    logger.warning(f"Failed to train Transformer for {stock_id}, falling back to LLM")
-                    return self.predict_with_llm(stock_id, sentiment)
-            
-            model, scaler = self.tools[0].model_cache[stock_id]
+            # 使用模型登錄中的 Transformer 預測（個股模型優先，其次全域模型），請求中不做訓練
+            model, scaler, metadata = self.tools[0].model_registry.load_for_stock("transformer", stock_id)
+            if model is None:
+                logger.warning(f"No registered Transformer for {stock_id}, falling back to LLM")
+                return self.predict_with_llm(stock_id, sentiment)
+
+            # 同一模型版本當日的預測結果可直接重用
+            today, params = date.today().isoformat(), {"model_version": metadata["data_version"]}
+            cached = self.read_memory(stock_id, today, params)
+            if cached is not None:
+                return cached
             pred_price = predict_price(model, scaler, stock_id)
             if pred_price is not None:
                 result = {"stock_id": stock_id, "predicted_price": pred_price}
-                self.store_memory(result)
+                self.store_memory(result, stock_id, today, params)
                 return result
 
             # 若 Transformer 失敗，後備使用 LLM
@@ -102,8 +99,34 @@ class PredictionAgent(Assistant):
             logger.error(f"Error predicting price with Transformer: {str(e)}")
             return self.predict_with_llm(stock_id, sentiment)
 
+    def predict_batch(self, stock_ids: list):
+        """批次預測多檔股票：同一模型的股票共用一次查詢與一次前向傳遞"""
+        registry = self.tools[0].model_registry
+        groups = {}
+        for stock_id in stock_ids:
+            model, scaler, _ = registry.load_for_stock("transformer", stock_id)
+            if model is None:
+                logger.warning(f"No registered Transformer for {stock_id}")
+                continue
+            group = groups.setdefault(id(model), (model, [], {}))
+            group[1].append(stock_id)
+            if scaler is not None:
+                group[2][stock_id] = scaler
+
+        results = {}
+        for model, group_ids, scalers in groups.values():
+            try:
+                results.update(predict_prices_batch(model, group_ids, scalers or None))
+            except Exception as e:
+                logger.error(f"Error in batch prediction: {str(e)}")
+        return [{"stock_id": stock_id, "predicted_price": price} for stock_id, price in results.items()]
+
     def predict_with_llm(self, stock_id: str, sentiment: str):
-        """使用 LLM 預測股價變化"""
+        """使用 LLM 預測股價變化；同一股票、日期與情緒的結果由記憶直接回傳"""
+        today, params = date.today().isoformat(), {"sentiment": sentiment}
+        cached = self.read_memory(stock_id, today, params)
+        if cached is not None:
+            return cached
         prompt = (
             f"Based on a sentiment of '{sentiment}' for stock ID {stock_id}, predict the next day's stock price change "
             f"as a percentage (e.g., '+5%' or '-3%'). Return ONLY a JSON string with 'stock_id' and 'predicted_change'."
@@ -111,15 +134,14 @@ class PredictionAgent(Assistant):
         max_attempts = 3
         for attempt in range(max_attempts):
             try:
-                response_generator = self.run(prompt)
-                response = "".join([chunk for chunk in response_generator if chunk is not None])
+                response = cached_run(self, prompt, validate=json.loads)
                 if response.strip() == "":
                     logger.warning(f"LLM attempt {attempt + 1}/{max_attempts} returned empty response")
                     time.sleep(2)
                     continue
                 logger.info(f"Raw LLM response: {response}")
                 result = json.loads(response)
-                self.store_memory(result)
+                self.store_memory(result, stock_id, today, params)
                 return result
             except Exception as e:
                 logger.error(f"LLM attempt {attempt + 1}/{max_attempts} error: {str(e)}")
@@ -127,7 +149,7 @@ class PredictionAgent(Assistant):
         
         logger.warning(f"No valid LLM response after {max_attempts} attempts, using default change '0%'")
         result = {"stock_id": stock_id, "predicted_change": "0%"}
-        self.store_memory(result)
+        self.store_memory(result, stock_id, today, params, ttl=FALLBACK_MEMORY_TTL)
         return result
 
 if __name__ == "__main__":
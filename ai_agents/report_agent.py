@@ -1,18 +1,18 @@
 from phi.assistant import Assistant
 from phi.tools import Toolkit
-from redis import Redis
 from api.controllers.report_controller import ReportController
 from dotenv import load_dotenv
 import json
 from monitoring.logging_config import setup_logging
+from services.llm_cache import cached_run
+from services.agent_memory import get_agent_memory, params_digest
+from datetime import date
 import os
 from phi.model.xai import xAI
 
 logger = setup_logging()
 load_dotenv()
 
-REDIS_HOST = "localhost"
-redis_client = Redis(host=REDIS_HOST, port=6379, db=0)
 XAI_API_KEY = os.getenv("XAI_API_KEY")
 
 class ReportToolkit(Toolkit):
@@ -38,27 +38,41 @@ class ReportAgent(Assistant):
             show_tool_calls=True
         )
 
-    def store_memory(self, data):
-        try:
-            redis_client.set(self.memory_key, json.dumps(data))
-            logger.info(f"Stored data in Redis for {self.name}: {data}")
-        except Exception as e:
-            logger.error(f"Error storing memory: {str(e)}")
+    def store_memory(self, data, stock_id=None, date=None, params=None, ttl=None):
+        """依 stock_id / date / params 分鍵寫入記憶（帶 TTL）"""
+        get_agent_memory().set(self.memory_key, data, stock_id, date, params, ttl)
+
+    def read_memory(self, stock_id=None, date=None, params=None):
+        """讀取指定股票 / 日期 / 參數的記憶；不帶參數時回傳最近一次寫入"""
+        return get_agent_memory().get(self.memory_key, stock_id, date, params)
 
-    def read_memory(self):
+    def generate_report(self, stock_id: str, start_date: str, end_date: str):
+        """生成強化報告；已結束區間的報告由記憶直接回傳
+
+        end_date 為今天或之後時當日資料仍在更新，先產生基礎報告並以其摘要作為記憶鍵，資料變動後不沿用舊報告。
+        """
+        params = {"start_date": start_date}
+        report = None
+        if str(end_date) >= date.today().isoformat():
+            report = self._base_report(stock_id, start_date, end_date)
+            if not report:
+                return None
+            params["report_digest"] = params_digest(report)
+        return get_agent_memory().read_through(
+            self.memory_key, lambda: self._generate_report(stock_id, start_date, end_date, report), stock_id, end_date, params
+        )
+
+    def _base_report(self, stock_id, start_date, end_date):
         try:
-            data = redis_client.get(self.memory_key)
-            if data:
-                return json.loads(data)
-            return None
+            return json.loads(self.tools[0].generate_report(stock_id, start_date, end_date))
         except Exception as e:
-            logger.error(f"Error reading memory: {str(e)}")
+            logger.error(f"Error generating base report: {str(e)}")
             return None
 
-    def generate_report(self, stock_id: str, start_date: str, end_date: str):
+    def _generate_report(self, stock_id, start_date, end_date, report=None):
         try:
-            report_json = self.tools[0].generate_report(stock_id, start_date, end_date)
-            report = json.loads(report_json)
+            if report is None:
+                report = self._base_report(stock_id, start_date, end_date)
             if not report:
                 return None
 
@@ -67,11 +81,8 @@ class ReportAgent(Assistant):
                 f"{json.dumps(report)}\n"
                 f"Add detailed insights and return a JSON string."
             )
-            response = self.run(prompt)
-            response_str = "".join([chunk for chunk in response if chunk is not None])
-            enhanced_report = json.loads(response_str)
-            self.store_memory(enhanced_report)
-            return enhanced_report
+            response_str = cached_run(self, prompt, validate=json.loads)
+            return json.loads(response_str)
         except Exception as e:
             logger.error(f"Error generating report: {str(e)}")
             return None
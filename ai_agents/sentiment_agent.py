@@ -1,13 +1,15 @@
 import json
 import pandas as pd
 from pymilvus import connections, Collection, utility
-from sentence_transformers import SentenceTransformer
 from elasticsearch import Elasticsearch
 from neo4j import GraphDatabase
 from dotenv import load_dotenv
 import os
-from redis import Redis
 from monitoring.logging_config import setup_logging
+from services.llm_cache import cached_run
+from services.agent_memory import get_agent_memory, params_digest
+from services.news_context import NewsContextBuilder, query_text, count_tokens
+from services.embedding_service import get_embedding_service
 from phi.assistant import Assistant
 from phi.tools import Toolkit
 from phi.model.xai import xAI
@@ -15,9 +17,6 @@ from phi.model.xai import xAI
 logger = setup_logging()
 load_dotenv()
 
-REDIS_HOST = "localhost"
-redis_client = Redis(host=REDIS_HOST, port=6379, db=0)
-
 MONGO_URI = f"mongodb://{os.getenv('MONGO_HOST', 'localhost')}:27017/"
 MILVUS_HOST = os.getenv("MILVUS_HOST", "localhost")
 MILVUS_PORT = "19530"
@@ -29,6 +28,8 @@ NEO4J_URI = f"neo4j://{os.getenv('NEO4J_HOST', 'localhost')}:7687"
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
 XAI_API_KEY = os.getenv("XAI_API_KEY")
+# Milvus 補充新聞佔整體新聞 token 預算的比例
+MILVUS_BUDGET_SHARE = 0.25
 
 class SentimentToolkit(Toolkit):
     def __init__(self):
@@ -39,7 +40,7 @@ class SentimentToolkit(Toolkit):
         self.register(self.get_technical_indicator)
         self.register(self.query_graphrag)
         self.register(self.search_milvus)
-        self.embedder = SentenceTransformer('sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
+        self.embedder = get_embedding_service()
         connections.connect(host=MILVUS_HOST, port=MILVUS_PORT)
 
     def search_mongodb(self, stock_id: str, date: str) -> str:
@@ -125,45 +126,74 @@ class SentimentAgent(Assistant):
             show_tool_calls=True
         )
 
-    def store_memory(self, data):
-        try:
-            redis_client.set(self.memory_key, json.dumps(data))
-            logger.info(f"Stored data in Redis for {self.name}: {data}")
-        except Exception as e:
-            logger.error(f"Error storing memory: {str(e)}")
+    def store_memory(self, data, stock_id=None, date=None, params=None, ttl=None):
+        """依 stock_id / date / params 分鍵寫入記憶（帶 TTL）"""
+        get_agent_memory().set(self.memory_key, data, stock_id, date, params, ttl)
 
-    def read_memory(self):
-        try:
-            data = redis_client.get(self.memory_key)
-            if data:
-                return json.loads(data)
-            return None
-        except Exception as e:
-            logger.error(f"Error reading memory: {str(e)}")
-            return None
+    def read_memory(self, stock_id=None, date=None, params=None):
+        """讀取指定股票 / 日期 / 參數的記憶；不帶參數時回傳最近一次寫入"""
+        return get_agent_memory().get(self.memory_key, stock_id, date, params)
+
+    def _fetch_news(self, stock_id, date):
+        """讀取當日新聞並回傳 (news, params)；params 含新聞數與內容摘要，爬蟲補進新聞後記憶鍵隨之改變"""
+        news = json.loads(self.tools[0].search_mongodb(stock_id=stock_id, date=date))
+        return news, {"news_count": len(news), "news_digest": params_digest(news)}
 
     def analyze(self, stock_id: str, date: str):
-        """分析股票情緒"""
+        """分析股票情緒；同一股票同一日且新聞未變的結果由記憶直接回傳，不再呼叫 LLM"""
+        news, params = self._fetch_news(stock_id, date)
+        return get_agent_memory().read_through(self.memory_key, lambda: self._analyze(stock_id, date, news), stock_id, date, params)
+
+    def analyze_many(self, stock_ids: list, date: str):
+        """批次分析多檔股票：以一次 pipeline 讀取記憶，只對未命中（或新聞已變動）的股票呼叫 LLM，結果再以一次 pipeline 寫回"""
+        memory = get_agent_memory()
+        inputs = {stock_id: self._fetch_news(stock_id, date) for stock_id in stock_ids}
+        cached = memory.get_many(self.memory_key, [(stock_id, date, inputs[stock_id][1]) for stock_id in stock_ids])
+        results, computed = {}, []
+        for stock_id, result in zip(stock_ids, cached):
+            if result is None:
+                news, params = inputs[stock_id]
+                result = self._analyze(stock_id, date, news)
+                if result is not None:
+                    computed.append((stock_id, date, params, result))
+            results[stock_id] = result
+        memory.set_many(self.memory_key, computed)
+        logger.info(f"Sentiment for {len(stock_ids)} stocks on {date}: {len(stock_ids) - len(computed)} from memory")
+        return results
+
+    def _analyze(self, stock_id: str, date: str, news: list = None):
         try:
-            news_json = self.tools[0].search_mongodb(stock_id=stock_id, date=date)
-            news = json.loads(news_json)
-            combined_text = " ".join([item["title"] + " " + item["content"] for item in news])
+            if news is None:
+                news = json.loads(self.tools[0].search_mongodb(stock_id=stock_id, date=date))
+
+            # 去重、排序並壓縮到 token 預算內；Milvus 查詢只用排名前面的標題，不再以全文嵌入
+            builder = NewsContextBuilder()
+            keywords = [stock_id]
+            news_budget = int(builder.budget * (1 - MILVUS_BUDGET_SHARE))
+            news_context = builder.build(news, keywords, budget=news_budget)
 
             # 使用 Milvus 搜索增強分析
-            milvus_results_json = self.tools[0].search_milvus(stock_id=stock_id, date=date, query=combined_text, sentiment_filter="positive")
+            milvus_results_json = self.tools[0].search_milvus(stock_id=stock_id, date=date, query=query_text(news_context), sentiment_filter="positive")
             milvus_news = json.loads(milvus_results_json)
-            positive_news = " ".join([item["title"] + " " + item["content"] for item in milvus_news])
+            milvus_context = builder.build(milvus_news, keywords, budget=builder.budget - news_context["tokens_after"], exclude=news_context["signatures"])
 
             prompt = (
                 f"Analyze the sentiment of the following news for stock {stock_id} on {date}:\n"
-                f"Combined News: {combined_text}\n"
-                f"Positive News from Milvus: {positive_news}\n"
+                f"Combined News: {news_context['text']}\n"
+                f"Positive News from Milvus: {milvus_context['text']}\n"
                 f"Return a JSON string with 'stock_id', 'date', 'sentiment', and 'confidence'."
             )
-            response = self.run(prompt)
-            response_str = "".join([chunk for chunk in response if chunk is not None])
+            # 壓縮前的 prompt token 數：同樣的模板加上未處理的全文
+            tokens_after = count_tokens(prompt)
+            tokens_before = (tokens_after - news_context["tokens_after"] - milvus_context["tokens_after"]
+                             + news_context["tokens_before"] + milvus_context["tokens_before"])
+            logger.info(
+                f"Sentiment prompt for {stock_id} on {date}: {news_context['items_in']} news -> {news_context['items_unique']} unique -> "
+                f"{news_context['items_packed']} packed, {milvus_context['items_packed']} from Milvus; prompt tokens {tokens_before} -> {tokens_after}"
+            )
+            response_str = cached_run(self, prompt, validate=json.loads)
             result = json.loads(response_str)
-            self.store_memory(result)
+            result["prompt_tokens"] = {"before": tokens_before, "after": tokens_after}
             return result
         except Exception as e:
             logger.error(f"Error analyzing sentiment: {str(e)}")
@@ -1,32 +1,34 @@
 from phi.assistant import Assistant
 from phi.model.xai import xAI
 from phi.tools import Toolkit
-from redis import Redis
-from services.trading_strategies import TradingStrategies
 from services.risk_management import RiskManagement
+from services.benchmark_service import get_benchmark_service
+from services import price_context
+from services.price_context import PriceContext
+from services.strategy_weights import StrategyWeightOptimizer
+from models.ensemble import hybrid_score as combine_scores, EnsemblePipeline
 from dotenv import load_dotenv
 import os
 import json
 from monitoring.logging_config import setup_logging
+from services.llm_cache import cached_run
+from services.llm_backend import get_llm_backend
+from services.agent_memory import get_agent_memory
 import pandas as pd
-import numpy as np
 import mlflow
-import yfinance as yf
 
 logger = setup_logging()
 load_dotenv()
 
-REDIS_HOST = "localhost"
-redis_client = Redis(host=REDIS_HOST, port=6379, db=0)
-
 XAI_API_KEY = os.getenv("XAI_API_KEY")
-if not XAI_API_KEY:
-    raise ValueError("XAI_API_KEY environment variable is not set.")
+
+# 權重由本地最佳化器決定；LLM 只在開啟時用於說明權重
+STRATEGY_LLM_EXPLAIN = os.getenv("STRATEGY_LLM_EXPLAIN", "false").lower() == "true"
+weight_optimizer = StrategyWeightOptimizer()
 
 class StrategyToolkit(Toolkit):
     def __init__(self):
         super().__init__(name="strategy_tools")
-        self.trading_strategies = TradingStrategies()
         self.risk_management = RiskManagement()
         self.register(self.momentum_breakout)
         self.register(self.mean_reversion)
@@ -39,69 +41,59 @@ class StrategyToolkit(Toolkit):
         self.register(self.lstm_momentum)
         self.register(self.sentiment_stat_arb)
         self.register(self.calculate_risk_metrics)
+        self.register(self.optimize_portfolio)
 
+    # 以下為 LLM 工具介面（JSON 字串輸入）；程式內呼叫請改用 evaluate_all 與共用的 PriceContext
     def momentum_breakout(self, prices: str) -> tuple:
-        prices = pd.Series(json.loads(prices))
-        return self.trading_strategies.momentum_breakout(prices)
+        return price_context.momentum_breakout(PriceContext.from_json(prices))
 
     def mean_reversion(self, prices: str) -> tuple:
-        prices = pd.Series(json.loads(prices))
-        return self.trading_strategies.mean_reversion(prices)
+        return price_context.mean_reversion(PriceContext.from_json(prices))
 
     def chaos_phase_transition(self, prices: str) -> tuple:
-        prices = pd.Series(json.loads(prices))
-        return self.trading_strategies.chaos_phase_transition(prices)
+        return price_context.chaos_phase_transition(PriceContext.from_json(prices))
 
     def llm_sentiment_trend(self, prices: str, sentiment_score: float) -> tuple:
-        prices = pd.Series(json.loads(prices))
-        return self.trading_strategies.llm_sentiment_trend(prices, sentiment_score)
+        return price_context.llm_sentiment_trend(PriceContext.from_json(prices), sentiment_score)
 
     def rlhf_volatility_arbitrage(self, prices: str) -> tuple:
-        prices = pd.Series(json.loads(prices))
-        return self.trading_strategies.rlhf_volatility_arbitrage(prices)
+        return price_context.rlhf_volatility_arbitrage(PriceContext.from_json(prices))
 
     def brownian_diffusion(self, prices: str) -> tuple:
-        prices = pd.Series(json.loads(prices))
-        return self.trading_strategies.brownian_diffusion(prices)
+        return price_context.brownian_diffusion(PriceContext.from_json(prices))
 
     def quantum_fluctuation(self, prices: str) -> tuple:
-        prices = pd.Series(json.loads(prices))
-        return self.trading_strategies.quantum_fluctuation(prices)
+        return price_context.quantum_fluctuation(PriceContext.from_json(prices))
 
     def low_risk_pair_trading(self, stock_prices: str, pair_prices: str) -> tuple:
-        stock_prices = pd.Series(json.loads(stock_prices))
-        pair_prices = pd.Series(json.loads(pair_prices))
-        return self.trading_strategies.low_risk_pair_trading(stock_prices, pair_prices)
+        return price_context.low_risk_pair_trading(PriceContext.from_json(stock_prices, pair_prices))
 
     def lstm_momentum(self, prices: str) -> tuple:
-        prices = pd.Series(json.loads(prices))
-        return self.trading_strategies.lstm_momentum(prices)
+        return price_context.lstm_momentum(PriceContext.from_json(prices))
 
     def sentiment_stat_arb(self, prices: str, sentiment_score: float) -> tuple:
-        prices = pd.Series(json.loads(prices))
-        return self.trading_strategies.sentiment_stat_arb(prices, sentiment_score)
+        return price_context.sentiment_stat_arb(PriceContext.from_json(prices), sentiment_score)
 
     def calculate_risk_metrics(self, prices: str, market_prices: str) -> dict:
-        prices = pd.Series(json.loads(prices))
-        market_prices = pd.Series(json.loads(market_prices))
-        returns = prices.pct_change().dropna()
-        market_returns = market_prices.pct_change().dropna()
-        return {
-            "VaR": self.risk_management.calculate_var(returns),
-            "Sharpe": self.risk_management.calculate_sharpe(returns),
-            "Beta": self.risk_management.calculate_beta(returns, market_returns),
-            "MaxDrawdown": self.risk_management.calculate_max_drawdown(prices),
-            "Volatility": self.risk_management.calculate_volatility(returns),
-            "CVaR": self.risk_management.calculate_cvar(returns),
-            "Sortino": self.risk_management.calculate_sortino(returns),
-            "JensenAlpha": self.risk_management.calculate_jensen_alpha(returns, market_returns),
-            "Treynor": self.risk_management.calculate_treynor(returns, market_returns)
-        }
+        return price_context.risk_metrics(PriceContext.from_json(prices, market_prices))
+
+    def evaluate_all(self, context: PriceContext, sentiment_score: float):
+        """以同一個 PriceContext 一次計算十個策略與風險指標，回傳 (signals, expected_returns, risk_metrics)"""
+        signals, expected_returns = price_context.evaluate_strategies(context, sentiment_score)
+        return signals, expected_returns, price_context.risk_metrics(context)
+
+    def optimize_portfolio(self, stock_ids: str, method: str = "erc") -> str:
+        """多檔股票倉位配置，stock_ids 以逗號分隔，method 為 erc / min_variance / mean_variance"""
+        weights = self.risk_management.calculate_portfolio_weights(stock_ids.split(","), method=method)
+        return json.dumps(weights if weights else {})
 
 class StrategyAgent(Assistant):
     memory_key: str = "strategy_memory"
 
     def __init__(self):
+        # 在建構時才檢查，匯入模組或使用離線後端時不需要 API 金鑰
+        if not XAI_API_KEY and get_llm_backend().requires_api_key:
+            raise ValueError("XAI_API_KEY environment variable is not set.")
         toolkit = StrategyToolkit()
         super().__init__(
             name="StrategyAgent",
@@ -111,77 +103,54 @@ class StrategyAgent(Assistant):
             show_tool_calls=True
         )
 
-    def store_memory(self, data):
-        try:
-            redis_client.set(self.memory_key, json.dumps(data))
-            logger.info(f"Stored data in Redis for {self.name}: {data}")
-        except Exception as e:
-            logger.error(f"Error storing memory: {str(e)}")
+    def store_memory(self, data, stock_id=None, date=None, params=None, ttl=None):
+        """依 stock_id / date / params 分鍵寫入記憶（帶 TTL）"""
+        get_agent_memory().set(self.memory_key, data, stock_id, date, params, ttl)
 
-    def read_memory(self):
-        try:
-            data = redis_client.get(self.memory_key)
-            if data:
-                return json.loads(data)
-            return None
-        except Exception as e:
-            logger.error(f"Error reading memory: {str(e)}")
-            return None
+    def read_memory(self, stock_id=None, date=None, params=None):
+        """讀取指定股票 / 日期 / 參數的記憶；不帶參數時回傳最近一次寫入"""
+        return get_agent_memory().get(self.memory_key, stock_id, date, params)
+
+    def generate_strategy(self, stock_id: str, transformer_pred: float, mamba_pred: float, drl_pred: float, prices: list, market_prices: list, sentiment_score: float, vix: float, dates: list = None, explain: bool = None):
+        """生成交易策略並計算混合評分；market_prices 為 None 時由共用的 BenchmarkService 提供（依 dates 對齊，否則取最近交易日）
 
-    def generate_strategy(self, stock_id: str, transformer_pred: float, mamba_pred: float, drl_pred: float, prices: list, market_prices: list, sentiment_score: float, vix: float):
-        """生成交易策略並計算混合評分"""
+        相同輸入（股票、日期、模型分數、價格、情緒與 VIX）的結果由記憶直接回傳，不再呼叫 LLM；
+        市場價格由 BenchmarkService 提供時，鍵中另含基準資料的最後交易日，基準更新後不會沿用舊結果。
+        """
+        params = {
+            "transformer_pred": transformer_pred, "mamba_pred": mamba_pred, "drl_pred": drl_pred, "prices": prices,
+            "market_prices": market_prices, "sentiment_score": sentiment_score, "vix": vix, "explain": explain
+        }
+        if market_prices is None:
+            params["benchmark_as_of"] = get_benchmark_service().latest_date()
+        return get_agent_memory().read_through(
+            self.memory_key,
+            lambda: self._generate_strategy(stock_id, transformer_pred, mamba_pred, drl_pred, prices, market_prices, sentiment_score, vix, dates, explain),
+            stock_id, str(dates[-1]) if dates else None, params
+        )
+
+    def _generate_strategy(self, stock_id, transformer_pred, mamba_pred, drl_pred, prices, market_prices, sentiment_score, vix, dates, explain=None):
         try:
-            prices_json = json.dumps(prices)
-            market_prices_json = json.dumps(market_prices)
-            prices_series = pd.Series(prices)
-
-            # 第一層：各子策略信號與預期收益
-            signals = {}
-            expected_returns = {}
-            signals["momentum_breakout"], expected_returns["momentum_breakout"] = self.tools[0].momentum_breakout(prices_json)
-            signals["mean_reversion"], expected_returns["mean_reversion"] = self.tools[0].mean_reversion(prices_json)
-            signals["chaos_phase_transition"], expected_returns["chaos_phase_transition"] = self.tools[0].chaos_phase_transition(prices_json)
-            signals["llm_sentiment_trend"], expected_returns["llm_sentiment_trend"] = self.tools[0].llm_sentiment_trend(prices_json, sentiment_score)
-            signals["rlhf_volatility_arbitrage"], expected_returns["rlhf_volatility_arbitrage"] = self.tools[0].rlhf_volatility_arbitrage(prices_json)
-            signals["brownian_diffusion"], expected_returns["brownian_diffusion"] = self.tools[0].brownian_diffusion(prices_json)
-            signals["quantum_fluctuation"], expected_returns["quantum_fluctuation"] = self.tools[0].quantum_fluctuation(prices_json)
-            signals["low_risk_pair_trading"], expected_returns["low_risk_pair_trading"] = self.tools[0].low_risk_pair_trading(prices_json, market_prices_json)
-            signals["lstm_momentum"], expected_returns["lstm_momentum"] = self.tools[0].lstm_momentum(prices_json)
-            signals["sentiment_stat_arb"], expected_returns["sentiment_stat_arb"] = self.tools[0].sentiment_stat_arb(prices_json, sentiment_score)
-
-            # 風險指標
-            risk_metrics = self.tools[0].calculate_risk_metrics(prices_json, market_prices_json)
-
-            # 第二層：初始權重（條件規則）
-            weights = {strategy: 1.0 for strategy in signals}
-            if vix > 20:
-                weights["rlhf_volatility_arbitrage"] *= 1.2
-                weights["quantum_fluctuation"] *= 1.2
-                weights["mean_reversion"] *= 0.8
-            if sentiment_score > 0.5:
-                weights["llm_sentiment_trend"] *= 1.3
-                weights["sentiment_stat_arb"] *= 1.3
-            elif sentiment_score < -0.5:
-                weights["llm_sentiment_trend"] *= 1.1
-                weights["sentiment_stat_arb"] *= 1.1
-
-            # AI 模型優化最終權重
-            prompt = (
-                f"Optimize weights for trading strategies based on signals, expected returns, VIX ({vix}), sentiment score ({sentiment_score}), "
-                f"and risk metrics: {json.dumps(risk_metrics)}. "
-                f"Signals: {json.dumps(signals)}, Expected Returns: {json.dumps(expected_returns)}, Initial Weights: {json.dumps(weights)}. "
-                f"Return a JSON string with optimized weights."
-            )
-            response = self.run(prompt)
-            response_str = "".join([chunk for chunk in response if chunk is not None])
-            optimized_weights = json.loads(response_str)
+            if market_prices is None:
+                benchmark = get_benchmark_service()
+                market = benchmark.market_closes_for(dates) if dates else benchmark.market_closes_tail(len(prices))
+                if market is None:
+                    logger.error(f"No market prices available for {stock_id}")
+                    return None
+                market_prices = pd.Series(market).ffill().bfill().tolist()
+            # 價格上下文每個請求只建立一次，十個策略與風險指標共用；JSON 只用於 LLM prompt
+            context = PriceContext(prices, market_prices, dates)
+            signals, expected_returns, risk_metrics = self.tools[0].evaluate_all(context, sentiment_score)
+
+            # 第二層：VIX / 情緒先驗結合近期回測績效的權重（總和與先驗相同，±0.5 門檻沿用原刻度）
+            optimized_weights, weight_diagnostics = weight_optimizer.optimize(context, sentiment_score, vix, risk_metrics)
 
             # 最終決策
             s_final = sum(optimized_weights[strategy] * signals[strategy] for strategy in signals)
             final_strategy = "buy" if s_final > 0.5 else "sell" if s_final < -0.5 else "hold"
 
             # 混合評分
-            hybrid_score = (transformer_pred * 0.3 + mamba_pred * 0.3 + drl_pred * 0.4)
+            hybrid_score = combine_scores(transformer_pred, mamba_pred, drl_pred)
 
             result = {
                 "stock_id": stock_id,
@@ -189,19 +158,19 @@ class StrategyAgent(Assistant):
                 "hybrid_score": hybrid_score,
                 "signals": signals,
                 "optimized_weights": optimized_weights,
+                "weight_method": weight_diagnostics["method"],
                 "risk_metrics": risk_metrics
             }
-            self.store_memory(result)
-
+            if STRATEGY_LLM_EXPLAIN if explain is None else explain:
+                result["explanation"] = self.explain_weights(stock_id, signals, expected_returns, optimized_weights, weight_diagnostics, risk_metrics, vix, sentiment_score)
             with mlflow.start_run(run_name=f"Strategy_{stock_id}"):
                 mlflow.log_param("stock_id", stock_id)
-                mlflow.log_metric("transformer_pred", transformer_pred)
-                mlflow.log_metric("mamba_pred", mamba_pred)
-                mlflow.log_metric("drl_pred", drl_pred)
-                mlflow.log_metric("hybrid_score", hybrid_score)
+                for name, value in (("transformer_pred", transformer_pred), ("mamba_pred", mamba_pred), ("drl_pred", drl_pred), ("hybrid_score", hybrid_score)):
+                    if value is not None:
+                        mlflow.log_metric(name, value)
                 mlflow.log_param("final_strategy", final_strategy)
                 mlflow.log_dict({"signals": signals}, "signals.json")
-                mlflow.log_dict({"weights": optimized_weights}, "weights.json")
+                mlflow.log_dict({"weights": optimized_weights, "diagnostics": weight_diagnostics}, "weights.json")
                 mlflow.log_dict({"risk_metrics": risk_metrics}, "risk_metrics.json")
 
             return result
@@ -209,6 +178,39 @@ class StrategyAgent(Assistant):
             logger.error(f"Error generating strategy: {str(e)}")
             return None
 
+    def explain_weights(self, stock_id, signals, expected_returns, weights, diagnostics, risk_metrics, vix, sentiment_score):
+        """以 LLM 說明本地最佳化器給出的權重（選用，不影響決策）"""
+        prompt = (
+            f"Explain in a short paragraph why these trading strategy weights suit stock {stock_id} given VIX ({vix}), "
+            f"sentiment score ({sentiment_score}) and risk metrics: {json.dumps(risk_metrics)}. "
+            f"Signals: {json.dumps(signals)}, Expected Returns: {json.dumps(expected_returns)}, Weights: {json.dumps(weights)}, "
+            f"Backtest Sharpe per strategy: {json.dumps(diagnostics['strategy_sharpe'])}."
+        )
+        try:
+            return cached_run(self, prompt)
+        except Exception as e:
+            logger.error(f"Error explaining strategy weights: {str(e)}")
+            return None
+
+    def generate_ensemble_strategies(self, stock_ids: list, prices: dict, sentiment_scores: dict, vix: float, sentiment_data: dict = None, market_prices: list = None, dates: dict = None):
+        """以 EnsemblePipeline 一次批次產生各股的 transformer / mamba / drl 分量，再逐股生成策略
+
+        prices、sentiment_scores、dates 皆以 stock_id 為鍵；回傳 {stock_id: 策略結果}，結果附上 model_latency_ms。
+        """
+        ensemble = EnsemblePipeline().run(stock_ids, sentiment_data)
+        if ensemble is None:
+            return {}
+        results = {}
+        for stock_id, scores in ensemble["stocks"].items():
+            result = self.generate_strategy(
+                stock_id, scores["transformer_pred"], scores["mamba_pred"], scores["drl_pred"], prices[stock_id],
+                market_prices, sentiment_scores.get(stock_id, 0.0), vix, (dates or {}).get(stock_id)
+            )
+            if result is not None:
+                result["model_latency_ms"] = ensemble["latency_ms"]
+                results[stock_id] = result
+        return results
+
 if __name__ == "__main__":
     agent = StrategyAgent()
     prices = [100, 101, 102, 103, 104]
@@ -1,10 +1,10 @@
 from pymilvus import connections, Collection, utility
-from sentence_transformers import SentenceTransformer
 from pymongo import MongoClient
 from dotenv import load_dotenv
 import os
 import pandas as pd
 from monitoring.logging_config import setup_logging
+from services.embedding_service import get_embedding_service
 
 logger = setup_logging()
 load_dotenv()
@@ -15,7 +15,7 @@ MILVUS_PORT = "19530"
 
 class NewsController:
     def __init__(self):
-        self.embedder = SentenceTransformer('sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
+        self.embedder = get_embedding_service()
         connections.connect(host=MILVUS_HOST, port=MILVUS_PORT)
 
     def search_news(self, stock_id: str, query: str, date: str = None, sentiment: str = None, tags: list = None):
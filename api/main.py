@@ -1,19 +1,14 @@
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware  # 導入 CORS 中間件
-from api.controllers.stock_controller import StockController
-from api.controllers.report_controller import ReportController
-from api.controllers.strategy_controller import StrategyController
-from api.controllers.news_controller import NewsController
-from ai_agents.sentiment_agent import SentimentAgent
-from ai_agents.strategy_agent import StrategyAgent
-from ai_agents.report_agent import ReportAgent
-from ai_agents.news_agent import NewsAgent
 from dotenv import load_dotenv
 import os
 from redis import Redis
 import json
 import asyncio
+from prometheus_client import make_asgi_app
 from monitoring.logging_config import setup_logging
+from services.component_registry import ComponentRegistry, warmup_names
+from services.embedding_service import embedding_stats
 
 logger = setup_logging()
 load_dotenv()
@@ -29,15 +24,56 @@ app.add_middleware(
     allow_headers=["*"],  # 允許所有頭部
 )
 
-# 初始化控制器與 Agent
-stock_controller = StockController()
-report_controller = ReportController()
-strategy_controller = StrategyController()
-news_controller = NewsController()
-sentiment_agent = SentimentAgent()
-strategy_agent = StrategyAgent()
-report_agent = ReportAgent()
-news_agent = NewsAgent()
+# 控制器、Agent 與模型皆延遲到第一次使用才匯入與建構（SentenceTransformer、torch、Milvus / ES / Neo4j 連線）
+components = ComponentRegistry()
+components.register("stock_controller", "api.controllers.stock_controller:StockController")
+components.register("report_controller", "api.controllers.report_controller:ReportController")
+components.register("strategy_controller", "api.controllers.strategy_controller:StrategyController")
+components.register("news_controller", "api.controllers.news_controller:NewsController")
+components.register("sentiment_agent", "ai_agents.sentiment_agent:SentimentAgent")
+components.register("strategy_agent", "ai_agents.strategy_agent:StrategyAgent")
+components.register("report_agent", "ai_agents.report_agent:ReportAgent")
+components.register("news_agent", "ai_agents.news_agent:NewsAgent")
+components.register("risk_management", "services.risk_management:RiskManagement")
+components.register("model_registry", "models.model_registry:get_model_registry")
+
+def _prediction_batcher(registry):
+    from services.inference_batcher import MicroBatcher
+    return MicroBatcher(name="price_prediction")
+
+def _ensemble(registry):
+    from models.ensemble import EnsemblePipeline
+    return EnsemblePipeline(registry.get("model_registry"))
+
+def _analysis_orchestrator(registry):
+    from ai_agents.orchestrator import build_stock_analysis
+    return build_stock_analysis(
+        sentiment_agent=registry.get("sentiment_agent"), news_agent=registry.get("news_agent"),
+        strategy_agent=registry.get("strategy_agent"), report_agent=registry.get("report_agent"),
+        stock_controller=registry.get("stock_controller"), risk_management=registry.get("risk_management"),
+        ensemble=registry.get("ensemble")
+    )
+
+components.register("prediction_batcher", _prediction_batcher)
+components.register("ensemble", _ensemble, requires=("model_registry",))
+components.register("analysis_orchestrator", _analysis_orchestrator, requires=(
+    "sentiment_agent", "news_agent", "strategy_agent", "report_agent", "stock_controller", "risk_management", "ensemble"
+))
+app.mount("/metrics", make_asgi_app())
+
+@app.on_event("startup")
+async def warm_up_components():
+    """依 COMPONENT_WARMUP 在背景預熱元件，不延遲服務啟動"""
+    names = warmup_names()
+    if names == []:
+        logger.info("Component warm-up disabled, components will initialize on first use")
+        return
+    components.warm_up(names)
+
+@app.get("/startup/report")
+async def get_startup_report():
+    """各元件的狀態與匯入 / 建構耗時"""
+    return components.report()
 
 redis_client = Redis(host=os.getenv("REDIS_HOST", "localhost"), port=6379, db=0)
 pubsub = redis_client.pubsub()
@@ -51,6 +87,7 @@ async def get_stock_data(stock_id: str, start_date: str = "2023-01-01", end_date
     if cached:
         return json.loads(cached)
     try:
+        stock_controller = await components.aget("stock_controller")
         data = stock_controller.get_stock_data(stock_id, start_date, end_date)
         if not data:
             raise HTTPException(status_code=404, detail=f"No data found for stock {stock_id}")
@@ -61,6 +98,62 @@ async def get_stock_data(stock_id: str, start_date: str = "2023-01-01", end_date
         logger.error(f"Error retrieving stock data: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def transformer_prediction_handler(model, scaler=None):
+    """微批次處理函式：同一模型的 stock_id 請求以一次查詢與一次前向傳遞預測
+
+    scaler 與模型來自同一版本（個股模型），全域模型為 None（逐股以歷史 min/max 正規化）。
+    """
+    from models.transformer import predict_prices_batch
+
+    def run(stock_ids):
+        scalers = {stock_id: scaler for stock_id in stock_ids} if scaler is not None else None
+        preds = predict_prices_batch(model, list(dict.fromkeys(stock_ids)), scalers)
+        return [preds.get(stock_id) for stock_id in stock_ids]
+    return run
+
+@app.get("/predictions/{stock_id}")
+async def get_price_prediction(stock_id: str):
+    """預測下一交易日股價；同時到達的請求由 MicroBatcher 合併為一次前向傳遞"""
+    model_registry = await components.aget("model_registry")
+    prediction_batcher = await components.aget("prediction_batcher")
+    model, scaler, metadata = await asyncio.to_thread(model_registry.load_for_stock, "transformer", stock_id)
+    if model is None:
+        raise HTTPException(status_code=404, detail=f"No registered model for stock {stock_id}")
+    # 佇列以 (模型類型, scope) 為鍵，新版本發佈時替換處理函式，不為每個版本另建佇列與執行緒
+    key = ("transformer", metadata["scope"])
+    if not prediction_batcher.has(key, metadata["data_version"]):
+        prediction_batcher.register(key, transformer_prediction_handler(model, scaler), version=metadata["data_version"])
+    try:
+        price = await prediction_batcher.submit(key, stock_id)
+    except Exception as e:
+        logger.error(f"Error predicting price for {stock_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if price is None:
+        raise HTTPException(status_code=404, detail=f"Insufficient data for stock {stock_id}")
+    return {"stock_id": stock_id, "predicted_price": price, "model_version": metadata["data_version"]}
+
+@app.get("/predictions/stats/queues")
+async def get_prediction_queue_stats():
+    """各模型微批次佇列的深度與批次大小分佈"""
+    if not components.is_ready("prediction_batcher"):
+        return {}
+    return components.get("prediction_batcher").stats()
+
+@app.get("/embeddings/stats")
+async def get_embedding_stats():
+    """共用嵌入服務的模型記憶體、批次大小與吞吐量"""
+    return embedding_stats()
+
+@app.get("/analysis/{stock_id}")
+async def get_stock_analysis(stock_id: str, date: str = None, start_date: str = "2023-01-01", end_date: str = None, query: str = None, vix: float = None):
+    """並行執行情緒、新聞、風險、模型、策略與報告各階段，回傳部分結果與各階段耗時"""
+    from ai_agents.orchestrator import analyze_stock
+    try:
+        analysis_orchestrator = await components.aget("analysis_orchestrator")
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Analysis components unavailable: {str(e)}")
+    return await analyze_stock(analysis_orchestrator, stock_id, date, start_date, end_date, query, vix)
+
 # ... 其餘路由保持不變 ...
 
 if __name__ == "__main__":
@@ -0,0 +1,209 @@
+import time
+import numpy as np
+import torch
+from dotenv import load_dotenv
+from monitoring.logging_config import setup_logging
+from models.price_store import fetch_tail_windows, stack_tail_windows, scaling_params
+from models.trading_env import sentiment_series, BUY, SELL
+from models.export import model_device
+from models.model_registry import get_model_registry
+
+logger = setup_logging()
+load_dotenv()
+
+# 混合評分權重，與 StrategyAgent.generate_strategy 共用
+HYBRID_WEIGHTS = {"transformer": 0.3, "mamba": 0.3, "drl": 0.4}
+RSI_PERIOD = 14
+
+def hybrid_score(transformer_pred, mamba_pred, drl_pred, weights=HYBRID_WEIGHTS):
+    """加權合併三個模型分數；缺少的分量（None）不計入，其餘權重重新正規化"""
+    components = {"transformer": transformer_pred, "mamba": mamba_pred, "drl": drl_pred}
+    available = {name: value for name, value in components.items() if value is not None}
+    if not available:
+        return None
+    total = sum(weights[name] for name in available)
+    return sum(weights[name] * value for name, value in available.items()) / total
+
+def window_indicators(closes, period=RSI_PERIOD):
+    """以視窗收盤價 (N, L) 向量化計算技術指標：區間報酬、日報酬波動度、平均日變動、RSI"""
+    diffs = np.diff(closes, axis=1)
+    returns = diffs / np.where(closes[:, :-1] == 0, 1.0, closes[:, :-1])
+    recent = diffs[:, -period:]
+    gains = np.clip(recent, 0, None).mean(axis=1)
+    losses = np.clip(-recent, 0, None).mean(axis=1)
+    rsi = np.where(losses == 0, 100.0, 100.0 - 100.0 / (1.0 + gains / np.where(losses == 0, 1.0, losses)))
+    return {
+        "window_return": closes[:, -1] / np.where(closes[:, 0] == 0, 1.0, closes[:, 0]) - 1.0,
+        "volatility": returns.std(axis=1),
+        "mean_abs_change": np.abs(diffs).mean(axis=1),
+        "rsi": rsi
+    }
+
+class FeatureWindow:
+    """多檔股票共用的特徵視窗：一次查詢取得尾端收盤價，對齊情緒分數並計算技術指標
+
+    各模型的輸入皆由同一份視窗切出：Transformer 用縮放後收盤價 (N, L, 1)、Mamba 加上情緒 (N, L, 2)、
+    策略網路用與 StockTradingEnv 相同的原始 [收盤價, 情緒] 狀態 (N, 2L)。
+    """
+
+    def __init__(self, stock_ids, closes, hist_min, hist_max, dates, sentiments):
+        self.stock_ids = stock_ids
+        self.closes = closes
+        self.hist_min = hist_min
+        self.hist_max = hist_max
+        self.dates = dates
+        self.sentiments = sentiments
+        self.indicators = window_indicators(closes)
+        self.positions = {stock_id: i for i, stock_id in enumerate(stock_ids)}
+
+    @classmethod
+    def fetch(cls, stock_ids, sentiment_data=None, seq_length=30):
+        """sentiment_data 為 {stock_id: [{"date", "sentiment"}, ...]}；資料不足的股票會被略過"""
+        df = fetch_tail_windows(stock_ids, seq_length)
+        if df is None or df.empty:
+            return None
+        ids, closes, hist_min, hist_max, dates = stack_tail_windows(df, seq_length)
+        if not ids:
+            return None
+        sentiments = np.vstack([sentiment_series((sentiment_data or {}).get(stock_id), stock_dates) for stock_id, stock_dates in zip(ids, dates)])
+        return cls(ids, closes, hist_min, hist_max, dates, sentiments)
+
+    def __len__(self):
+        return len(self.stock_ids)
+
+    def scaled_prices(self, rows, scalers=None):
+        ids = [self.stock_ids[i] for i in rows]
+        scale, offset = scaling_params(ids, self.hist_min[rows], self.hist_max[rows], scalers)
+        return (self.closes[rows] * scale[:, None] + offset[:, None]), scale, offset
+
+    def transformer_inputs(self, rows, scalers=None):
+        scaled, scale, offset = self.scaled_prices(rows, scalers)
+        return scaled.astype(np.float32)[:, :, None], scale, offset
+
+    def mamba_inputs(self, rows, scalers=None):
+        scaled, scale, offset = self.scaled_prices(rows, scalers)
+        return np.stack([scaled, self.sentiments[rows]], axis=-1).astype(np.float32), scale, offset
+
+    def policy_inputs(self, rows):
+        return np.concatenate([self.closes[rows], self.sentiments[rows]], axis=1).astype(np.float32)
+
+def _forward(model, X, batch_size=1024):
+    """分塊前向傳遞，回傳 numpy 輸出"""
+    device = model_device(model)
+    model.eval()
+    outputs = []
+    with torch.no_grad():
+        for start in range(0, len(X), batch_size):
+            outputs.append(model(torch.from_numpy(X[start:start + batch_size]).to(device)).cpu().numpy())
+    return np.concatenate(outputs)
+
+def _group_by_model(registry, model_type, stock_ids):
+    """依各股實際使用的模型版本（個股或全域）分組，同一模型的股票合併為一批"""
+    groups = {}
+    for row, stock_id in enumerate(stock_ids):
+        model, scaler, metadata = registry.load_for_stock(model_type, stock_id)
+        if model is None:
+            continue
+        key = (metadata["scope"], metadata["data_version"])
+        group = groups.setdefault(key, {"model": model, "rows": [], "scalers": {}})
+        group["rows"].append(row)
+        if scaler is not None:
+            group["scalers"][stock_id] = scaler
+    return groups
+
+class EnsemblePipeline:
+    """Transformer、Mamba 與 RL 策略網路的整合推論管線
+
+    每次呼叫只查詢一次資料庫建立共用特徵視窗，三個模型各自以批次推論所有股票，
+    回傳各分量、混合評分與逐模型延遲。drl_pred 以策略的買賣機率差乘上視窗平均日變動，
+    換算為與價格預測同單位的預期價格：last_close + (P(buy) - P(sell)) * mean_abs_change。
+    """
+
+    def __init__(self, registry=None, seq_length=30, weights=HYBRID_WEIGHTS, batch_size=1024):
+        self.registry = registry or get_model_registry()
+        self.seq_length = seq_length
+        self.weights = weights
+        self.batch_size = batch_size
+
+    def _predict_prices(self, model_type, window, build_inputs):
+        preds = np.full(len(window), np.nan)
+        for group in _group_by_model(self.registry, model_type, window.stock_ids).values():
+            rows = np.asarray(group["rows"])
+            X, scale, offset = build_inputs(rows, group["scalers"] or None)
+            preds[rows] = (_forward(group["model"], X, self.batch_size)[:, 0] - offset) / scale
+        return preds
+
+    def _predict_policy(self, window):
+        probs = np.full((len(window), 3), np.nan)
+        groups = _group_by_model(self.registry, "policy", window.stock_ids)
+        missing = len(window) - sum(len(group["rows"]) for group in groups.values())
+        if missing:
+            logger.warning(f"No policy model registered for {missing} of {len(window)} stocks, drl_pred is skipped in their hybrid score")
+        for group in groups.values():
+            rows = np.asarray(group["rows"])
+            probs[rows] = _forward(group["model"], window.policy_inputs(rows), self.batch_size)
+        drl = window.closes[:, -1] + (probs[:, BUY] - probs[:, SELL]) * window.indicators["mean_abs_change"]
+        return drl, probs
+
+    def run(self, stock_ids, sentiment_data=None):
+        """回傳 {"stocks": {stock_id: 各分量與混合評分}, "latency_ms": {...}, "n_stocks": N}"""
+        latency = {}
+        start = time.perf_counter()
+        window = FeatureWindow.fetch(stock_ids, sentiment_data, self.seq_length)
+        latency["features"] = (time.perf_counter() - start) * 1000
+        if window is None:
+            logger.error(f"No feature window available for {len(stock_ids)} stocks")
+            return None
+
+        components = {}
+        for name, predict in (
+            ("transformer", lambda: self._predict_prices("transformer", window, window.transformer_inputs)),
+            ("mamba", lambda: self._predict_prices("mamba", window, window.mamba_inputs)),
+            ("drl", lambda: self._predict_policy(window))
+        ):
+            model_start = time.perf_counter()
+            try:
+                components[name] = predict()
+            except Exception as e:
+                logger.error(f"Ensemble component {name} failed: {str(e)}")
+                components[name] = None
+            latency[name] = (time.perf_counter() - model_start) * 1000
+        latency["total"] = (time.perf_counter() - start) * 1000
+
+        transformer_preds = components["transformer"]
+        mamba_preds = components["mamba"]
+        drl_preds, action_probs = components["drl"] if components["drl"] is not None else (None, None)
+
+        def value(preds, i):
+            return None if preds is None or np.isnan(preds[i]) else float(preds[i])
+
+        stocks = {}
+        for i, stock_id in enumerate(window.stock_ids):
+            transformer_pred, mamba_pred, drl_pred = value(transformer_preds, i), value(mamba_preds, i), value(drl_preds, i)
+            stocks[stock_id] = {
+                "last_close": float(window.closes[i, -1]),
+                "transformer_pred": transformer_pred,
+                "mamba_pred": mamba_pred,
+                "drl_pred": drl_pred,
+                "action_probs": action_probs[i].tolist() if drl_pred is not None else None,
+                "hybrid_score": hybrid_score(transformer_pred, mamba_pred, drl_pred, self.weights),
+                "indicators": {name: float(values[i]) for name, values in window.indicators.items()}
+            }
+        logger.info(
+            f"Ensemble inference for {len(window)} stocks: features {latency['features']:.1f}ms, transformer {latency['transformer']:.1f}ms, "
+            f"mamba {latency['mamba']:.1f}ms, drl {latency['drl']:.1f}ms"
+        )
+        return {"stocks": stocks, "latency_ms": latency, "n_stocks": len(window)}
+
+def predict_ensemble(stock_ids, sentiment_data=None, registry=None, seq_length=30):
+    """批次計算多檔股票的 transformer / mamba / drl 分量與混合評分"""
+    return EnsemblePipeline(registry, seq_length).run(stock_ids, sentiment_data)
+
+if __name__ == "__main__":
+    import sys
+    stock_ids = sys.argv[1].split(",") if len(sys.argv) > 1 else ["0050"]
+    result = predict_ensemble(stock_ids)
+    if result:
+        for stock_id, entry in result["stocks"].items():
+            print(f"{stock_id}: hybrid score {entry['hybrid_score']}")
+        print(f"Latency (ms): {result['latency_ms']}")
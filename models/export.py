@@ -0,0 +1,185 @@
+import json
+import os
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from monitoring.logging_config import setup_logging
+
+logger = setup_logging()
+
+# 推論匯出格式，依序為候選優先順序（同速時取前者）
+ARTIFACT_EAGER = "eager"
+ARTIFACT_SCRIPTED = "torchscript.pt"
+ARTIFACT_QUANTIZED = "torchscript_int8.pt"
+ARTIFACT_ONNX = "model.onnx"
+# 前向傳遞含資料相依控制流程的模型：CPU Mamba 的分塊掃描依輸入的 Δ 決定區塊邊界，
+# trace 會把範例輸入的切分固定下來，實際輸入 Δ 較大時可能溢位，因此只以 eager 推論
+EAGER_ONLY_MODELS = {"mamba"}
+
+def example_input(model_type, seq_length=30, batch_size=8):
+    """各模型的範例輸入，用於 trace 與驗證"""
+    if model_type == "transformer" or model_type == "lstm":
+        return torch.randn(batch_size, seq_length, 1)
+    if model_type == "mamba":
+        return torch.randn(batch_size, seq_length, 2)
+    if model_type == "policy":
+        return torch.randn(batch_size, seq_length * 2)
+    raise ValueError(f"Unknown model type {model_type}")
+
+def validation_windows(builder, indices, limit=256):
+    """取出 SequenceBuilder 中保留的驗證視窗（最多最近 limit 個），作為匯出驗證的實際縮放輸入"""
+    indices = list(indices)[-limit:]
+    if not indices:
+        return None
+    X, _ = builder.batch(indices)
+    return torch.from_numpy(X)
+
+def model_device(model):
+    """取得模型所在裝置；量化後的模型可能沒有一般參數，預設為 CPU"""
+    for param in model.parameters():
+        return param.device
+    return torch.device("cpu")
+
+def to_torchscript(model, example):
+    """以 trace 轉為 TorchScript 並凍結，供 CPU 推論"""
+    model.eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example, check_trace=False)
+        return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+def quantize_dynamic(model):
+    """對 Linear 層做動態 int8 量化（權重 int8，啟動值於執行時量化）"""
+    model.eval()
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+def export_onnx(model, example, path):
+    """匯出 ONNX（batch 維度為動態）；未安裝 onnx 時回傳 None"""
+    try:
+        import onnx  # noqa: F401
+    except ImportError:
+        logger.warning("onnx is not installed, skipping ONNX export")
+        return None
+    model.eval()
+    torch.onnx.export(
+        model, example, path,
+        input_names=["input"], output_names=["output"],
+        dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}},
+        opset_version=17
+    )
+    return path
+
+def onnx_runner(path):
+    """以 onnxruntime 建立推論函式；未安裝時回傳 None"""
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        logger.warning("onnxruntime is not installed, skipping ONNX verification")
+        return None
+    session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+    return lambda x: torch.from_numpy(session.run(None, {"input": x.numpy()})[0])
+
+def max_abs_diff(reference, candidate, example):
+    """比較兩個推論函式在範例輸入上的最大絕對誤差"""
+    with torch.no_grad():
+        return float((reference(example) - candidate(example)).abs().max())
+
+def benchmark(run, example, warmup=5, iters=50):
+    """量測延遲（毫秒，p50 / p95）與吞吐量（samples/sec）"""
+    with torch.no_grad():
+        for _ in range(warmup):
+            run(example)
+        timings = []
+        for _ in range(iters):
+            start = time.perf_counter()
+            run(example)
+            timings.append(time.perf_counter() - start)
+    timings = np.asarray(timings)
+    return {
+        "p50_ms": float(np.percentile(timings, 50) * 1000),
+        "p95_ms": float(np.percentile(timings, 95) * 1000),
+        "samples_per_sec": float(len(example) / timings.mean())
+    }
+
+def export_model(model, model_type, out_dir, seq_length=30, quantize=True, onnx=True, atol=1e-4, quantized_rtol=1e-3, batch_size=64,
+                 validation_input=None):
+    """匯出 TorchScript / 量化 TorchScript / ONNX，驗證輸出誤差並量測延遲
+
+    寫出 out_dir 下的各格式檔案與 export_report.json，回傳報告；報告中的 best 為
+    通過誤差驗證且 p50 延遲最低的格式。validation_input 為實際縮放後的驗證視窗，未提供時以隨機輸入驗證；
+    int8 版本的容許誤差為 quantized_rtol 乘上參考輸出的範圍，且只有在實際視窗上通過驗證才可被選為 best。
+    EAGER_ONLY_MODELS 中的模型不匯出，best 固定為 eager。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    model = model.cpu().eval()
+    example = example_input(model_type, seq_length, batch_size)
+    validation = example if validation_input is None else validation_input.float().cpu()
+    with torch.no_grad():
+        reference = model(validation)
+    output_range = float(reference.max() - reference.min())
+    report = {"model_type": model_type, "batch_size": batch_size, "validated_on": "random" if validation_input is None else "windows",
+              "validation_samples": len(validation), "output_range": output_range, "artifacts": {}}
+    report["artifacts"][ARTIFACT_EAGER] = {"valid": True, "max_abs_diff": 0.0, **benchmark(model, example)}
+    if model_type in EAGER_ONLY_MODELS:
+        logger.info(f"{model_type} has data-dependent control flow, serving eager only")
+        quantize = onnx = False
+
+    candidates = []
+    if model_type not in EAGER_ONLY_MODELS:
+        try:
+            scripted = to_torchscript(model, example)
+            torch.jit.save(scripted, os.path.join(out_dir, ARTIFACT_SCRIPTED))
+            candidates.append((ARTIFACT_SCRIPTED, scripted, atol))
+        except Exception as e:
+            logger.error(f"TorchScript export failed for {model_type}: {str(e)}")
+
+    if quantize:
+        try:
+            quantized = to_torchscript(quantize_dynamic(model), example)
+            torch.jit.save(quantized, os.path.join(out_dir, ARTIFACT_QUANTIZED))
+            candidates.append((ARTIFACT_QUANTIZED, quantized, quantized_rtol * output_range if validation_input is not None else None))
+        except Exception as e:
+            logger.error(f"Quantized export failed for {model_type}: {str(e)}")
+
+    if onnx:
+        try:
+            path = export_onnx(model, example, os.path.join(out_dir, ARTIFACT_ONNX))
+            runner = onnx_runner(path) if path else None
+            if runner:
+                candidates.append((ARTIFACT_ONNX, runner, atol))
+        except Exception as e:
+            logger.error(f"ONNX export failed for {model_type}: {str(e)}")
+
+    for name, run, tolerance in candidates:
+        # tolerance 為 None 表示未以實際視窗驗證，只量測不啟用
+        diff = max_abs_diff(model, run, validation)
+        entry = {"valid": tolerance is not None and diff <= tolerance, "max_abs_diff": diff, "tolerance": tolerance}
+        entry.update(benchmark(run, example))
+        report["artifacts"][name] = entry
+        logger.info(f"{model_type} {name}: diff={diff:.2e} valid={entry['valid']} p50={entry['p50_ms']:.2f}ms {entry['samples_per_sec']:.0f} samples/sec")
+
+    valid = {name: entry for name, entry in report["artifacts"].items() if entry["valid"]}
+    report["best"] = min(valid, key=lambda name: valid[name]["p50_ms"])
+    with open(os.path.join(out_dir, "export_report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Fastest valid artifact for {model_type}: {report['best']}")
+    return report
+
+def load_artifact(path):
+    """載入匯出的推論檔案：TorchScript 回傳 ScriptModule，ONNX 回傳包裝後的可呼叫物件"""
+    if path.endswith(".onnx"):
+        runner = onnx_runner(path)
+        return OnnxModule(runner) if runner else None
+    module = torch.jit.load(path, map_location="cpu")
+    module.eval()
+    return module
+
+class OnnxModule(nn.Module):
+    """讓 onnxruntime 推論函式具備與 nn.Module 相同的呼叫介面"""
+
+    def __init__(self, runner):
+        super(OnnxModule, self).__init__()
+        self.runner = runner
+
+    def forward(self, x):
+        return self.runner(x.cpu())
@@ -0,0 +1,218 @@
+import math
+import os
+import shutil
+import tempfile
+import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import mlflow
+from monitoring.logging_config import setup_logging
+
+logger = setup_logging()
+
+# 搜尋空間：list 為離散選項，("log", low, high) 為對數均勻取樣
+TRANSFORMER_SPACE = {
+    "d_model": [32, 64, 128],
+    "n_heads": [2, 4, 8],
+    "n_layers": [1, 2, 3],
+    "dropout": [0.0, 0.1, 0.2],
+    "lr": ("log", 1e-4, 3e-3),
+    "seq_length": [20, 30, 60],
+    "batch_size": [32, 64, 128]
+}
+
+MAMBA_SPACE = {
+    "d_model": [32, 64, 128],
+    "d_state": [8, 16, 32],
+    "expand": [1, 2],
+    "dropout": [0.0, 0.1, 0.2],
+    "lr": ("log", 1e-4, 3e-3),
+    "seq_length": [20, 30, 60],
+    "batch_size": [32, 64, 128]
+}
+
+SEARCH_SPACES = {"transformer": TRANSFORMER_SPACE, "mamba": MAMBA_SPACE}
+TRAINING_KEYS = ("lr", "seq_length", "batch_size")
+
+def sample_config(space, rng):
+    """從搜尋空間隨機取樣一組超參數"""
+    config = {}
+    for name, choices in space.items():
+        if isinstance(choices, tuple) and choices[0] == "log":
+            config[name] = float(math.exp(rng.uniform(math.log(choices[1]), math.log(choices[2]))))
+        else:
+            config[name] = choices[rng.integers(len(choices))]
+            if isinstance(config[name], np.generic):
+                config[name] = config[name].item()
+    return config
+
+def split_config(model_type, config):
+    """拆成模型建構參數與訓練參數"""
+    model_config = {key: value for key, value in config.items() if key not in TRAINING_KEYS}
+    model_config["input_dim"] = 1 if model_type == "transformer" else 2
+    return model_config, {key: config[key] for key in TRAINING_KEYS}
+
+def _init_worker(threads_per_trial):
+    """限制每個 trial 的執行緒數，避免 pool 中多個行程搶佔 CPU 核心"""
+    os.environ["OMP_NUM_THREADS"] = str(threads_per_trial)
+    os.environ["MKL_NUM_THREADS"] = str(threads_per_trial)
+    import torch
+    torch.set_num_threads(threads_per_trial)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+def _run_trial(model_type, df, config, epochs, checkpoint_path, patience):
+    """在 worker 中訓練單一 trial epochs 個 epoch；checkpoint 存在時從上一個 rung 接續"""
+    import torch
+    from models.training import fit_model
+    if model_type == "transformer":
+        from models.transformer import TransformerModel as model_class, build_sequences
+    else:
+        from models.mamba_model import MambaModel as model_class, build_sequences
+
+    model_config, train_config = split_config(model_type, config)
+    builder, _ = build_sequences(df, train_config["seq_length"])
+    train_idx, val_idx = builder.split(0.8)
+    model = model_class(**model_config)
+    optimizer = torch.optim.Adam(model.parameters(), lr=train_config["lr"])
+    if os.path.exists(checkpoint_path):
+        state = torch.load(checkpoint_path, map_location="cpu")
+        model.load_state_dict(state["model"])
+        optimizer.load_state_dict(state["optimizer"])
+
+    start = time.perf_counter()
+    model, history = fit_model(
+        model, builder, train_idx, val_idx, epochs=epochs, batch_size=train_config["batch_size"],
+        lr=train_config["lr"], patience=patience, device=torch.device("cpu"), optimizer=optimizer
+    )
+    torch.save({"model": model.state_dict(), "optimizer": optimizer.state_dict()}, checkpoint_path)
+    return {
+        "val_loss": min(record["val_loss"] for record in history),
+        "epochs_run": len(history),
+        "train_time": time.perf_counter() - start,
+        "samples_per_sec": float(np.mean([record["samples_per_sec"] for record in history]))
+    }
+
+def _load_training_frame(model_type, stock_id, sentiment_data):
+    if model_type == "transformer":
+        from models.transformer import fetch_stock_data
+        return fetch_stock_data(stock_id)
+    from models.mamba_model import fetch_stock_and_sentiment_data
+    return fetch_stock_and_sentiment_data(stock_id, sentiment_data)
+
+def successive_halving(model_type, stock_id, sentiment_data=None, n_trials=27, min_epochs=2, max_epochs=18, eta=3,
+                       max_workers=None, threads_per_trial=None, patience=3, space=None, seed=42):
+    """以 successive halving 平行搜尋 Transformer / Mamba 超參數
+
+    第一輪所有 trial 各訓練 min_epochs 個 epoch，依驗證損失保留前 1/eta，存活者從檢查點接續
+    訓練到 eta 倍的 epoch 數，直到 max_epochs；被淘汰的 trial 視為 pruned。trial 在 process pool
+    中執行，每個 worker 限制 threads_per_trial 個執行緒。結果記錄到 MLflow（每個 trial 為 nested run）。
+    回傳的 model_config / train_config 可直接傳給 train_transformer / train_mamba。
+    """
+    if model_type not in SEARCH_SPACES:
+        raise ValueError(f"Unknown model type {model_type}")
+    space = space or SEARCH_SPACES[model_type]
+    df = _load_training_frame(model_type, stock_id, sentiment_data)
+    max_seq_length = max(space["seq_length"]) if isinstance(space["seq_length"], list) else space["seq_length"]
+    if df is None or len(df) < max_seq_length * 2:
+        logger.error(f"Insufficient data for hyperparameter search on {stock_id}")
+        return None
+
+    cpu_count = os.cpu_count() or 1
+    max_workers = max_workers or max(1, cpu_count // 2)
+    threads_per_trial = threads_per_trial or max(1, cpu_count // max_workers)
+    rng = np.random.default_rng(seed)
+    trials = [{"trial_id": i, "config": sample_config(space, rng), "status": "running", "epochs": 0, "rungs": []} for i in range(n_trials)]
+    checkpoint_dir = tempfile.mkdtemp(prefix=f"hpo_{model_type}_")
+
+    with mlflow.start_run(run_name=f"HPO_{model_type}_{stock_id}"):
+        mlflow.log_params({
+            "model_type": model_type, "stock_id": stock_id, "n_trials": n_trials, "min_epochs": min_epochs,
+            "max_epochs": max_epochs, "eta": eta, "max_workers": max_workers, "threads_per_trial": threads_per_trial
+        })
+        search_start = time.perf_counter()
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp.get_context("spawn"),
+                                     initializer=_init_worker, initargs=(threads_per_trial,)) as pool:
+                alive = trials
+                budget = min_epochs
+                rung = 0
+                while alive:
+                    # 每個 rung 只補足到 budget 的 epoch 數，存活者延續上一輪的權重
+                    futures = {
+                        trial["trial_id"]: pool.submit(
+                            _run_trial, model_type, df, trial["config"], budget - trial["epochs"],
+                            os.path.join(checkpoint_dir, f"trial_{trial['trial_id']}.pt"), patience
+                        )
+                        for trial in alive
+                    }
+                    for trial in alive:
+                        try:
+                            result = futures[trial["trial_id"]].result()
+                            trial["val_loss"] = result["val_loss"]
+                            trial["epochs"] = budget
+                            trial["rungs"].append({"rung": rung, "epochs": budget, **result})
+                        except Exception as e:
+                            logger.error(f"Trial {trial['trial_id']} failed: {str(e)}")
+                            trial["status"] = "failed"
+                            trial["val_loss"] = float("inf")
+
+                    ranked = sorted((t for t in alive if t["status"] == "running"), key=lambda t: t["val_loss"])
+                    logger.info(f"Rung {rung} ({budget} epochs): best val loss {ranked[0]['val_loss']:.6f}" if ranked else f"Rung {rung}: all trials failed")
+                    if budget >= max_epochs or len(ranked) <= 1:
+                        for trial in ranked:
+                            trial["status"] = "completed"
+                        break
+                    keep = max(1, len(ranked) // eta)
+                    for trial in ranked[keep:]:
+                        trial["status"] = "pruned"
+                    alive = ranked[:keep]
+                    budget = min(budget * eta, max_epochs)
+                    rung += 1
+        finally:
+            shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+        for trial in trials:
+            with mlflow.start_run(run_name=f"trial_{trial['trial_id']}", nested=True):
+                mlflow.log_params(trial["config"])
+                mlflow.set_tag("status", trial["status"])
+                for record in trial["rungs"]:
+                    mlflow.log_metric("val_loss", record["val_loss"], step=record["epochs"])
+                    mlflow.log_metric("samples_per_sec", record["samples_per_sec"], step=record["epochs"])
+                mlflow.log_metric("epochs_trained", trial["epochs"])
+
+        finished = [t for t in trials if t["status"] == "completed"]
+        if not finished:
+            logger.error(f"Hyperparameter search for {model_type}/{stock_id} produced no completed trial")
+            return None
+        best = min(finished, key=lambda t: t["val_loss"])
+        elapsed = time.perf_counter() - search_start
+        mlflow.log_params({f"best_{key}": value for key, value in best["config"].items()})
+        mlflow.log_metric("best_val_loss", best["val_loss"])
+        mlflow.log_metric("search_time", elapsed)
+        total_epochs = sum(t["epochs"] for t in trials)
+        logger.info(
+            f"Hyperparameter search for {model_type}/{stock_id} finished in {elapsed:.1f}s: "
+            f"best val loss {best['val_loss']:.6f} with {best['config']} ({total_epochs} trial-epochs, "
+            f"vs {n_trials * max_epochs} without pruning)"
+        )
+
+    model_config, train_config = split_config(model_type, best["config"])
+    return {
+        "best_config": best["config"],
+        "model_config": model_config,
+        "train_config": train_config,
+        "best_val_loss": best["val_loss"],
+        "trials": trials
+    }
+
+if __name__ == "__main__":
+    import sys
+    model_type = sys.argv[1] if len(sys.argv) > 1 else "transformer"
+    stock_id = sys.argv[2] if len(sys.argv) > 2 else "0050"
+    result = successive_halving(model_type, stock_id)
+    if result:
+        print(f"Best config for {model_type}/{stock_id}: {result['best_config']} (val loss {result['best_val_loss']:.6f})")
@@ -0,0 +1,197 @@
+import math
+import os
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from monitoring.logging_config import setup_logging
+
+logger = setup_logging()
+
+try:
+    from mamba_ssm import Mamba as CudaMamba
+except ImportError:
+    CudaMamba = None
+
+MAMBA_BACKEND = os.getenv("MAMBA_BACKEND", "auto")
+# 區塊內允許的最大對數衰減量；float32 的 exp 在約 88 溢位，保留餘裕
+LOG_DECAY_LIMIT = 30.0
+
+def _chunk_bounds(step_decay, seqlen, chunk_size, limit=LOG_DECAY_LIMIT):
+    """切分區塊：每塊長度不超過 chunk_size，且塊內（第一步之後）累積衰減不超過 limit，避免 exp 溢位"""
+    bounds, start, total = [], 0, 0.0
+    for t in range(1, seqlen):
+        if t - start >= chunk_size or total + step_decay[t] > limit:
+            bounds.append((start, t))
+            start, total = t, 0.0
+        else:
+            total += step_decay[t]
+    bounds.append((start, seqlen))
+    return bounds
+
+def _scan_chunks_autograd(bounds, delta_t, du_t, B_t, C_t, A, h, tril):
+    """訓練用：每塊配置新張量以保留計算圖"""
+    ys = []
+    for start, end in bounds:
+        # 區塊第一步直接遞推，其後各步的衰減以第一步的狀態為基準
+        first = torch.exp(delta_t[start, :, :, None] * A) * h + du_t[start, :, :, None] * B_t[start, :, None, :]
+        length = end - start - 1
+        if length > 0:
+            mask = tril[:length, :length]
+            dA = delta_t[start + 1:end, :, :, None] * A
+            P = (mask @ dA.reshape(length, -1)).view_as(dA)
+            W = torch.exp(-P) * (du_t[start + 1:end, :, :, None] * B_t[start + 1:end, :, None, :])
+            rest = torch.exp(P) * (first + (mask @ W.reshape(length, -1)).view_as(W))
+            chunk = torch.cat([first[None], rest], dim=0)
+        else:
+            chunk = first[None]
+        ys.append(torch.matmul(chunk, C_t[start:end, :, :, None])[..., 0])
+        h = chunk[-1]
+    return torch.cat(ys, dim=0), h
+
+def _scan_chunks_inplace(bounds, delta_t, du_t, B_t, C_t, A, h, tril):
+    """推論用：區塊緩衝區重複使用並以 in-place 運算避免反覆配置大張量"""
+    seqlen, batch, d_inner = delta_t.shape
+    size = tril.shape[0]
+    y = delta_t.new_empty(seqlen, batch, d_inner)
+    states = delta_t.new_empty(size, batch, d_inner, A.shape[1])
+    log_decay = torch.empty_like(states)
+    work = torch.empty_like(states)
+    for start, end in bounds:
+        first = states[0]
+        torch.mul(delta_t[start, :, :, None], A, out=first).exp_().mul_(h)
+        first.add_(du_t[start, :, :, None] * B_t[start, :, None, :])
+        length = end - start - 1
+        if length > 0:
+            rest = states[1:length + 1]
+            P = log_decay[:length]
+            W = work[:length]
+            mask = tril[:length, :length]
+            torch.mul(delta_t[start + 1:end, :, :, None], A, out=W)
+            torch.mm(mask, W.view(length, -1), out=P.view(length, -1))
+            torch.mul(du_t[start + 1:end, :, :, None], B_t[start + 1:end, :, None, :], out=rest)
+            torch.neg(P, out=W).exp_().mul_(rest)
+            torch.mm(mask, W.view(length, -1), out=rest.view(length, -1))
+            rest.add_(first).mul_(P.exp_())
+        chunk = states[:length + 1]
+        torch.matmul(chunk, C_t[start:end, :, :, None], out=y[start:end, :, :, None])
+        h.copy_(chunk[-1])
+    return y, h
+
+def chunked_selective_scan(u, delta, A, B, C, D=None, z=None, delta_bias=None, chunk_size=64, initial_state=None, return_last_state=False):
+    """純 PyTorch 的選擇性掃描（selective scan），與 mamba_ssm.selective_scan_fn 介面一致
+
+    u, delta, z: (batch, d_inner, seqlen)；A: (d_inner, d_state)；B, C: (batch, d_state, seqlen)；D: (d_inner,)
+    遞迴 h_t = exp(Δ_t A) h_{t-1} + Δ_t B_t u_t 以分塊方式計算：區塊內以對數累積衰減 P_t 改寫為
+    h_t = exp(P_t) (h_0 + Σ_s exp(-P_s) Δ_s B_s u_s)，兩次前綴和都以下三角矩陣乘法一次完成；
+    區塊邊界依衰減量動態決定以確保 exp(-P) 不溢位，區塊之間再傳遞最後狀態。
+    """
+    dtype_in = u.dtype
+    u, delta = u.float(), delta.float()
+    if delta_bias is not None:
+        delta = delta + delta_bias[..., None].float()
+    delta = F.softplus(delta)
+
+    batch, d_inner, seqlen = u.shape
+    d_state = A.shape[1]
+    A = A.float()
+    # 轉成時間軸在前 (seqlen, batch, ...)，區塊切片即為連續記憶體
+    delta_t = delta.permute(2, 0, 1).contiguous()
+    du_t = (delta * u).permute(2, 0, 1).contiguous()
+    B_t = B.float().permute(2, 0, 1).contiguous()
+    C_t = C.float().permute(2, 0, 1).contiguous()
+    step_decay = (delta.amax(dim=(0, 1)) * (-A).amax()).tolist()
+
+    h = u.new_zeros(batch, d_inner, d_state) if initial_state is None else initial_state.float()
+    bounds = _chunk_bounds(step_decay, seqlen, chunk_size)
+    size = min(chunk_size, seqlen)
+    tril = torch.tril(u.new_ones(size, size))
+    if torch.is_grad_enabled() and any(t.requires_grad for t in (u, delta, A, B, C)):
+        y, h = _scan_chunks_autograd(bounds, delta_t, du_t, B_t, C_t, A, h, tril)
+    else:
+        y, h = _scan_chunks_inplace(bounds, delta_t, du_t, B_t, C_t, A, h.clone(), tril)
+
+    y = y.permute(1, 2, 0)                                                 # (b, d, L)
+    if D is not None:
+        y = y + u * D.float()[:, None]
+    if z is not None:
+        y = y * F.silu(z.float())
+    y = y.to(dtype_in)
+    return (y, h) if return_last_state else y
+
+def selective_scan_reference(u, delta, A, B, C, D, z, delta_bias):
+    """逐時間步的參考實作，只用於驗證分塊掃描的正確性並作為效能基準"""
+    delta = F.softplus(delta + delta_bias[..., None])
+    batch, d_inner, seqlen = u.shape
+    h = u.new_zeros(batch, d_inner, A.shape[1])
+    ys = []
+    for t in range(seqlen):
+        h = torch.exp(delta[:, :, t, None] * A) * h + (delta[:, :, t] * u[:, :, t])[..., None] * B[:, None, :, t]
+        ys.append(torch.einsum("bdn,bn->bd", h, C[:, :, t]))
+    y = torch.stack(ys, dim=-1) + u * D[:, None]
+    return y * F.silu(z)
+
+class CPUMamba(nn.Module):
+    """與 mamba_ssm.Mamba 權重相容（參數名稱與形狀一致）的 CPU 實作，使用分塊掃描"""
+
+    def __init__(self, d_model, d_state=16, d_conv=4, expand=2, dt_rank="auto", dt_min=0.001, dt_max=0.1,
+                 dt_init_floor=1e-4, conv_bias=True, bias=False, chunk_size=64):
+        super(CPUMamba, self).__init__()
+        self.d_model = d_model
+        self.d_state = d_state
+        self.d_conv = d_conv
+        self.expand = expand
+        self.d_inner = int(expand * d_model)
+        self.dt_rank = math.ceil(d_model / 16) if dt_rank == "auto" else dt_rank
+        self.chunk_size = chunk_size
+
+        self.in_proj = nn.Linear(d_model, self.d_inner * 2, bias=bias)
+        self.conv1d = nn.Conv1d(self.d_inner, self.d_inner, kernel_size=d_conv, groups=self.d_inner,
+                                padding=d_conv - 1, bias=conv_bias)
+        self.act = nn.SiLU()
+        self.x_proj = nn.Linear(self.d_inner, self.dt_rank + d_state * 2, bias=False)
+        self.dt_proj = nn.Linear(self.dt_rank, self.d_inner, bias=True)
+
+        # 與 mamba_ssm 相同的初始化：dt 偏置為 [dt_min, dt_max] 對數均勻取樣後的 softplus 反函數
+        dt_init_std = self.dt_rank ** -0.5
+        nn.init.uniform_(self.dt_proj.weight, -dt_init_std, dt_init_std)
+        dt = torch.exp(torch.rand(self.d_inner) * (math.log(dt_max) - math.log(dt_min)) + math.log(dt_min)).clamp(min=dt_init_floor)
+        with torch.no_grad():
+            self.dt_proj.bias.copy_(dt + torch.log(-torch.expm1(-dt)))
+
+        A = torch.arange(1, d_state + 1, dtype=torch.float32).repeat(self.d_inner, 1)
+        self.A_log = nn.Parameter(torch.log(A))
+        self.D = nn.Parameter(torch.ones(self.d_inner))
+        self.out_proj = nn.Linear(self.d_inner, d_model, bias=bias)
+
+    def forward(self, hidden_states):
+        """hidden_states: (batch, seqlen, d_model) -> (batch, seqlen, d_model)"""
+        seqlen = hidden_states.shape[1]
+        xz = self.in_proj(hidden_states).transpose(1, 2)                   # (b, 2*d_inner, L)
+        x, z = xz.chunk(2, dim=1)
+        x = self.act(self.conv1d(x)[..., :seqlen])
+
+        x_dbl = self.x_proj(x.transpose(1, 2))                             # (b, L, dt_rank + 2n)
+        dt, B, C = torch.split(x_dbl, [self.dt_rank, self.d_state, self.d_state], dim=-1)
+        dt = (dt @ self.dt_proj.weight.t()).transpose(1, 2)                # (b, d_inner, L)，偏置於掃描中加入
+        A = -torch.exp(self.A_log.float())
+
+        y = chunked_selective_scan(
+            x, dt, A, B.transpose(1, 2), C.transpose(1, 2), self.D.float(), z=z,
+            delta_bias=self.dt_proj.bias.float(), chunk_size=self.chunk_size
+        )
+        return self.out_proj(y.transpose(1, 2))
+
+def resolve_backend(backend=MAMBA_BACKEND):
+    """auto：有 mamba_ssm 且有 CUDA 時使用 CUDA 核心，否則使用 CPU 分塊掃描"""
+    if backend == "auto":
+        return "cuda" if CudaMamba is not None and torch.cuda.is_available() else "cpu"
+    if backend == "cuda" and CudaMamba is None:
+        raise ImportError("MAMBA_BACKEND=cuda requires mamba_ssm to be installed")
+    return backend
+
+def build_mamba_block(d_model, d_state=16, d_conv=4, expand=2, backend=MAMBA_BACKEND, chunk_size=64):
+    """依後端建立 Mamba 區塊；兩種後端的 state_dict 可互相載入"""
+    backend = resolve_backend(backend)
+    if backend == "cuda":
+        return CudaMamba(d_model=d_model, d_state=d_state, d_conv=d_conv, expand=expand)
+    return CPUMamba(d_model=d_model, d_state=d_state, d_conv=d_conv, expand=expand, chunk_size=chunk_size)
@@ -3,11 +3,16 @@ import torch.nn as nn
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import MinMaxScaler
-from mamba_ssm import Mamba
+from models.mamba_backends import build_mamba_block, MAMBA_BACKEND
 import psycopg2
 from dotenv import load_dotenv
 import os
 from monitoring.logging_config import setup_logging
+from models.sequence_builder import SequenceBuilder
+from models.training import fit_model
+from models.price_store import fetch_tail_windows, stack_tail_windows, scaling_params
+from models.export import model_device, validation_windows
+from models.online_update import update_scaler, replay_indices, load_for_update, publish_if_improved
 
 logger = setup_logging()
 load_dotenv()
@@ -20,17 +25,21 @@ DB_CONFIG = {
     "password": os.getenv("DB_PASSWORD")
 }
 
+MODEL_CONFIG = {"input_dim": 2}  # 2 = price + sentiment
+
 class MambaModel(nn.Module):
-    def __init__(self, input_dim, d_model=64, d_state=16, d_conv=4, expand=2, dropout=0.1):
+    def __init__(self, input_dim, d_model=64, d_state=16, d_conv=4, expand=2, dropout=0.1, backend=MAMBA_BACKEND):
         super(MambaModel, self).__init__()
         self.input_dim = input_dim
         self.d_model = d_model
         self.embedding = nn.Linear(input_dim, d_model)
-        self.mamba = Mamba(
+        # backend: "cuda"（mamba_ssm 核心）、"cpu"（純 PyTorch 分塊掃描）或 "auto"，兩者權重互通
+        self.mamba = build_mamba_block(
             d_model=d_model,
             d_state=d_state,
             d_conv=d_conv,
-            expand=expand
+            expand=expand,
+            backend=backend
         )
         self.fc_out = nn.Linear(d_model, 1)
         self.dropout = nn.Dropout(dropout)
@@ -72,84 +81,133 @@ def fetch_stock_and_sentiment_data(stock_id, sentiment_data):
         logger.error(f"Error fetching stock data: {str(e)}")
         return None
 
-def prepare_data(df, seq_length=30):
-    """準備 Mamba 訓練數據，包含情緒分數"""
+def build_sequences(df, seq_length=30):
+    """擬合價格 scaler 並建立價格＋情緒雙通道的 SequenceBuilder"""
     scaler = MinMaxScaler()
     scaled_prices = scaler.fit_transform(df[['close']])
-    sentiment_scores = df['sentiment_score'].values.reshape(-1, 1)
-
-    X, y = [], []
-    for i in range(len(scaled_prices) - seq_length):
-        price_seq = scaled_prices[i:i + seq_length]
-        sentiment_seq = sentiment_scores[i:i + seq_length]
-        X.append(np.hstack((price_seq, sentiment_seq)))
-        y.append(scaled_prices[i + seq_length])
-    
-    X = np.array(X)
-    y = np.array(y)
+    sentiment_scores = df['sentiment_score'].values
+    # 價格與情緒兩個通道共用同一份 (T, 2) 序列，X 為其滑動視窗檢視
+    return SequenceBuilder([scaled_prices, sentiment_scores], seq_length, target=scaled_prices), scaler
+
+def prepare_data(df, seq_length=30):
+    """準備 Mamba 訓練數據，包含情緒分數"""
+    builder, scaler = build_sequences(df, seq_length)
+    X, y = builder.inputs, builder.targets
     logger.info(f"Prepared {len(X)} sequences with length {seq_length}")
     return X, y, scaler
 
-def train_mamba(stock_id, sentiment_data, epochs=50, batch_size=32, seq_length=30):
-    """訓練 Mamba 模型"""
+def train_mamba(stock_id, sentiment_data, epochs=50, batch_size=32, seq_length=30, lr=0.001, num_workers=0, accumulation_steps=1, patience=5, model_config=None):
+    """訓練 Mamba 模型（mini-batch 訓練，驗證損失不再下降時提前停止）；model_config 預設為 MODEL_CONFIG"""
     df = fetch_stock_and_sentiment_data(stock_id, sentiment_data)
     if df is None or len(df) < seq_length + 1:
         logger.error(f"Insufficient data for stock {stock_id}")
         return None, None
 
-    X, y, scaler = prepare_data(df, seq_length)
-    train_size = int(len(X) * 0.8)
-    X_train, X_test = X[:train_size], X[train_size:]
-    y_train, y_test = y[:train_size], y[train_size:]
+    builder, scaler = build_sequences(df, seq_length)
+    train_idx, val_idx = builder.split(0.8)
+    logger.info(f"Prepared {len(builder)} sequences with length {seq_length}")
 
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     logger.info(f"Using device: {device}")
 
-    model = MambaModel(input_dim=2).to(device)  # 2 = price + sentiment
-    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
-    criterion = nn.MSELoss()
-
-    X_train = torch.FloatTensor(X_train).to(device)
-    y_train = torch.FloatTensor(y_train).to(device)
-    X_test = torch.FloatTensor(X_test).to(device)
-    y_test = torch.FloatTensor(y_test).to(device)
-
-    for epoch in range(epochs):
-        model.train()
-        optimizer.zero_grad()
-        output = model(X_train)
-        loss = criterion(output, y_train)
-        loss.backward()
-        optimizer.step()
-        
-        if (epoch + 1) % 10 == 0:
-            model.eval()
-            with torch.no_grad():
-                test_output = model(X_test)
-                test_loss = criterion(test_output, y_test)
-            logger.info(f"Epoch {epoch+1}/{epochs}, Train Loss: {loss.item():.4f}, Test Loss: {test_loss.item():.4f}")
-
+    model = MambaModel(**(model_config or MODEL_CONFIG))
+    model, _ = fit_model(
+        model, builder, train_idx, val_idx,
+        epochs=epochs, batch_size=batch_size, lr=lr, num_workers=num_workers,
+        accumulation_steps=accumulation_steps, patience=patience, device=device
+    )
     return model, scaler
 
-def predict_price_with_sentiment(model, scaler, stock_id, sentiment_data, seq_length=30):
-    """預測下一個交易日的股價，考慮情緒"""
+def train_and_publish_mamba(stock_id, sentiment_data, registry=None, **train_kwargs):
+    """背景訓練工作：完整訓練個股 Mamba 模型並發佈到模型登錄"""
+    from models.model_registry import get_model_registry
+    registry = registry or get_model_registry()
     df = fetch_stock_and_sentiment_data(stock_id, sentiment_data)
-    if df is None or len(df) < seq_length:
-        logger.error(f"Insufficient data for prediction on stock {stock_id}")
+    if df is None or df.empty:
+        return None
+    model, scaler = train_mamba(stock_id, sentiment_data, **train_kwargs)
+    if model is None:
         return None
+    data_version = df["date"].iloc[-1].strftime("%Y-%m-%d")
+    seq_length = train_kwargs.get("seq_length", 30)
+    builder, _ = build_sequences(df, seq_length)
+    return registry.publish_with_exports("mamba", stock_id, data_version, model, train_kwargs.get("model_config") or MODEL_CONFIG, scaler=scaler,
+                                         seq_length=seq_length, validation_input=validation_windows(builder, builder.split(0.8)[1]))
+
+def update_mamba(stock_id, sentiment_data, registry=None, seq_length=30, recent_windows=20, val_windows=5, replay_size=256,
+                 epochs=3, batch_size=32, lr=1e-4, tolerance=0.0, seed=None):
+    """每日增量更新：從最新登錄版本以 replay buffer 微調，驗證損失未退步才發佈；尚無版本時完整訓練"""
+    from models.model_registry import get_model_registry
+    registry = registry or get_model_registry()
+
+    model, scaler, metadata = load_for_update(registry, "mamba", stock_id)
+    if model is None:
+        logger.info(f"No registered Mamba model for {stock_id}, running full training")
+        return train_and_publish_mamba(stock_id, sentiment_data, registry=registry, seq_length=seq_length)
 
-    last_sequence = df[['close', 'sentiment_score']].values[-seq_length:]
-    scaled_sequence = np.copy(last_sequence)
-    scaled_sequence[:, 0] = scaler.transform(last_sequence[:, 0].reshape(-1, 1))[:, 0]  # 只縮放 close
-    input_tensor = torch.FloatTensor(scaled_sequence).unsqueeze(0)  # [1, seq_length, 2]
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    input_tensor = input_tensor.to(device)
+    df = fetch_stock_and_sentiment_data(stock_id, sentiment_data)
+    if df is None or len(df) < seq_length + val_windows + 1:
+        logger.error(f"Insufficient data to update Mamba model for {stock_id}")
+        return None
+    data_version = df["date"].iloc[-1].strftime("%Y-%m-%d")
+    if data_version == metadata["data_version"]:
+        logger.info(f"Mamba model for {stock_id} already at {data_version}")
+        return None
+
+    # 沿用已登錄的價格 scaler，只有新價格超出原範圍時才擴展
+    scaler, _ = update_scaler(scaler, df[['close']].values)
+    scaled_prices = scaler.transform(df[['close']])
+    builder = SequenceBuilder([scaled_prices, df['sentiment_score'].values], seq_length, target=scaled_prices)
+    train_idx, val_idx = replay_indices(len(builder), recent_windows, val_windows, replay_size, np.random.default_rng(seed))
+    return publish_if_improved(
+        registry, "mamba", stock_id, data_version, model, metadata, builder, train_idx, val_idx,
+        scaler=scaler, tolerance=tolerance, seq_length=seq_length, epochs=epochs, batch_size=batch_size, lr=lr
+    )
+
+def sentiment_scores_for(sentiment_data, dates):
+    """將情緒資料（date, sentiment）對齊到指定日期，缺值補 0"""
+    if not sentiment_data:
+        return np.zeros(len(dates))
+    sentiment_df = pd.DataFrame(sentiment_data, columns=["date", "sentiment"])
+    sentiment_df["date"] = pd.to_datetime(sentiment_df["date"])
+    scores = sentiment_df.set_index("date")["sentiment"].map({"positive": 1, "neutral": 0, "negative": -1})
+    scores = scores[~scores.index.duplicated(keep="last")]
+    return scores.reindex(pd.to_datetime(dates)).fillna(0).to_numpy(dtype=np.float64)
+
+def predict_prices_with_sentiment_batch(model, stock_ids, sentiment_data=None, scalers=None, seq_length=30, batch_size=1024):
+    """批次預測多檔股票股價（考慮情緒）：一次查詢取得尾端視窗並以單一前向傳遞推論
+
+    sentiment_data 為 {stock_id: [{"date", "sentiment"}, ...]}；scalers 為 {stock_id: scaler}。
+    """
+    df = fetch_tail_windows(stock_ids, seq_length)
+    if df is None or df.empty:
+        return {}
+    ids, closes, hist_min, hist_max, dates = stack_tail_windows(df, seq_length)
+    if not ids:
+        return {}
+
+    scale, offset = scaling_params(ids, hist_min, hist_max, scalers)
+    sentiments = np.vstack([sentiment_scores_for((sentiment_data or {}).get(stock_id), stock_dates) for stock_id, stock_dates in zip(ids, dates)])
+    X = np.stack([closes * scale[:, None] + offset[:, None], sentiments], axis=-1).astype(np.float32)  # [N, seq_length, 2]
+    device = model_device(model)
 
     model.eval()
+    preds = []
     with torch.no_grad():
-        pred_scaled = model(input_tensor).cpu().numpy()
-        pred_price = scaler.inverse_transform(pred_scaled)[0][0]
-    
+        for start in range(0, len(X), batch_size):
+            batch = torch.from_numpy(X[start:start + batch_size]).to(device)
+            preds.append(model(batch).cpu().numpy()[:, 0])
+    pred_prices = (np.concatenate(preds) - offset) / scale
+    logger.info(f"Predicted prices with sentiment for {len(ids)} stocks in one batch")
+    return {stock_id: float(price) for stock_id, price in zip(ids, pred_prices)}
+
+def predict_price_with_sentiment(model, scaler, stock_id, sentiment_data, seq_length=30):
+    """預測下一個交易日的股價，考慮情緒"""
+    preds = predict_prices_with_sentiment_batch(model, [stock_id], {stock_id: sentiment_data}, {stock_id: scaler}, seq_length)
+    if stock_id not in preds:
+        logger.error(f"Insufficient data for prediction on stock {stock_id}")
+        return None
+    pred_price = preds[stock_id]
     logger.info(f"Predicted price for {stock_id} with sentiment: {pred_price:.2f}")
     return pred_price
 
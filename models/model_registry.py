@@ -0,0 +1,228 @@
+import importlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import torch
+from sklearn.preprocessing import MinMaxScaler
+from dotenv import load_dotenv
+from monitoring.logging_config import setup_logging
+from models.export import export_model, load_artifact, ARTIFACT_EAGER, EAGER_ONLY_MODELS
+
+logger = setup_logging()
+load_dotenv()
+
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "model_registry")
+MODEL_CACHE_SIZE = int(os.getenv("MODEL_CACHE_SIZE", 32))
+GLOBAL_SCOPE = "global"
+
+# 模型類別以字串延遲匯入，避免載入 registry 時就引入 mamba_ssm 等重型依賴
+MODEL_CLASSES = {
+    "transformer": "models.transformer:TransformerModel",
+    "mamba": "models.mamba_model:MambaModel",
+    "policy": "models.rlhf_strategy:SimplePolicy",
+    "sentiment_head": "models.sentiment_classifier:SentimentHead"
+}
+
+SCALER_FIELDS = ["data_min_", "data_max_", "data_range_", "scale_", "min_"]
+
+def scaler_to_dict(scaler):
+    """將 MinMaxScaler 參數轉為可 JSON 序列化的 dict"""
+    params = {field: getattr(scaler, field).tolist() for field in SCALER_FIELDS}
+    params["feature_range"] = list(scaler.feature_range)
+    params["n_features_in_"] = int(scaler.n_features_in_)
+    params["n_samples_seen_"] = int(scaler.n_samples_seen_)
+    return params
+
+def scaler_from_dict(params):
+    """由 dict 重建已擬合的 MinMaxScaler"""
+    scaler = MinMaxScaler(feature_range=tuple(params["feature_range"]))
+    for field in SCALER_FIELDS:
+        setattr(scaler, field, np.asarray(params[field], dtype=np.float64))
+    scaler.n_features_in_ = params["n_features_in_"]
+    scaler.n_samples_seen_ = params["n_samples_seen_"]
+    return scaler
+
+def _resolve_class(model_type):
+    module_name, class_name = MODEL_CLASSES[model_type].split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+class ModelRegistry:
+    """磁碟上的模型登錄：以 (模型類型, 股票或 global, 資料版本) 儲存權重、scaler 與中繼資料
+
+    目錄結構為 {root}/{model_type}/{scope}/{data_version}/，發佈時先寫入暫存目錄再以 rename
+    原子替換，LATEST 指標檔同樣原子更新；載入時以 mmap 讀取權重，並以 LRU 限制常駐模型數量。
+    """
+
+    def __init__(self, root=MODEL_REGISTRY_DIR, cache_size=MODEL_CACHE_SIZE):
+        self.root = root
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _scope_dir(self, model_type, scope):
+        return os.path.join(self.root, model_type, scope)
+
+    def _version_dir(self, model_type, scope, data_version):
+        return os.path.join(self._scope_dir(model_type, scope), data_version)
+
+    @staticmethod
+    def _write_atomic(path, content):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def publish(self, model_type, scope, data_version, model, model_config, scaler=None, metadata=None, artifacts=None):
+        """原子發佈新版本並更新 LATEST 指標；artifacts 為 {檔名: 來源路徑} 的額外檔案"""
+        scope_dir = self._scope_dir(model_type, scope)
+        os.makedirs(scope_dir, exist_ok=True)
+        staging = os.path.join(scope_dir, f".staging-{uuid.uuid4().hex}")
+        os.makedirs(staging)
+        try:
+            torch.save(model.state_dict(), os.path.join(staging, "weights.pt"))
+            if scaler is not None:
+                with open(os.path.join(staging, "scaler.json"), "w", encoding="utf-8") as f:
+                    json.dump(scaler_to_dict(scaler), f)
+            for name, source in (artifacts or {}).items():
+                shutil.copyfile(source, os.path.join(staging, name))
+            meta = {
+                "model_type": model_type,
+                "scope": scope,
+                "data_version": data_version,
+                "model_config": model_config,
+                "created_at": pd.Timestamp.now().isoformat(),
+                **(metadata or {})
+            }
+            with open(os.path.join(staging, "metadata.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+
+            target = self._version_dir(model_type, scope, data_version)
+            if os.path.exists(target):
+                retired = os.path.join(scope_dir, f".retired-{uuid.uuid4().hex}")
+                os.replace(target, retired)
+                os.replace(staging, target)
+                shutil.rmtree(retired, ignore_errors=True)
+            else:
+                os.replace(staging, target)
+            self._write_atomic(os.path.join(scope_dir, "LATEST"), data_version)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        with self._lock:
+            for key in [k for k in self._cache if k[:2] == (model_type, scope)]:
+                del self._cache[key]
+        logger.info(f"Published {model_type}/{scope}@{data_version} to model registry")
+        return target
+
+    def publish_with_exports(self, model_type, scope, data_version, model, model_config, scaler=None, metadata=None, seq_length=30,
+                             validation_input=None):
+        """匯出 TorchScript / int8 / ONNX 並以 validation_input（實際縮放視窗）驗證後，連同權重一起原子發佈"""
+        with tempfile.TemporaryDirectory() as export_dir:
+            try:
+                report = export_model(model, model_type, export_dir, seq_length=seq_length, validation_input=validation_input)
+            except Exception as e:
+                logger.error(f"Export failed for {model_type}/{scope}, publishing eager weights only: {str(e)}")
+                report = {"best": ARTIFACT_EAGER, "artifacts": {}}
+            artifacts = {
+                name: os.path.join(export_dir, name)
+                for name in list(report["artifacts"]) + ["export_report.json"]
+                if os.path.exists(os.path.join(export_dir, name))
+            }
+            meta = {**(metadata or {}), "best_artifact": report["best"]}
+            return self.publish(model_type, scope, data_version, model, model_config, scaler=scaler, metadata=meta, artifacts=artifacts)
+
+    def latest_version(self, model_type, scope):
+        """回傳最新版本號，不存在時回傳 None"""
+        try:
+            with open(os.path.join(self._scope_dir(model_type, scope), "LATEST"), encoding="utf-8") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def read_metadata(self, model_type, scope, data_version=None):
+        data_version = data_version or self.latest_version(model_type, scope)
+        if data_version is None:
+            return None
+        with open(os.path.join(self._version_dir(model_type, scope, data_version), "metadata.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def artifact_path(self, model_type, scope, name, data_version=None):
+        """回傳版本目錄下額外檔案的路徑"""
+        data_version = data_version or self.latest_version(model_type, scope)
+        if data_version is None:
+            return None
+        return os.path.join(self._version_dir(model_type, scope, data_version), name)
+
+    def load(self, model_type, scope=GLOBAL_SCOPE, data_version=None, prefer_optimized=True):
+        """載入模型，回傳 (model, scaler, metadata)；不存在時回傳 (None, None, None)
+
+        prefer_optimized 為 True 時載入發佈時驗證過且最快的匯出格式（TorchScript / int8 / ONNX）。
+        """
+        data_version = data_version or self.latest_version(model_type, scope)
+        if data_version is None:
+            return None, None, None
+        key = (model_type, scope, data_version, prefer_optimized)
+
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        version_dir = self._version_dir(model_type, scope, data_version)
+        try:
+            with open(os.path.join(version_dir, "metadata.json"), encoding="utf-8") as f:
+                metadata = json.load(f)
+            model = None
+            best = metadata.get("best_artifact", ARTIFACT_EAGER)
+            # 先前發佈的 Mamba 版本可能帶有 trace 匯出檔，一律改以 eager 載入
+            if prefer_optimized and model_type not in EAGER_ONLY_MODELS and best != ARTIFACT_EAGER and os.path.exists(os.path.join(version_dir, best)):
+                model = load_artifact(os.path.join(version_dir, best))
+            if model is None:
+                model = _resolve_class(model_type)(**metadata["model_config"])
+                state = torch.load(os.path.join(version_dir, "weights.pt"), map_location="cpu", mmap=True, weights_only=True)
+                model.load_state_dict(state, assign=True)
+                model.eval()
+
+            scaler = None
+            scaler_path = os.path.join(version_dir, "scaler.json")
+            if os.path.exists(scaler_path):
+                with open(scaler_path, encoding="utf-8") as f:
+                    scaler = scaler_from_dict(json.load(f))
+        except Exception as e:
+            logger.error(f"Error loading {model_type}/{scope}@{data_version}: {str(e)}")
+            return None, None, None
+
+        entry = (model, scaler, metadata)
+        with self._lock:
+            self._cache[key] = entry
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                evicted, _ = self._cache.popitem(last=False)
+                logger.info(f"Evicted {evicted} from model cache")
+        return entry
+
+    def load_for_stock(self, model_type, stock_id):
+        """優先載入個股模型，否則退回全域模型"""
+        model, scaler, metadata = self.load(model_type, stock_id)
+        if model is None:
+            model, scaler, metadata = self.load(model_type, GLOBAL_SCOPE)
+        return model, scaler, metadata
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_model_registry():
+    """取得行程內共用的 ModelRegistry"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry()
+    return _registry
@@ -0,0 +1,86 @@
+import copy
+import numpy as np
+import torch
+import torch.nn as nn
+from monitoring.logging_config import setup_logging
+from models.training import fit_model, make_loader, evaluate
+from models.export import validation_windows
+
+logger = setup_logging()
+
+def update_scaler(scaler, values):
+    """保持 scaler 穩定：新資料落在既有範圍內時沿用原參數，超出時以 partial_fit 擴展範圍
+
+    回傳 (scaler, changed)；不修改傳入的 scaler（登錄快取中的物件可能正被推論共用）。
+    """
+    values = np.asarray(values, dtype=np.float64).reshape(-1, scaler.n_features_in_)
+    if np.all(values.min(axis=0) >= scaler.data_min_) and np.all(values.max(axis=0) <= scaler.data_max_):
+        return scaler, False
+    updated = copy.deepcopy(scaler)
+    updated.partial_fit(values)
+    logger.info(f"Scaler range extended from [{scaler.data_min_[0]:.2f}, {scaler.data_max_[0]:.2f}] to [{updated.data_min_[0]:.2f}, {updated.data_max_[0]:.2f}]")
+    return updated, True
+
+def replay_indices(n_windows, recent_windows=20, val_windows=5, replay_size=256, rng=None):
+    """切出增量微調的索引：最後 val_windows 個視窗為驗證集，其前 recent_windows 個最新視窗
+    全部納入訓練，再從更早的歷史隨機抽 replay_size 個視窗混入，避免只擬合近期而遺忘舊型態"""
+    rng = rng or np.random.default_rng()
+    val_start = max(n_windows - val_windows, 0)
+    recent_start = max(val_start - recent_windows, 0)
+    older = np.arange(recent_start)
+    if len(older) > replay_size:
+        older = np.sort(rng.choice(older, replay_size, replace=False))
+    train_idx = np.concatenate([older, np.arange(recent_start, val_start)])
+    return train_idx, np.arange(val_start, n_windows)
+
+def load_for_update(registry, model_type, scope):
+    """載入最新登錄版本的 eager 模型供微調，不存在時回傳 (None, None, None)"""
+    model, scaler, metadata = registry.load(model_type, scope, prefer_optimized=False)
+    if model is None:
+        return None, None, None
+    # 登錄快取中的模型正被推論共用，微調前先複製
+    return copy.deepcopy(model), scaler, metadata
+
+def fine_tune(model, builder, train_idx, val_idx, epochs=3, batch_size=32, lr=1e-4, patience=2, device=None):
+    """以小學習率微調並回傳 (model, baseline_loss, candidate_loss)，兩個損失在同一驗證集上計算"""
+    device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    criterion = nn.MSELoss()
+    model = model.to(device)
+    val_loader = make_loader(builder, val_idx, batch_size)
+    baseline_loss = evaluate(model, val_loader, criterion, device)
+    for param in model.parameters():
+        param.requires_grad_(True)
+    model, _ = fit_model(model, builder, train_idx, val_idx, epochs=epochs, batch_size=batch_size, lr=lr,
+                         patience=patience, device=device)
+    candidate_loss = evaluate(model, val_loader, criterion, device)
+    return model.eval(), baseline_loss, candidate_loss
+
+def publish_if_improved(registry, model_type, scope, data_version, model, metadata, builder, train_idx, val_idx,
+                        scaler=None, tolerance=0.0, seq_length=30, **fine_tune_kwargs):
+    """微調後驗證損失未退步（容許 tolerance 比例）才發佈新版本；回傳發佈路徑，未發佈時回傳 None"""
+    if len(train_idx) == 0 or len(val_idx) == 0:
+        logger.warning(f"Not enough windows to update {model_type}/{scope}")
+        return None
+    model, baseline_loss, candidate_loss = fine_tune(model, builder, train_idx, val_idx, **fine_tune_kwargs)
+    parent_version = metadata["data_version"]
+    if candidate_loss > baseline_loss * (1 + tolerance):
+        logger.warning(
+            f"Rejected incremental update of {model_type}/{scope}: val loss {candidate_loss:.6f} "
+            f"regressed from {baseline_loss:.6f}, keeping {parent_version}"
+        )
+        return None
+    logger.info(f"Incremental update of {model_type}/{scope}: val loss {baseline_loss:.6f} -> {candidate_loss:.6f}")
+    update_meta = {
+        key: value for key, value in metadata.items()
+        if key not in ("model_type", "scope", "data_version", "model_config", "created_at", "best_artifact")
+    }
+    update_meta.update({
+        "update": "incremental",
+        "parent_version": parent_version,
+        "baseline_val_loss": baseline_loss,
+        "val_loss": candidate_loss,
+        "train_windows": int(len(train_idx))
+    })
+    return registry.publish_with_exports(model_type, scope, data_version, model, metadata["model_config"],
+                                         scaler=scaler, metadata=update_meta, seq_length=seq_length,
+                                         validation_input=validation_windows(builder, val_idx))
@@ -0,0 +1,298 @@
+import os
+import time
+import multiprocessing as mp
+import numpy as np
+import torch
+import torch.nn as nn
+import mlflow
+from torch.distributions import Categorical
+from monitoring.logging_config import setup_logging
+from models.trading_env import VectorStockTradingEnv
+from models.rlhf_strategy import SimplePolicy
+
+logger = setup_logging()
+
+class ValueNetwork(nn.Module):
+    """PPO / A2C 的 critic，結構與 SimplePolicy 相同但輸出狀態價值"""
+
+    def __init__(self, input_dim, hidden_dim=64):
+        super(ValueNetwork, self).__init__()
+        self.fc1 = nn.Linear(input_dim, hidden_dim)
+        self.fc2 = nn.Linear(hidden_dim, hidden_dim)
+        self.fc3 = nn.Linear(hidden_dim, 1)
+
+    def forward(self, x):
+        x = torch.relu(self.fc1(x))
+        x = torch.relu(self.fc2(x))
+        return self.fc3(x).squeeze(-1)
+
+def action_distribution(policy, obs):
+    """SimplePolicy 輸出 softmax 機率，取 log 前先截斷避免機率下溢為 0"""
+    return Categorical(logits=torch.log(policy(obs).clamp_min(1e-8)))
+
+class RolloutRunner:
+    """持有一組向量化環境，以目前策略收集固定步數的軌跡，並追蹤已完成回合的總報酬"""
+
+    def __init__(self, env_kwargs, seed=0):
+        torch.manual_seed(seed)
+        self.env = VectorStockTradingEnv(seed=seed, **env_kwargs)
+        self.policy = SimplePolicy(self.env.observation_dim)
+        self.obs = self.env.reset()
+        self.episode_returns = np.zeros(self.env.n_envs)
+
+    def collect(self, state_dict, steps):
+        self.policy.load_state_dict(state_dict)
+        n_envs, obs_dim = self.env.n_envs, self.env.observation_dim
+        batch = {
+            "obs": np.empty((steps, n_envs, obs_dim), dtype=np.float32),
+            "actions": np.empty((steps, n_envs), dtype=np.int64),
+            "log_probs": np.empty((steps, n_envs), dtype=np.float32),
+            "rewards": np.empty((steps, n_envs), dtype=np.float32),
+            "dones": np.empty((steps, n_envs), dtype=bool)
+        }
+        finished = []
+        with torch.no_grad():
+            for t in range(steps):
+                dist = action_distribution(self.policy, torch.from_numpy(self.obs))
+                actions = dist.sample()
+                batch["obs"][t] = self.obs
+                batch["actions"][t] = actions.numpy()
+                batch["log_probs"][t] = dist.log_prob(actions).numpy()
+                self.obs, rewards, dones = self.env.step(batch["actions"][t])
+                batch["rewards"][t] = rewards
+                batch["dones"][t] = dones
+                self.episode_returns += rewards
+                if dones.any():
+                    finished.extend(self.episode_returns[dones].tolist())
+                    self.episode_returns[dones] = 0.0
+        batch["last_obs"] = self.obs.copy()
+        batch["episode_returns"] = finished
+        return batch
+
+def _rollout_worker(conn, env_kwargs, seed):
+    """子行程：每次收到最新策略權重就收集一段軌跡回傳"""
+    torch.set_num_threads(1)
+    runner = RolloutRunner(env_kwargs, seed)
+    while True:
+        message = conn.recv()
+        if message[0] == "close":
+            break
+        _, state_dict, steps = message
+        conn.send(runner.collect(state_dict, steps))
+    conn.close()
+
+def _save_atomic(obj, path):
+    tmp_path = f"{path}.tmp"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+class PPOTrainer:
+    """SimplePolicy 的輕量 PPO / A2C 訓練器，不依賴 Ray / OpenRLHF
+
+    軌跡由 num_workers 個子行程（各自持有 envs_per_worker 個向量化環境）平行收集，
+    num_workers=0 時在本行程收集；價值估計與參數更新在主行程批次完成。
+    輸出的 actor_final.pth 為 SimplePolicy 的 state_dict，可直接交給 predict_action 使用。
+    """
+
+    def __init__(self, closes, sentiments=None, seq_length=30, algorithm="ppo", num_workers=0, envs_per_worker=64,
+                 rollout_steps=128, lr=3e-4, gamma=0.99, gae_lambda=0.95, clip_range=0.2, update_epochs=4,
+                 minibatch_size=1024, value_coef=0.5, entropy_coef=0.01, max_grad_norm=0.5,
+                 checkpoint_dir="checkpoint/rlhf", seed=42):
+        if algorithm not in ("ppo", "a2c"):
+            raise ValueError(f"Unknown algorithm {algorithm}")
+        self.algorithm = algorithm
+        self.num_workers = num_workers
+        self.rollout_steps = rollout_steps
+        self.gamma = gamma
+        self.gae_lambda = gae_lambda
+        self.clip_range = clip_range
+        # A2C：每批軌跡只做一次全批次更新、不做比例截斷
+        self.update_epochs = update_epochs if algorithm == "ppo" else 1
+        self.minibatch_size = minibatch_size
+        self.value_coef = value_coef
+        self.entropy_coef = entropy_coef
+        self.max_grad_norm = max_grad_norm
+        self.checkpoint_dir = checkpoint_dir
+        self.iteration = 0
+
+        torch.manual_seed(seed)
+        self.input_dim = seq_length * 2
+        self.policy = SimplePolicy(self.input_dim)
+        self.value = ValueNetwork(self.input_dim)
+        self.optimizer = torch.optim.Adam(list(self.policy.parameters()) + list(self.value.parameters()), lr=lr)
+
+        env_kwargs = {
+            "closes": closes, "sentiments": sentiments, "n_envs": envs_per_worker,
+            "seq_length": seq_length, "random_starts": True
+        }
+        self.runners, self.workers, self.pipes = [], [], []
+        if num_workers > 0:
+            ctx = mp.get_context("spawn")
+            for worker_id in range(num_workers):
+                parent_conn, child_conn = ctx.Pipe()
+                process = ctx.Process(target=_rollout_worker, args=(child_conn, env_kwargs, seed + worker_id + 1), daemon=True)
+                process.start()
+                # 父行程不保留子端，worker 異常結束時 recv 才能收到 EOF
+                child_conn.close()
+                self.workers.append(process)
+                self.pipes.append(parent_conn)
+        else:
+            self.runners.append(RolloutRunner(env_kwargs, seed + 1))
+
+    def collect(self):
+        """廣播最新策略權重並收集所有 worker 的軌跡，依環境維度串接"""
+        state_dict = {k: v.detach().clone() for k, v in self.policy.state_dict().items()}
+        if self.pipes:
+            for conn in self.pipes:
+                conn.send(("collect", state_dict, self.rollout_steps))
+            batches = [self._receive(conn, process) for conn, process in zip(self.pipes, self.workers)]
+        else:
+            batches = [runner.collect(state_dict, self.rollout_steps) for runner in self.runners]
+        merged = {key: np.concatenate([b[key] for b in batches], axis=1) for key in ("obs", "actions", "log_probs", "rewards", "dones")}
+        merged["last_obs"] = np.concatenate([b["last_obs"] for b in batches], axis=0)
+        merged["episode_returns"] = [r for b in batches for r in b["episode_returns"]]
+        return merged
+
+    @staticmethod
+    def _receive(conn, process, poll_interval=1.0):
+        while not conn.poll(poll_interval):
+            if not process.is_alive():
+                raise RuntimeError(f"Rollout worker {process.name} exited with code {process.exitcode}")
+        return conn.recv()
+
+    def compute_advantages(self, batch):
+        """以 GAE(λ) 計算優勢與回報；回合結束（含自動重置）處不向後自舉"""
+        steps, n_envs = batch["rewards"].shape
+        with torch.no_grad():
+            values = self.value(torch.from_numpy(batch["obs"].reshape(steps * n_envs, -1))).view(steps, n_envs).numpy()
+            next_value = self.value(torch.from_numpy(batch["last_obs"])).numpy()
+        advantages = np.zeros((steps, n_envs), dtype=np.float32)
+        last_gae = np.zeros(n_envs, dtype=np.float32)
+        for t in reversed(range(steps)):
+            not_done = 1.0 - batch["dones"][t]
+            delta = batch["rewards"][t] + self.gamma * next_value * not_done - values[t]
+            last_gae = delta + self.gamma * self.gae_lambda * not_done * last_gae
+            advantages[t] = last_gae
+            next_value = values[t]
+        return advantages, advantages + values
+
+    def update(self, batch, advantages, returns):
+        """PPO 截斷目標（A2C 為一般策略梯度）加上價值損失與熵正則，回傳平均損失"""
+        obs = torch.from_numpy(batch["obs"].reshape(-1, self.input_dim))
+        actions = torch.from_numpy(batch["actions"].reshape(-1))
+        old_log_probs = torch.from_numpy(batch["log_probs"].reshape(-1))
+        advantages = torch.from_numpy(advantages.reshape(-1))
+        advantages = (advantages - advantages.mean()) / (advantages.std() + 1e-8)
+        returns = torch.from_numpy(returns.reshape(-1))
+        params = list(self.policy.parameters()) + list(self.value.parameters())
+
+        minibatch_size = len(obs) if self.algorithm == "a2c" else self.minibatch_size
+        stats = {"policy_loss": 0.0, "value_loss": 0.0, "entropy": 0.0}
+        n_updates = 0
+        for _ in range(self.update_epochs):
+            for idx in torch.randperm(len(obs)).split(minibatch_size):
+                dist = action_distribution(self.policy, obs[idx])
+                log_probs = dist.log_prob(actions[idx])
+                entropy = dist.entropy().mean()
+                if self.algorithm == "ppo":
+                    ratio = torch.exp(log_probs - old_log_probs[idx])
+                    clipped = torch.clamp(ratio, 1 - self.clip_range, 1 + self.clip_range)
+                    policy_loss = -torch.min(ratio * advantages[idx], clipped * advantages[idx]).mean()
+                else:
+                    policy_loss = -(log_probs * advantages[idx]).mean()
+                value_loss = nn.functional.mse_loss(self.value(obs[idx]), returns[idx])
+                loss = policy_loss + self.value_coef * value_loss - self.entropy_coef * entropy
+
+                self.optimizer.zero_grad()
+                loss.backward()
+                nn.utils.clip_grad_norm_(params, self.max_grad_norm)
+                self.optimizer.step()
+                stats["policy_loss"] += policy_loss.item()
+                stats["value_loss"] += value_loss.item()
+                stats["entropy"] += entropy.item()
+                n_updates += 1
+        return {key: value / max(n_updates, 1) for key, value in stats.items()}
+
+    def save_checkpoint(self, completed=False):
+        """寫出可續訓的完整狀態與 predict_action 可直接載入的 actor_final.pth；completed 標記訓練已跑完"""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        _save_atomic({
+            "iteration": self.iteration,
+            "completed": completed,
+            "algorithm": self.algorithm,
+            "input_dim": self.input_dim,
+            "policy": self.policy.state_dict(),
+            "value": self.value.state_dict(),
+            "optimizer": self.optimizer.state_dict()
+        }, os.path.join(self.checkpoint_dir, "trainer_state.pt"))
+        _save_atomic(self.policy.state_dict(), os.path.join(self.checkpoint_dir, "actor_final.pth"))
+
+    def load_checkpoint(self, iterations=None):
+        """從 checkpoint_dir 續訓中斷的訓練；不存在、已完成或已達 iterations 時不載入並回傳 False"""
+        path = os.path.join(self.checkpoint_dir, "trainer_state.pt")
+        if not os.path.exists(path):
+            return False
+        state = torch.load(path, map_location="cpu")
+        if state.get("completed") or (iterations is not None and state["iteration"] >= iterations):
+            logger.info(f"Checkpoint {path} is from a finished run, starting fresh {self.algorithm} training")
+            return False
+        self.policy.load_state_dict(state["policy"])
+        self.value.load_state_dict(state["value"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        self.iteration = state["iteration"]
+        logger.info(f"Resumed {self.algorithm} training from iteration {self.iteration}")
+        return True
+
+    def train(self, iterations=100, checkpoint_every=10, log_every=1):
+        """執行 iterations 次「收集 → 更新」，並將吞吐量、報酬與損失記錄到 MLflow（若有進行中的 run）"""
+        log_to_mlflow = mlflow.active_run() is not None
+        recent_returns = []
+        try:
+            while self.iteration < iterations:
+                rollout_start = time.perf_counter()
+                batch = self.collect()
+                rollout_time = time.perf_counter() - rollout_start
+
+                update_start = time.perf_counter()
+                advantages, returns = self.compute_advantages(batch)
+                stats = self.update(batch, advantages, returns)
+                update_time = time.perf_counter() - update_start
+                self.iteration += 1
+
+                recent_returns = (recent_returns + batch["episode_returns"])[-100:]
+                env_steps = batch["rewards"].size
+                metrics = {
+                    "env_steps_per_sec": env_steps / rollout_time,
+                    "samples_per_sec": env_steps / (rollout_time + update_time),
+                    "rollout_time": rollout_time,
+                    "update_time": update_time,
+                    "mean_step_reward": float(batch["rewards"].mean()),
+                    **stats
+                }
+                if recent_returns:
+                    metrics["mean_episode_return"] = float(np.mean(recent_returns))
+                if log_to_mlflow:
+                    mlflow.log_metrics(metrics, step=self.iteration)
+                if self.iteration % log_every == 0:
+                    logger.info(
+                        f"{self.algorithm.upper()} iter {self.iteration}/{iterations}: "
+                        f"{metrics['env_steps_per_sec']:.0f} env steps/sec, reward/step {metrics['mean_step_reward']:.4f}, "
+                        f"episode return {metrics.get('mean_episode_return', float('nan')):.2f}, "
+                        f"policy loss {stats['policy_loss']:.4f}, value loss {stats['value_loss']:.4f}"
+                    )
+                if self.iteration % checkpoint_every == 0:
+                    self.save_checkpoint()
+            self.save_checkpoint(completed=True)
+        finally:
+            self.close()
+        return self.policy.eval()
+
+    def close(self):
+        for conn in self.pipes:
+            try:
+                conn.send(("close",))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.workers:
+            process.join(timeout=5)
+        self.pipes, self.workers = [], []
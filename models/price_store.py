@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import psycopg2
+from dotenv import load_dotenv
+import os
+from monitoring.logging_config import setup_logging
+
+logger = setup_logging()
+load_dotenv()
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "port": os.getenv("DB_PORT"),
+    "dbname": os.getenv("DB_NAME"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD")
+}
+
+def fetch_tail_windows(stock_ids, seq_length=30, conn=None):
+    """單一查詢取得多檔股票最近 seq_length 筆收盤價，並附上各股完整歷史的最小/最大收盤價
+
+    回傳欄位為 stock_id, date, close, hist_min, hist_max 的 DataFrame，依 stock_id、日期遞增排序；
+    hist_min / hist_max 供全域模型做逐股 MinMax 正規化，無須載入完整歷史。
+    """
+    query = """
+    SELECT stock_id, date, close, hist_min, hist_max FROM (
+        SELECT stock_id, date, close,
+               MIN(close) OVER (PARTITION BY stock_id) AS hist_min,
+               MAX(close) OVER (PARTITION BY stock_id) AS hist_max,
+               ROW_NUMBER() OVER (PARTITION BY stock_id ORDER BY date DESC) AS rn
+        FROM daily_prices
+        WHERE stock_id = ANY(%s)
+    ) t
+    WHERE rn <= %s
+    ORDER BY stock_id, date ASC;
+    """
+    own_conn = conn is None
+    try:
+        if own_conn:
+            conn = psycopg2.connect(**DB_CONFIG)
+        df = pd.read_sql(query, conn, params=(list(stock_ids), seq_length))
+        logger.info(f"Fetched tail windows of {seq_length} days for {df['stock_id'].nunique() if not df.empty else 0} stocks")
+        return df
+    except Exception as e:
+        logger.error(f"Error fetching tail windows: {str(e)}")
+        return None
+    finally:
+        if own_conn and conn is not None:
+            conn.close()
+
+def stack_tail_windows(df, seq_length=30):
+    """將 fetch_tail_windows 結果整理成 (N, seq_length) 收盤價陣列；資料不足的股票會被略過
+
+    回傳 (stock_ids, closes, hist_min, hist_max, dates)，dates 為每檔股票視窗對應的日期列表。
+    """
+    stock_ids, closes, mins, maxs, dates = [], [], [], [], []
+    for stock_id, group in df.groupby("stock_id", sort=False):
+        if len(group) < seq_length:
+            logger.warning(f"Insufficient data for prediction on stock {stock_id}")
+            continue
+        stock_ids.append(stock_id)
+        closes.append(group["close"].to_numpy(dtype=np.float64))
+        mins.append(group["hist_min"].iloc[0])
+        maxs.append(group["hist_max"].iloc[0])
+        dates.append(group["date"].tolist())
+    if not stock_ids:
+        return [], np.empty((0, seq_length)), np.empty(0), np.empty(0), []
+    return stock_ids, np.vstack(closes), np.asarray(mins, dtype=np.float64), np.asarray(maxs, dtype=np.float64), dates
+
+def scaling_params(stock_ids, hist_min, hist_max, scalers=None):
+    """組合每檔股票的 MinMax 參數 (scale, offset)，使 scaled = x * scale + offset
+
+    scalers 中有對應股票時使用其 scaler（個股模型），否則以歷史最小/最大值逐股正規化（全域模型）。
+    """
+    data_range = hist_max - hist_min
+    data_range = np.where(data_range == 0, 1.0, data_range)
+    scale = 1.0 / data_range
+    offset = -hist_min * scale
+    for i, stock_id in enumerate(stock_ids):
+        scaler = (scalers or {}).get(stock_id)
+        if scaler is not None:
+            scale[i] = scaler.scale_[0]
+            offset[i] = scaler.min_[0]
+    return scale, offset
@@ -7,12 +7,13 @@ from dotenv import load_dotenv
 import os
 from monitoring.logging_config import setup_logging
 import mlflow
-import ray
-from openrlhf.cli.train_ppo_ray import train
 
 logger = setup_logging()
 load_dotenv()
 
+# local：行程內 PPO 訓練器（預設）；openrlhf：原本的 Ray / OpenRLHF 流程
+RLHF_BACKEND = os.getenv("RLHF_BACKEND", "local")
+
 DB_CONFIG = {
     "host": os.getenv("DB_HOST"),
     "port": os.getenv("DB_PORT"),
@@ -29,6 +30,9 @@ class StockTradingEnv:
         self.sentiment_data["sentiment_score"] = self.sentiment_data["sentiment"].map({"positive": 1, "neutral": 0, "negative": -1})
         self.seq_length = seq_length
         self.data = self._fetch_data()
+        # 逐步存取改用連續 NumPy 陣列，避免每步 iloc 的 pandas 索引開銷
+        self.closes = self.data["close"].to_numpy(dtype=np.float64) if not self.data.empty else np.empty(0)
+        self.sentiments = self.data["sentiment_score"].to_numpy(dtype=np.float64) if not self.data.empty else np.empty(0)
         self.current_step = seq_length
         self.balance = 10000
         self.shares = 0
@@ -56,26 +60,24 @@ class StockTradingEnv:
         return self._get_state()
 
     def _get_state(self):
-        window = self.data.iloc[self.current_step - self.seq_length:self.current_step]
-        prices = window["close"].values
-        sentiments = window["sentiment_score"].values
-        state = np.concatenate([prices, sentiments])
+        start = self.current_step - self.seq_length
+        state = np.concatenate([self.closes[start:self.current_step], self.sentiments[start:self.current_step]])
         return state
 
     def step(self, action):
-        current_price = self.data.iloc[self.current_step]["close"]
+        current_price = self.closes[self.current_step]
         reward = 0
 
         if action == 0:  # Buy
             if self.balance >= current_price:
                 self.shares += 1
                 self.balance -= current_price
-                reward = self.data.iloc[self.current_step]["sentiment_score"]
+                reward = self.sentiments[self.current_step]
         elif action == 1:  # Sell
             if self.shares > 0:
                 self.shares -= 1
                 self.balance += current_price
-                reward = current_price - self.data.iloc[self.current_step - 1]["close"]
+                reward = current_price - self.closes[self.current_step - 1]
         # Action 2: Hold
 
         self.current_step += 1
@@ -97,8 +99,52 @@ class SimplePolicy(nn.Module):
         x = torch.relu(self.fc2(x))
         return torch.softmax(self.fc3(x), dim=-1)
 
-def train_rlhf_strategy(stock_id, sentiment_data, episodes=100):
+def policy_windows(env, limit=256):
+    """最近 limit 個 [收盤價視窗, 情緒視窗] 狀態（與 StockTradingEnv 及 EnsemblePipeline 的輸入相同），供匯出驗證"""
+    if len(env.closes) < env.seq_length:
+        return None
+    closes = np.lib.stride_tricks.sliding_window_view(env.closes, env.seq_length)[-limit:]
+    sentiments = np.lib.stride_tricks.sliding_window_view(env.sentiments, env.seq_length)[-limit:]
+    return torch.from_numpy(np.concatenate([closes, sentiments], axis=1).astype(np.float32))
+
+def publish_policy(stock_id, env, policy, input_dim, registry=None):
+    """將訓練完成的策略網路發佈到模型登錄（資料版本為最後交易日），供 EnsemblePipeline 的 drl_pred 使用"""
+    from models.model_registry import get_model_registry
+    registry = registry or get_model_registry()
+    data_version = env.data["date"].iloc[-1].strftime("%Y-%m-%d")
+    try:
+        return registry.publish_with_exports("policy", stock_id, data_version, policy, {"input_dim": input_dim},
+                                             seq_length=env.seq_length, validation_input=policy_windows(env))
+    except Exception as e:
+        logger.error(f"Error publishing RLHF policy for {stock_id}: {str(e)}")
+        return None
+
+def train_rlhf_strategy(stock_id, sentiment_data, episodes=100, backend=RLHF_BACKEND, **trainer_kwargs):
+    """訓練交易策略；episodes 在 local 後端為 PPO 迭代次數（每次收集一批向量化環境的軌跡）"""
     env = StockTradingEnv(stock_id, sentiment_data)
+    if backend == "openrlhf":
+        return _train_with_openrlhf(stock_id, env, episodes)
+
+    from models.ppo_trainer import PPOTrainer
+    if env.data.empty:
+        logger.error(f"No data to train RLHF strategy for {stock_id}")
+        return None
+    with mlflow.start_run(run_name=f"RLHF_{stock_id}"):
+        mlflow.log_param("episodes", episodes)
+        mlflow.log_param("stock_id", stock_id)
+        mlflow.log_params({key: value for key, value in trainer_kwargs.items() if isinstance(value, (int, float, str))})
+        trainer = PPOTrainer([env.closes], [env.sentiments], seq_length=env.seq_length,
+                             checkpoint_dir=f"checkpoint/rlhf_{stock_id}", **trainer_kwargs)
+        trainer.load_checkpoint(iterations=episodes)
+        trained_policy = trainer.train(iterations=episodes)
+        mlflow.pytorch.log_model(trained_policy, "rlhf_model")
+        logger.info(f"Completed RLHF training for {stock_id}")
+    publish_policy(stock_id, env, trained_policy, trainer.input_dim)
+    return trained_policy
+
+def _train_with_openrlhf(stock_id, env, episodes):
+    import ray
+    from openrlhf.cli.train_ppo_ray import train
     state_dim = env.seq_length * 2
 
     policy = SimplePolicy(state_dim)
@@ -0,0 +1,168 @@
+import threading
+import numpy as np
+import torch
+import torch.nn as nn
+from dotenv import load_dotenv
+import os
+from monitoring.logging_config import setup_logging
+from models.model_registry import get_model_registry, GLOBAL_SCOPE
+from services.embedding_service import get_embedding_service, EMBEDDING_MODEL, EMBEDDING_DIM
+
+logger = setup_logging()
+load_dotenv()
+
+SENTIMENT_EMBEDDING_MODEL = os.getenv("SENTIMENT_EMBEDDING_MODEL", EMBEDDING_MODEL)
+SENTIMENT_THRESHOLD = float(os.getenv("SENTIMENT_THRESHOLD", 0.15))
+SENTIMENT_TEXT_CHARS = 512
+SENTIMENT_MODEL_TYPE = "sentiment_head"
+# 類別順序與 SENTIMENT_SCORES 的 -1 / 0 / 1 對應
+LABELS = ["negative", "neutral", "positive"]
+
+# 無已登錄的分類頭時，以各類別錨點句的平均嵌入作為初始權重（零樣本）
+PROTOTYPES = {
+    "negative": [
+        "營收衰退", "獲利下滑", "股價重挫", "虧損擴大", "調降目標價", "外資大賣", "利空消息", "訂單減少，前景看淡",
+        "revenue declined", "shares plunged", "downgraded to sell"
+    ],
+    "neutral": [
+        "公告董事會召開日期", "股東常會議程", "法說會時間公告", "盤勢持平", "例行性公告", "更正新聞稿",
+        "company announces meeting date", "shares were little changed"
+    ],
+    "positive": [
+        "營收創新高", "獲利成長", "股價大漲", "訂單強勁", "調升目標價", "外資大買", "利多消息", "看好後市展望",
+        "record revenue", "shares surged", "upgraded to buy"
+    ]
+}
+PROTOTYPE_SCALE = 20.0
+
+class SentimentHead(nn.Module):
+    """在句向量上的小型情緒分類頭；hidden_dim 為 0 時為單層線性"""
+
+    def __init__(self, input_dim=EMBEDDING_DIM, num_classes=len(LABELS), hidden_dim=0):
+        super(SentimentHead, self).__init__()
+        if hidden_dim:
+            self.net = nn.Sequential(nn.Linear(input_dim, hidden_dim), nn.ReLU(), nn.Linear(hidden_dim, num_classes))
+        else:
+            self.net = nn.Linear(input_dim, num_classes)
+
+    def forward(self, x):
+        return self.net(x)
+
+def prototype_head(embedder):
+    """以錨點句嵌入建立線性分類頭：logit 為與各類原型的餘弦相似度乘上 PROTOTYPE_SCALE"""
+    head = SentimentHead()
+    with torch.no_grad():
+        for index, label in enumerate(LABELS):
+            vectors = embedder.encode(PROTOTYPES[label])
+            prototype = vectors.mean(axis=0)
+            prototype = prototype / max(np.linalg.norm(prototype), 1e-12)
+            head.net.weight[index] = torch.from_numpy(prototype.astype(np.float32)) * PROTOTYPE_SCALE
+        head.net.bias.zero_()
+    head.eval()
+    return head
+
+def fit_head(embeddings, labels, head=None, epochs=30, lr=1e-2, batch_size=512):
+    """以已標記的句向量訓練分類頭（例如以 SentimentAgent 的 LLM 結果做蒸餾）；labels 為 LABELS 中的字串"""
+    head = head or SentimentHead()
+    X = torch.from_numpy(np.asarray(embeddings, dtype=np.float32))
+    y = torch.tensor([LABELS.index(label) for label in labels], dtype=torch.long)
+    optimizer = torch.optim.Adam(head.parameters(), lr=lr)
+    loss_fn = nn.CrossEntropyLoss()
+    head.train()
+    loss = torch.tensor(0.0)
+    for _ in range(epochs):
+        permutation = torch.randperm(len(X))
+        for start in range(0, len(X), batch_size):
+            index = permutation[start:start + batch_size]
+            loss = loss_fn(head(X[index]), y[index])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+    head.eval()
+    logger.info(f"Trained sentiment head on {len(X)} examples, final batch loss {loss.item():.4f}")
+    return head
+
+def publish_head(head, data_version, hidden_dim=0, metadata=None):
+    """發佈分類頭到模型登錄"""
+    return get_model_registry().publish(
+        SENTIMENT_MODEL_TYPE, GLOBAL_SCOPE, data_version, head, {"hidden_dim": hidden_dim},
+        metadata={"embedding_model": SENTIMENT_EMBEDDING_MODEL, "labels": LABELS, **(metadata or {})}
+    )
+
+def news_text(item):
+    return f"{item.get('title') or ''} {item.get('content') or ''}".strip()[:SENTIMENT_TEXT_CHARS]
+
+class SentimentClassifier:
+    """以本機 CPU 批次為新聞評分：MiniLM 句向量 + 分類頭
+
+    句向量由共用的 EmbeddingService 批次計算（已正規化），分類頭在 inference_mode 下一次處理整批；
+    分類頭優先載入模型登錄中的最新版本，否則以錨點原型零樣本初始化。
+    """
+
+    def __init__(self, embedder=None, head=None):
+        self.embedder = embedder or get_embedding_service(SENTIMENT_EMBEDDING_MODEL)
+        self.version = "prototype"
+        if head is None:
+            head, _, metadata = get_model_registry().load(SENTIMENT_MODEL_TYPE, GLOBAL_SCOPE, prefer_optimized=False)
+            if head is not None:
+                self.version = metadata["data_version"]
+        self.head = head if head is not None else prototype_head(self.embedder)
+
+    def predict_proba(self, texts):
+        """回傳 (N, 3) 機率矩陣，欄位順序同 LABELS"""
+        if not texts:
+            return np.zeros((0, len(LABELS)), dtype=np.float32)
+        embeddings = self.embedder.encode(list(texts))
+        with torch.inference_mode():
+            logits = self.head(torch.from_numpy(np.asarray(embeddings, dtype=np.float32)))
+            return torch.softmax(logits, dim=-1).numpy()
+
+    def score_news(self, news_items):
+        """為每則新聞加上 sentiment / polarity / confidence，回傳新的 dict 列表"""
+        probs = self.predict_proba([news_text(item) for item in news_items])
+        scored = []
+        for item, prob in zip(news_items, probs):
+            scored.append({
+                **item,
+                "sentiment": LABELS[int(prob.argmax())],
+                "polarity": float(prob[2] - prob[0]),
+                "confidence": float(prob.max())
+            })
+        return scored
+
+def aggregate_daily(scored_items, threshold=SENTIMENT_THRESHOLD):
+    """彙總成每檔股票每日一筆：score 為以單則信心加權的極性平均，
+    confidence 為平均信心乘上與彙總標籤一致的新聞比例"""
+    groups = {}
+    for item in scored_items:
+        groups.setdefault((item["stock_id"], item["date"]), []).append(item)
+
+    daily = []
+    for (stock_id, date), items in groups.items():
+        polarity = np.array([item["polarity"] for item in items])
+        confidence = np.array([item["confidence"] for item in items])
+        score = float(np.dot(confidence, polarity) / confidence.sum())
+        label = "positive" if score > threshold else "negative" if score < -threshold else "neutral"
+        counts = {name: sum(1 for item in items if item["sentiment"] == name) for name in LABELS}
+        daily.append({
+            "stock_id": stock_id,
+            "date": date,
+            "sentiment": label,
+            "score": score,
+            "confidence": float(confidence.mean() * counts[label] / len(items)),
+            "n_articles": len(items),
+            "counts": counts
+        })
+    return daily
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+def get_sentiment_classifier():
+    """取得行程內共用的 SentimentClassifier"""
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = SentimentClassifier()
+    return _classifier
@@ -0,0 +1,94 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+class SequenceBuilder:
+    """以 stride tricks 建立滑動視窗檢視，不複製原始序列，只在取出 mini-batch 時才實體化
+
+    channels 可為 (T,) / (T, C) 陣列，或由多個 (T,) 特徵（價格、情緒、技術指標…）組成的 list；
+    target 為預測目標序列 (T,)，第 i 個視窗 features[i:i+seq_length] 對應 target[i+seq_length]。
+    """
+
+    def __init__(self, channels, seq_length=30, target=None, dtype=np.float32):
+        if isinstance(channels, (list, tuple)):
+            channels = np.column_stack([np.asarray(c).reshape(-1) for c in channels])
+        features = np.asarray(channels, dtype=dtype)
+        if features.ndim == 1:
+            features = features.reshape(-1, 1)
+        # 原始序列只保留一份連續記憶體，所有視窗都是它的檢視
+        self.features = np.ascontiguousarray(features)
+        self.seq_length = seq_length
+        self.target = None if target is None else np.ascontiguousarray(np.asarray(target, dtype=dtype).reshape(-1))
+        if len(self.features) < seq_length:
+            self.windows = np.empty((0, seq_length, self.features.shape[1]), dtype=dtype)
+        else:
+            # sliding_window_view 回傳 (T-L+1, C, L)，轉置成 (N, L, C) 仍為檢視
+            self.windows = sliding_window_view(self.features, seq_length, axis=0).transpose(0, 2, 1)
+
+    @property
+    def num_channels(self):
+        return self.features.shape[1]
+
+    def __len__(self):
+        """有對應目標值的視窗數"""
+        return max(len(self.features) - self.seq_length, 0)
+
+    @property
+    def inputs(self):
+        """所有訓練視窗 (N, L, C) 的唯讀檢視"""
+        return self.windows[:len(self)]
+
+    @property
+    def targets(self):
+        """與 inputs 對齊的目標值 (N, 1) 檢視；未指定 target 時為 None（與 batch() 一致）"""
+        if self.target is None:
+            return None
+        return self.target[self.seq_length:].reshape(-1, 1)
+
+    def last_window(self):
+        """最近 seq_length 筆資料組成的視窗 (1, L, C)，供預測使用"""
+        return np.ascontiguousarray(self.windows[-1:])
+
+    def batch(self, indices):
+        """實體化指定索引的 mini-batch，回傳連續記憶體的 (X, y)"""
+        indices = np.asarray(indices)
+        X = np.ascontiguousarray(self.windows[indices])
+        y = None if self.target is None else self.target[indices + self.seq_length].reshape(-1, 1)
+        return X, y
+
+    def split(self, train_ratio=0.8):
+        """依時間順序切分訓練與驗證索引"""
+        split_at = int(len(self) * train_ratio)
+        return np.arange(split_at), np.arange(split_at, len(self))
+
+    def iter_batches(self, indices, batch_size, shuffle=True, rng=None):
+        """依索引逐批實體化 (X, y)"""
+        indices = np.asarray(indices)
+        if shuffle:
+            rng = rng or np.random.default_rng()
+            indices = rng.permutation(indices)
+        for start in range(0, len(indices), batch_size):
+            yield self.batch(indices[start:start + batch_size])
+
+class StackedWindows:
+    """已實體化的視窗 (N, L, C) 與目標 (N, 1)，提供與 SequenceBuilder 相同的 batch 介面
+
+    用於跨股票合併少量視窗（例如增量微調的 replay buffer），不適合整段歷史。
+    """
+
+    def __init__(self, inputs, targets, dtype=np.float32):
+        inputs = np.asarray(inputs, dtype=dtype)
+        if inputs.ndim == 2:
+            inputs = inputs[..., None]
+        self.windows = np.ascontiguousarray(inputs)
+        self.target = np.ascontiguousarray(np.asarray(targets, dtype=dtype).reshape(-1, 1))
+
+    def __len__(self):
+        return len(self.windows)
+
+    @property
+    def num_channels(self):
+        return self.windows.shape[2]
+
+    def batch(self, indices):
+        indices = np.asarray(indices)
+        return self.windows[indices], self.target[indices]
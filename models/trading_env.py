@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+import psycopg2
+from numpy.lib.stride_tricks import sliding_window_view
+from dotenv import load_dotenv
+import os
+from monitoring.logging_config import setup_logging
+
+logger = setup_logging()
+load_dotenv()
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "port": os.getenv("DB_PORT"),
+    "dbname": os.getenv("DB_NAME"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD")
+}
+
+BUY, SELL, HOLD = 0, 1, 2
+SENTIMENT_SCORES = {"positive": 1, "neutral": 0, "negative": -1}
+
+def sentiment_series(sentiment_data, dates):
+    """將情緒資料（date, sentiment）對齊到交易日，缺值補 0"""
+    if not sentiment_data:
+        return np.zeros(len(dates))
+    sentiment_df = pd.DataFrame(sentiment_data, columns=["date", "sentiment"])
+    sentiment_df["date"] = pd.to_datetime(sentiment_df["date"])
+    scores = sentiment_df.set_index("date")["sentiment"].map(SENTIMENT_SCORES)
+    scores = scores[~scores.index.duplicated(keep="last")]
+    return scores.reindex(pd.to_datetime(dates)).fillna(0).to_numpy(dtype=np.float64)
+
+class VectorStockTradingEnv:
+    """同步推進 K 個交易環境的向量化版本，規則與 StockTradingEnv 相同
+
+    所有股票的收盤價與情緒分數串接成一份連續陣列，觀測值由預先建立的滑動視窗檢視取出；
+    每個環境以 (序列起點, 目前步數) 表示，step 對 K 個環境一次做陣列運算，不使用 pandas 索引。
+    觀測值格式與 StockTradingEnv._get_state 相同：[前 seq_length 日收盤價, 前 seq_length 日情緒分數]。
+    """
+
+    def __init__(self, closes, sentiments=None, n_envs=None, seq_length=30, initial_balance=10000,
+                 random_starts=False, auto_reset=True, seed=None, dtype=np.float32):
+        series = [np.asarray(c, dtype=np.float64).reshape(-1) for c in closes]
+        if sentiments is None:
+            sentiments = [np.zeros(len(c)) for c in series]
+        sentiments = [np.asarray(s, dtype=np.float64).reshape(-1) for s in sentiments]
+
+        # 至少要能走一步：max_steps = len - seq_length - 1 必須大於起點 seq_length
+        keep = [i for i, c in enumerate(series) if len(c) - seq_length - 1 > seq_length]
+        if not keep:
+            raise ValueError(f"No series longer than {2 * seq_length + 1} steps")
+        if len(keep) < len(series):
+            logger.warning(f"Dropped {len(series) - len(keep)} series shorter than {2 * seq_length + 2} steps")
+        series = [series[i] for i in keep]
+        sentiments = [sentiments[i] for i in keep]
+
+        self.seq_length = seq_length
+        self.initial_balance = initial_balance
+        self.random_starts = random_starts
+        self.auto_reset = auto_reset
+        self.rng = np.random.default_rng(seed)
+        self.series_kept = keep
+
+        lengths = np.array([len(c) for c in series])
+        self.series_offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        self.closes = np.ascontiguousarray(np.concatenate(series))
+        self.sentiments = np.ascontiguousarray(np.concatenate(sentiments))
+        # (2, T) 的特徵陣列，視窗檢視為 (T - L + 1, 2, L)，取出後 reshape 即為 [prices, sentiments]
+        features = np.ascontiguousarray(np.stack([self.closes, self.sentiments]).astype(dtype))
+        self.windows = sliding_window_view(features, seq_length, axis=1).transpose(1, 0, 2)
+
+        self.n_envs = n_envs or len(series)
+        self.series_index = np.arange(self.n_envs) % len(series)
+        self.base = self.series_offsets[self.series_index]
+        self.max_steps = lengths[self.series_index] - seq_length - 1
+
+        self.t = np.full(self.n_envs, seq_length, dtype=np.int64)
+        self.balance = np.full(self.n_envs, float(initial_balance))
+        self.shares = np.zeros(self.n_envs, dtype=np.int64)
+        self.done = np.zeros(self.n_envs, dtype=bool)
+
+    @classmethod
+    def from_frames(cls, frames, **kwargs):
+        """由含 close 與 sentiment_score 欄位的 DataFrame 列表建立（例如 StockTradingEnv.data）"""
+        return cls([df["close"].values for df in frames], [df["sentiment_score"].values for df in frames], **kwargs)
+
+    @classmethod
+    def from_stocks(cls, stock_ids, sentiment_data=None, **kwargs):
+        """以單一查詢載入多檔股票；sentiment_data 為 {stock_id: [{"date", "sentiment"}, ...]}"""
+        query = """
+        SELECT stock_id, date, close FROM daily_prices
+        WHERE stock_id = ANY(%s)
+        ORDER BY stock_id, date ASC;
+        """
+        conn = psycopg2.connect(**DB_CONFIG)
+        try:
+            df = pd.read_sql(query, conn, params=(list(stock_ids),))
+        finally:
+            conn.close()
+        closes, sentiments = [], []
+        for stock_id, group in df.groupby("stock_id", sort=False):
+            closes.append(group["close"].values)
+            sentiments.append(sentiment_series((sentiment_data or {}).get(stock_id), group["date"]))
+        logger.info(f"Loaded {len(closes)} stocks for vectorized trading env")
+        return cls(closes, sentiments, **kwargs)
+
+    @property
+    def observation_dim(self):
+        return self.seq_length * 2
+
+    def _start_steps(self, mask=None):
+        """回合起點：預設為 seq_length，random_starts 時在序列內隨機取起點"""
+        max_steps = self.max_steps if mask is None else self.max_steps[mask]
+        if not self.random_starts:
+            return np.full(len(max_steps), self.seq_length, dtype=np.int64)
+        return self.rng.integers(self.seq_length, max_steps)
+
+    def _observe(self):
+        pos = self.base + self.t - self.seq_length
+        return self.windows[pos].reshape(self.n_envs, -1)
+
+    def reset(self):
+        """重置全部環境並回傳觀測值 (K, 2 * seq_length)"""
+        self.t[:] = self._start_steps()
+        self.balance[:] = self.initial_balance
+        self.shares[:] = 0
+        self.done[:] = False
+        return self._observe()
+
+    def step(self, actions):
+        """actions 為長度 K 的動作陣列（0 買、1 賣、2 持有），回傳 (obs, rewards, dones)
+
+        auto_reset 時結束的環境會立即重置，回傳的觀測值即為新回合的第一個狀態。
+        """
+        actions = np.asarray(actions)
+        pos = self.base + self.t
+        price = self.closes[pos]
+        buy = (actions == BUY) & (self.balance >= price) & ~self.done
+        sell = (actions == SELL) & (self.shares > 0) & ~self.done
+
+        rewards = np.where(buy, self.sentiments[pos], 0.0)
+        rewards = np.where(sell, price - self.closes[pos - 1], rewards)
+        self.shares += buy.astype(np.int64) - sell.astype(np.int64)
+        self.balance += np.where(sell, price, 0.0) - np.where(buy, price, 0.0)
+
+        self.t += ~self.done
+        self.done |= self.t >= self.max_steps
+        dones = self.done.copy()
+        if self.auto_reset and dones.any():
+            self.t[dones] = self._start_steps(dones)
+            self.balance[dones] = self.initial_balance
+            self.shares[dones] = 0
+            self.done[dones] = False
+        # 已結束且未自動重置的環境停在最後一步
+        np.minimum(self.t, self.max_steps, out=self.t)
+        return self._observe(), rewards, dones
+
+    def portfolio_value(self):
+        """各環境以目前收盤價計算的資產總值"""
+        return self.balance + self.shares * self.closes[self.base + np.minimum(self.t, self.max_steps)]
@@ -0,0 +1,114 @@
+import copy
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import Dataset, DataLoader, BatchSampler, RandomSampler, SequentialSampler
+from monitoring.logging_config import setup_logging
+
+logger = setup_logging()
+
+class WindowDataset(Dataset):
+    """包裝 SequenceBuilder 的資料集，每次以整批索引實體化一個 mini-batch"""
+
+    def __init__(self, builder, indices):
+        self.builder = builder
+        self.indices = np.asarray(indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, batch_positions):
+        X, y = self.builder.batch(self.indices[batch_positions])
+        return torch.from_numpy(X), torch.from_numpy(y)
+
+def make_loader(builder, indices, batch_size, shuffle=False, num_workers=0):
+    """建立批次層級取樣的 DataLoader（一次 fancy indexing 取出整批，而非逐筆 collate）"""
+    dataset = WindowDataset(builder, indices)
+    sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    return DataLoader(
+        dataset,
+        sampler=BatchSampler(sampler, batch_size=batch_size, drop_last=False),
+        batch_size=None,
+        num_workers=num_workers,
+        persistent_workers=num_workers > 0
+    )
+
+def evaluate(model, loader, criterion, device):
+    """以 mini-batch 計算平均驗證損失"""
+    model.eval()
+    total_loss, total_samples = 0.0, 0
+    with torch.no_grad():
+        for X_batch, y_batch in loader:
+            X_batch, y_batch = X_batch.to(device), y_batch.to(device)
+            total_loss += criterion(model(X_batch), y_batch).item() * len(X_batch)
+            total_samples += len(X_batch)
+    return total_loss / max(total_samples, 1)
+
+def fit_model(model, builder, train_idx, val_idx, epochs=50, batch_size=32, lr=0.001, num_workers=0,
+              accumulation_steps=1, patience=5, min_delta=0.0, device=None, optimizer=None):
+    """Mini-batch 訓練：打亂批次、梯度累積、以驗證損失提前停止，並記錄每個 epoch 的耗時
+
+    回傳 (model, history)，model 會載回驗證損失最低時的權重。
+    """
+    device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = model.to(device)
+    optimizer = optimizer or torch.optim.Adam(model.parameters(), lr=lr)
+    criterion = nn.MSELoss()
+
+    train_loader = make_loader(builder, train_idx, batch_size, shuffle=True, num_workers=num_workers)
+    val_loader = make_loader(builder, val_idx, batch_size, num_workers=num_workers) if len(val_idx) > 0 else None
+
+    best_loss = float("inf")
+    best_state = None
+    epochs_without_improvement = 0
+    history = []
+
+    for epoch in range(epochs):
+        epoch_start = time.perf_counter()
+        model.train()
+        optimizer.zero_grad()
+        train_loss, train_samples = 0.0, 0
+        n_batches = len(train_loader)
+        for step, (X_batch, y_batch) in enumerate(train_loader, start=1):
+            X_batch, y_batch = X_batch.to(device), y_batch.to(device)
+            loss = criterion(model(X_batch), y_batch)
+            (loss / accumulation_steps).backward()
+            if step % accumulation_steps == 0 or step == n_batches:
+                optimizer.step()
+                optimizer.zero_grad()
+            train_loss += loss.item() * len(X_batch)
+            train_samples += len(X_batch)
+        train_time = time.perf_counter() - epoch_start
+
+        val_start = time.perf_counter()
+        val_loss = evaluate(model, val_loader, criterion, device) if val_loader else train_loss / max(train_samples, 1)
+        val_time = time.perf_counter() - val_start
+
+        record = {
+            "epoch": epoch + 1,
+            "train_loss": train_loss / max(train_samples, 1),
+            "val_loss": val_loss,
+            "train_time": train_time,
+            "val_time": val_time,
+            "samples_per_sec": train_samples / train_time if train_time > 0 else 0.0
+        }
+        history.append(record)
+        logger.info(
+            f"Epoch {epoch+1}/{epochs}, Train Loss: {record['train_loss']:.4f}, Val Loss: {val_loss:.4f}, "
+            f"train {train_time:.2f}s, val {val_time:.2f}s, {record['samples_per_sec']:.0f} samples/sec"
+        )
+
+        if val_loss < best_loss - min_delta:
+            best_loss = val_loss
+            best_state = copy.deepcopy(model.state_dict())
+            epochs_without_improvement = 0
+        else:
+            epochs_without_improvement += 1
+            if epochs_without_improvement >= patience:
+                logger.info(f"Early stopping at epoch {epoch+1}, best Val Loss: {best_loss:.4f}")
+                break
+
+    if best_state is not None:
+        model.load_state_dict(best_state)
+    return model, history
@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+from torch.utils.data import IterableDataset, DataLoader, get_worker_info
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import MinMaxScaler
@@ -7,7 +8,14 @@ from sqlalchemy import create_engine
 from dotenv import load_dotenv
 import os
 from monitoring.logging_config import setup_logging
+from models.sequence_builder import SequenceBuilder, StackedWindows
+from models.training import fit_model
+from models.price_store import fetch_tail_windows, stack_tail_windows, scaling_params
+from models.export import model_device, validation_windows
+from models.online_update import update_scaler, replay_indices, load_for_update, publish_if_improved
 import psycopg2
+import random
+import time
 
 logger = setup_logging()
 load_dotenv()
@@ -23,6 +31,9 @@ DB_CONFIG = {
 
 engine = psycopg2.connect(**DB_CONFIG)
 
+GLOBAL_CHECKPOINT_PATH = "checkpoint/transformer_global.pt"
+MODEL_CONFIG = {"input_dim": 1, "d_model": 64, "n_heads": 4, "n_layers": 2, "dropout": 0.1}
+
 class TransformerModel(nn.Module):
     def __init__(self, input_dim, d_model=64, n_heads=4, n_layers=2, dropout=0.1):
         super(TransformerModel, self).__init__()
@@ -58,84 +69,414 @@ def fetch_stock_data(stock_id):
         logger.error(f"Error fetching stock data: {str(e)}")
         return None
 
-def prepare_data(df, seq_length=30):
-    """準備 Transformer 訓練數據"""
+def build_sequences(df, seq_length=30):
+    """擬合 scaler 並建立滑動視窗 SequenceBuilder"""
     scaler = MinMaxScaler()
     scaled_data = scaler.fit_transform(df[['close']])
-    
-    X, y = [], []
-    for i in range(len(scaled_data) - seq_length):
-        X.append(scaled_data[i:i + seq_length])
-        y.append(scaled_data[i + seq_length])
-    
-    X = np.array(X)
-    y = np.array(y)
+    return SequenceBuilder(scaled_data, seq_length, target=scaled_data), scaler
+
+def prepare_data(df, seq_length=30):
+    """準備 Transformer 訓練數據"""
+    # X 為原始序列的滑動視窗檢視，不逐窗複製
+    builder, scaler = build_sequences(df, seq_length)
+    X, y = builder.inputs, builder.targets
     logger.info(f"Prepared {len(X)} sequences with length {seq_length}")
     return X, y, scaler
 
-def train_transformer(stock_id, epochs=50, batch_size=32, seq_length=30):
-    """微調 Transformer 模型"""
+def train_transformer(stock_id, epochs=50, batch_size=32, seq_length=30, lr=0.001, num_workers=0, accumulation_steps=1, patience=5, model_config=None):
+    """微調 Transformer 模型（mini-batch 訓練，驗證損失不再下降時提前停止）；model_config 預設為 MODEL_CONFIG"""
     df = fetch_stock_data(stock_id)
     if df is None or len(df) < seq_length + 1:
         logger.error(f"Insufficient data for stock {stock_id}. Required: {seq_length + 1}, Found: {len(df) if df is not None else 0}")
         return None, None
 
-    X, y, scaler = prepare_data(df, seq_length)
-    train_size = int(len(X) * 0.8)
-    X_train, X_test = X[:train_size], X[train_size:]
-    y_train, y_test = y[:train_size], y[train_size:]
+    builder, scaler = build_sequences(df, seq_length)
+    train_idx, val_idx = builder.split(0.8)
+    logger.info(f"Prepared {len(builder)} sequences with length {seq_length}")
 
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     logger.info(f"Using device: {device}")
 
-    model = TransformerModel(input_dim=1).to(device)
-    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    model = TransformerModel(**(model_config or MODEL_CONFIG))
+    model, _ = fit_model(
+        model, builder, train_idx, val_idx,
+        epochs=epochs, batch_size=batch_size, lr=lr, num_workers=num_workers,
+        accumulation_steps=accumulation_steps, patience=patience, device=device
+    )
+    return model, scaler
+
+def fetch_stock_ids():
+    """從 stocks 表獲取所有股票代碼"""
+    try:
+        df = pd.read_sql("SELECT stock_id FROM stocks ORDER BY stock_id;", engine)
+        return df["stock_id"].tolist()
+    except Exception as e:
+        logger.error(f"Error fetching stock ids: {str(e)}")
+        return []
+
+def fit_stock_scaler(df):
+    """以單一股票的歷史收盤價擬合 scaler（全域模型使用逐股正規化）"""
+    scaler = MinMaxScaler()
+    scaler.fit(df[['close']])
+    return scaler
+
+class PooledWindowDataset(IterableDataset):
+    """跨股票串流的逐股正規化視窗資料集，逐檔從資料庫讀取並以緩衝區打亂"""
+
+    def __init__(self, stock_ids, seq_length=30, split="train", train_ratio=0.8, shuffle_buffer=10000, seed=42):
+        super().__init__()
+        self.stock_ids = list(stock_ids)
+        self.seq_length = seq_length
+        self.split = split
+        self.train_ratio = train_ratio
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _stock_windows(self, conn, stock_id):
+        query = """
+        SELECT close FROM daily_prices
+        WHERE stock_id = %s
+        ORDER BY date ASC;
+        """
+        df = pd.read_sql(query, conn, params=(stock_id,))
+        if len(df) < self.seq_length + 1:
+            return
+        scaled = fit_stock_scaler(df).transform(df[['close']])
+        builder = SequenceBuilder(scaled, self.seq_length, target=scaled)
+        # 每檔股票保留最後 (1 - train_ratio) 的視窗作為驗證集
+        train_idx, val_idx = builder.split(self.train_ratio)
+        X, y = builder.inputs, builder.targets
+        for i in (train_idx if self.split == "train" else val_idx):
+            # 只複製單一視窗，避免整段歷史逐窗展開
+            yield X[i].copy(), y[i].copy()
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id = worker_info.id if worker_info else 0
+        num_workers = worker_info.num_workers if worker_info else 1
+        rng = random.Random(self.seed + self.epoch * 1000 + worker_id)
+
+        stock_ids = self.stock_ids[worker_id::num_workers]
+        if self.split == "train":
+            rng.shuffle(stock_ids)
+
+        conn = psycopg2.connect(**DB_CONFIG)
+        try:
+            buffer = []
+            for stock_id in stock_ids:
+                try:
+                    for sample in self._stock_windows(conn, stock_id):
+                        if self.split != "train":
+                            yield sample
+                        elif len(buffer) < self.shuffle_buffer:
+                            buffer.append(sample)
+                        else:
+                            idx = rng.randrange(len(buffer))
+                            yield buffer[idx]
+                            buffer[idx] = sample
+                except Exception as e:
+                    logger.error(f"Error streaming windows for {stock_id}: {str(e)}")
+            rng.shuffle(buffer)
+            yield from buffer
+        finally:
+            conn.close()
+
+def save_checkpoint(path, state):
+    """原子寫入檢查點，避免中斷時留下損毀檔案"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+def train_global_transformer(stock_ids=None, epochs=10, batch_size=256, seq_length=30, lr=0.001, num_workers=0,
+                             checkpoint_path=GLOBAL_CHECKPOINT_PATH, resume=True, checkpoint_every=500, log_every=100):
+    """以所有股票訓練單一全域 Transformer 模型，支援檢查點續訓
+
+    只續訓中斷的訓練；檢查點標記為已完成（或已達 epochs）時重新訓練，不會直接回傳舊權重。
+    """
+    stock_ids = stock_ids or fetch_stock_ids()
+    if not stock_ids:
+        logger.error("No stock ids available for global training")
+        return None
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model_config = dict(MODEL_CONFIG)
+    model = TransformerModel(**model_config).to(device)
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
     criterion = nn.MSELoss()
 
-    X_train = torch.FloatTensor(X_train).to(device)
-    y_train = torch.FloatTensor(y_train).to(device)
-    X_test = torch.FloatTensor(X_test).to(device)
-    y_test = torch.FloatTensor(y_test).to(device)
+    start_epoch, skip_batches, total_samples = 0, 0, 0
+    state = torch.load(checkpoint_path, map_location=device) if resume and os.path.exists(checkpoint_path) else None
+    if state is not None and (state.get("completed") or state["epoch"] >= epochs):
+        logger.info(f"Checkpoint {checkpoint_path} is from a finished run, starting fresh training")
+        state = None
+    if state is not None:
+        model.load_state_dict(state["model"])
+        optimizer.load_state_dict(state["optimizer"])
+        start_epoch, skip_batches, total_samples = state["epoch"], state["batches_done"], state["samples_seen"]
+        logger.info(f"Resumed global training from {checkpoint_path} at epoch {start_epoch + 1}, batch {skip_batches}")
 
-    for epoch in range(epochs):
+    train_set = PooledWindowDataset(stock_ids, seq_length, split="train")
+    val_set = PooledWindowDataset(stock_ids, seq_length, split="val")
+    train_loader = DataLoader(train_set, batch_size=batch_size, num_workers=num_workers)
+    val_loader = DataLoader(val_set, batch_size=batch_size, num_workers=num_workers)
+
+    def checkpoint(epoch, batches_done, completed=False):
+        save_checkpoint(checkpoint_path, {
+            "model": model.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "model_config": model_config,
+            "seq_length": seq_length,
+            "epoch": epoch,
+            "batches_done": batches_done,
+            "samples_seen": total_samples,
+            "completed": completed
+        })
+
+    for epoch in range(start_epoch, epochs):
+        train_set.set_epoch(epoch)
         model.train()
-        optimizer.zero_grad()
-        output = model(X_train)
-        loss = criterion(output, y_train)
-        loss.backward()
-        optimizer.step()
-        
-        if (epoch + 1) % 10 == 0:
-            model.eval()
-            with torch.no_grad():
-                test_output = model(X_test)
-                test_loss = criterion(test_output, y_test)
-            logger.info(f"Epoch {epoch+1}/{epochs}, Train Loss: {loss.item():.4f}, Test Loss: {test_loss.item():.4f}")
+        epoch_start = time.perf_counter()
+        window_start, window_samples, epoch_samples, train_loss = epoch_start, 0, 0, 0.0
+        batches_done = 0
+        for batches_done, (X_batch, y_batch) in enumerate(train_loader, start=1):
+            # 續訓時跳過本 epoch 已完成的批次（資料順序由 seed 與 epoch 決定）
+            if batches_done <= skip_batches:
+                continue
+            X_batch, y_batch = X_batch.to(device), y_batch.to(device)
+            optimizer.zero_grad()
+            loss = criterion(model(X_batch), y_batch)
+            loss.backward()
+            optimizer.step()
 
-    return model, scaler
+            n = len(X_batch)
+            train_loss += loss.item() * n
+            epoch_samples += n
+            window_samples += n
+            total_samples += n
+            if batches_done % log_every == 0:
+                now = time.perf_counter()
+                logger.info(f"Epoch {epoch+1}/{epochs}, batch {batches_done}, loss {loss.item():.4f}, {window_samples / (now - window_start):.0f} samples/sec")
+                window_start, window_samples = now, 0
+            if batches_done % checkpoint_every == 0:
+                checkpoint(epoch, batches_done)
+        skip_batches = 0
+
+        model.eval()
+        val_loss, val_samples = 0.0, 0
+        with torch.no_grad():
+            for X_batch, y_batch in val_loader:
+                X_batch, y_batch = X_batch.to(device), y_batch.to(device)
+                val_loss += criterion(model(X_batch), y_batch).item() * len(X_batch)
+                val_samples += len(X_batch)
+
+        elapsed = time.perf_counter() - epoch_start
+        logger.info(
+            f"Epoch {epoch+1}/{epochs}, Train Loss: {train_loss / max(epoch_samples, 1):.4f}, "
+            f"Val Loss: {val_loss / max(val_samples, 1):.4f}, {epoch_samples / elapsed:.0f} samples/sec, {elapsed:.1f}s"
+        )
+        checkpoint(epoch + 1, 0, completed=epoch + 1 >= epochs)
+
+    logger.info(f"Completed global training on {len(stock_ids)} stocks, {total_samples} samples seen")
+    return model
+
+def load_global_transformer(checkpoint_path=GLOBAL_CHECKPOINT_PATH):
+    """載入全域 Transformer 檢查點，不存在時回傳 None"""
+    if not os.path.exists(checkpoint_path):
+        return None
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    state = torch.load(checkpoint_path, map_location=device)
+    model = TransformerModel(**state["model_config"]).to(device)
+    model.load_state_dict(state["model"])
+    model.eval()
+    return model
+
+def global_validation_windows(seq_length=30, max_stocks=256, seed=0):
+    """全域模型匯出驗證用的實際輸入：抽樣股票的最新視窗，與推論相同地逐股以歷史 min/max 正規化"""
+    stock_ids = fetch_stock_ids()
+    if len(stock_ids) > max_stocks:
+        stock_ids = random.Random(seed).sample(stock_ids, max_stocks)
+    df = fetch_tail_windows(stock_ids, seq_length) if stock_ids else None
+    if df is None or df.empty:
+        return None
+    ids, closes, hist_min, hist_max, _ = stack_tail_windows(df, seq_length)
+    if not ids:
+        return None
+    scale, offset = scaling_params(ids, hist_min, hist_max)
+    return torch.from_numpy((closes * scale[:, None] + offset[:, None]).astype(np.float32)[:, :, None])
+
+def train_and_publish_transformer(stock_id=None, registry=None, **train_kwargs):
+    """背景訓練工作：訓練個股（stock_id）或全域（stock_id=None）模型並發佈到模型登錄"""
+    from models.model_registry import get_model_registry, GLOBAL_SCOPE
+    registry = registry or get_model_registry()
+
+    if stock_id is None:
+        model = train_global_transformer(**train_kwargs)
+        if model is None:
+            return None
+        data_version = pd.Timestamp.now().strftime("%Y-%m-%d")
+        return registry.publish_with_exports("transformer", GLOBAL_SCOPE, data_version, model, MODEL_CONFIG,
+                                             metadata={"normalization": "per_stock"},
+                                             validation_input=global_validation_windows(train_kwargs.get("seq_length", 30)))
 
-def predict_price(model, scaler, stock_id, seq_length=30):
-    """預測下一個交易日的股價"""
     df = fetch_stock_data(stock_id)
-    if df is None or len(df) < seq_length:
-        logger.error(f"Insufficient data for prediction on stock {stock_id}")
+    if df is None or df.empty:
+        return None
+    model, scaler = train_transformer(stock_id, **train_kwargs)
+    if model is None:
         return None
+    data_version = str(df["date"].iloc[-1])
+    seq_length = train_kwargs.get("seq_length", 30)
+    scaled = scaler.transform(df[['close']])
+    builder = SequenceBuilder(scaled, seq_length, target=scaled)
+    return registry.publish_with_exports("transformer", stock_id, data_version, model, train_kwargs.get("model_config") or MODEL_CONFIG,
+                                         scaler=scaler, seq_length=seq_length,
+                                         validation_input=validation_windows(builder, builder.split(0.8)[1]))
 
-    last_sequence = df['close'].values[-seq_length:]
-    scaled_sequence = scaler.transform(last_sequence.reshape(-1, 1))
-    input_tensor = torch.FloatTensor(scaled_sequence).unsqueeze(0)  # [1, seq_length, 1]
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    input_tensor = input_tensor.to(device)
+def global_update_windows(stock_ids, seq_length=30, recent_windows=20, val_windows=5, replay_stocks=200,
+                          replay_per_stock=8, rng=None):
+    """全域模型增量微調資料：所有股票的最新視窗（逐股以完整歷史 min/max 正規化）加上
+    隨機抽樣股票的較舊視窗；回傳 (StackedWindows, train_idx, val_idx)"""
+    rng = rng or np.random.default_rng()
+    tail = fetch_tail_windows(stock_ids, seq_length + recent_windows + val_windows)
+    if tail is None or tail.empty:
+        return None, None, None
+
+    X_train, y_train, X_val, y_val = [], [], [], []
+    for _, group in tail.groupby("stock_id", sort=False):
+        if len(group) < seq_length + val_windows + 1:
+            continue
+        # 與推論一致：hist_min / hist_max 隨新資料更新，等同逐股 scaler 的增量更新
+        hist_min, hist_max = group["hist_min"].iloc[0], group["hist_max"].iloc[0]
+        scaled = (group["close"].to_numpy(dtype=np.float64) - hist_min) / ((hist_max - hist_min) or 1.0)
+        builder = SequenceBuilder(scaled, seq_length, target=scaled)
+        split_at = len(builder) - val_windows
+        X_train.append(builder.inputs[:split_at])
+        y_train.append(builder.targets[:split_at])
+        X_val.append(builder.inputs[split_at:])
+        y_val.append(builder.targets[split_at:])
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        sampled = rng.choice(stock_ids, min(replay_stocks, len(stock_ids)), replace=False)
+        for stock_id in sampled:
+            df = pd.read_sql("SELECT close FROM daily_prices WHERE stock_id = %s ORDER BY date ASC;", conn, params=(stock_id,))
+            older = len(df) - seq_length - recent_windows - val_windows
+            if older <= 0:
+                continue
+            scaled = fit_stock_scaler(df).transform(df[['close']])
+            builder = SequenceBuilder(scaled, seq_length, target=scaled)
+            idx = rng.choice(older, min(replay_per_stock, older), replace=False)
+            X, y = builder.batch(idx)
+            X_train.append(X)
+            y_train.append(y)
+    except Exception as e:
+        logger.error(f"Error sampling replay windows: {str(e)}")
+    finally:
+        conn.close()
+
+    if not X_train or not X_val:
+        return None, None, None
+    n_train = sum(len(X) for X in X_train)
+    n_val = sum(len(X) for X in X_val)
+    windows = StackedWindows(np.concatenate(X_train + X_val), np.concatenate(y_train + y_val))
+    logger.info(f"Prepared {n_train} replay/recent windows and {n_val} validation windows for global update")
+    return windows, np.arange(n_train), np.arange(n_train, n_train + n_val)
+
+def update_transformer(stock_id=None, registry=None, seq_length=30, recent_windows=20, val_windows=5, replay_size=256,
+                       epochs=3, batch_size=32, lr=1e-4, tolerance=0.0, seed=None):
+    """每日增量更新：載入最新登錄版本，以最新視窗與舊視窗抽樣組成的 replay buffer 微調，
+    驗證損失未退步才發佈；尚無已登錄版本時退回完整訓練"""
+    from models.model_registry import get_model_registry, GLOBAL_SCOPE
+    registry = registry or get_model_registry()
+    scope = stock_id or GLOBAL_SCOPE
+    rng = np.random.default_rng(seed)
+
+    model, scaler, metadata = load_for_update(registry, "transformer", scope)
+    if model is None:
+        logger.info(f"No registered Transformer for {scope}, running full training")
+        return train_and_publish_transformer(stock_id, registry=registry, seq_length=seq_length)
+
+    if stock_id is None:
+        data_version = pd.Timestamp.now().strftime("%Y-%m-%d")
+        if data_version == metadata["data_version"]:
+            logger.info(f"Global Transformer already at {data_version}")
+            return None
+        builder, train_idx, val_idx = global_update_windows(
+            fetch_stock_ids(), seq_length, recent_windows, val_windows,
+            replay_per_stock=max(replay_size // 32, 1), rng=rng
+        )
+        if builder is None:
+            return None
+    else:
+        df = fetch_stock_data(stock_id)
+        if df is None or len(df) < seq_length + val_windows + 1:
+            logger.error(f"Insufficient data to update Transformer for {stock_id}")
+            return None
+        data_version = str(df["date"].iloc[-1])
+        if data_version == metadata["data_version"]:
+            logger.info(f"Transformer for {stock_id} already at {data_version}")
+            return None
+        # 沿用已登錄的 scaler，只有新價格超出原範圍時才擴展，避免輸入分佈每天漂移
+        scaler, _ = update_scaler(scaler, df[['close']].values) if scaler is not None else (fit_stock_scaler(df), True)
+        scaled = scaler.transform(df[['close']])
+        builder = SequenceBuilder(scaled, seq_length, target=scaled)
+        train_idx, val_idx = replay_indices(len(builder), recent_windows, val_windows, replay_size, rng)
+
+    return publish_if_improved(
+        registry, "transformer", scope, data_version, model, metadata, builder, train_idx, val_idx,
+        scaler=scaler, tolerance=tolerance, seq_length=seq_length, epochs=epochs, batch_size=batch_size, lr=lr
+    )
+
+def predict_prices_batch(model, stock_ids, scalers=None, seq_length=30, batch_size=1024):
+    """批次預測多檔股票下一交易日股價：一次查詢取得尾端視窗，縮放後以單一（分塊）前向傳遞推論
+
+    scalers 為 {stock_id: scaler}（個股模型）；未提供的股票以其歷史最小/最大值逐股正規化（全域模型）。
+    """
+    df = fetch_tail_windows(stock_ids, seq_length)
+    if df is None or df.empty:
+        return {}
+    ids, closes, hist_min, hist_max, _ = stack_tail_windows(df, seq_length)
+    if not ids:
+        return {}
+
+    scale, offset = scaling_params(ids, hist_min, hist_max, scalers)
+    X = (closes * scale[:, None] + offset[:, None]).astype(np.float32)[:, :, None]  # [N, seq_length, 1]
+    device = model_device(model)
 
     model.eval()
+    preds = []
     with torch.no_grad():
-        pred_scaled = model(input_tensor).cpu().numpy()
-        pred_price = scaler.inverse_transform(pred_scaled)[0][0]
-    
+        for start in range(0, len(X), batch_size):
+            batch = torch.from_numpy(X[start:start + batch_size]).to(device)
+            preds.append(model(batch).cpu().numpy()[:, 0])
+    pred_prices = (np.concatenate(preds) - offset) / scale
+    logger.info(f"Predicted prices for {len(ids)} stocks in one batch")
+    return {stock_id: float(price) for stock_id, price in zip(ids, pred_prices)}
+
+def predict_price(model, scaler, stock_id, seq_length=30):
+    """預測下一個交易日的股價；scaler 為 None 時（全域模型）以該股歷史逐股正規化"""
+    preds = predict_prices_batch(model, [stock_id], {stock_id: scaler} if scaler is not None else None, seq_length)
+    if stock_id not in preds:
+        logger.error(f"Insufficient data for prediction on stock {stock_id}")
+        return None
+    pred_price = preds[stock_id]
     logger.info(f"Predicted price for {stock_id}: {pred_price:.2f}")
     return pred_price
 
 if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "global":
+        train_and_publish_transformer()
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "update":
+        update_transformer(sys.argv[2] if len(sys.argv) > 2 else None)
+        sys.exit(0)
+
     stock_id = "0050"
     model, scaler = train_transformer(stock_id, epochs=50, seq_length=30)
     if model and scaler:
@@ -9,11 +9,15 @@ import pymongo
 from datetime import datetime, timedelta
 from elasticsearch import Elasticsearch
 from pymilvus import connections, Collection, FieldSchema, CollectionSchema, DataType, utility
-from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 import os
 import json
 from monitoring.logging_config import setup_logging
+from models.transformer import update_transformer, predict_prices_batch, fetch_stock_ids
+from models.model_registry import get_model_registry, GLOBAL_SCOPE
+from models.sentiment_classifier import get_sentiment_classifier, aggregate_daily
+from services.embedding_service import get_embedding_service
+from elasticsearch.helpers import bulk
 
 logger = setup_logging()
 load_dotenv()
@@ -41,7 +45,8 @@ es_client = Elasticsearch(
 # Milvus 配置（移除模組級連線）
 MILVUS_HOST = os.getenv("MILVUS_HOST")
 MILVUS_PORT = os.getenv("MILVUS_PORT")
-embedder = SentenceTransformer('all-MiniLM-L6-v2')
+# 與 NewsController / SentimentAgent 查詢時使用同一個嵌入模型
+embedder = get_embedding_service()
 
 @asset
 def stock_list():
@@ -179,6 +184,7 @@ async def crawl_and_embed_news(stock_id, stock_name, date_str):
                 break
             
             entities = {"stock_id": [], "date": [], "embedding": []}
+            texts = []
             for item in news_data:
                 news_id = item["newsId"]
                 if news_id in processed_docs:
@@ -198,13 +204,13 @@ async def crawl_and_embed_news(stock_id, stock_name, date_str):
                 es_doc = news_doc.copy()
                 es_client.index(index=f"stock_news_{date_str}", id=news_id, body=es_doc)
                 
-                text = f"{news_doc['title']} {news_doc['content']}"
-                embedding = embedder.encode(text).tolist()
+                texts.append(f"{news_doc['title']} {news_doc['content']}")
                 entities["stock_id"].append(stock_id)
                 entities["date"].append(date_str)
-                entities["embedding"].append(embedding)
                 processed_docs.add(news_id)
-            
+
+            # 整頁一次編碼；各股票的爬蟲同時送出時由嵌入服務合併成更大的批次
+            entities["embedding"] = (await embedder.aencode(texts)).tolist()
             milvus_collection.insert([entities["stock_id"], entities["date"], entities["embedding"]])
             logger.info(f"Stored and embedded {len(news_data)} news items for {stock_name} (ID: {stock_id}), page {page}")
             page += 1
@@ -224,6 +230,85 @@ def news_data(stock_list):
     logger.info("Completed news crawling and embedding for all stocks")
     return None
 
+@asset
+def news_sentiment(news_data):
+    """依賴 news_data，以本機 MiniLM 分類器批次為當日全部新聞評分，彙總成每檔股票一筆寫入 sentiment_analysis_{date}"""
+    try:
+        date_str = datetime.today().strftime('%Y-%m-%d')
+        news, seen = [], set()
+        for item in fetch_all_news(date_str):
+            key = (item.get("stock_id"), item.get("news_id"))
+            if item.get("stock_id") and key not in seen:
+                seen.add(key)
+                news.append({"stock_id": item["stock_id"], "news_id": item.get("news_id"), "title": item.get("title"), "content": item.get("content"), "date": date_str})
+        if not news:
+            logger.warning(f"No news to score for {date_str}")
+            return 0
+
+        classifier = get_sentiment_classifier()
+        daily = aggregate_daily(classifier.score_news(news))
+        actions = [
+            {
+                "_index": f"sentiment_analysis_{date_str}",
+                "_id": f"{row['stock_id']}_{date_str}",
+                "_source": {**row, "model": "local_minilm", "model_version": classifier.version}
+            }
+            for row in daily
+        ]
+        bulk(es_client, actions)
+        logger.info(f"Scored {len(news)} news items and stored sentiment for {len(actions)} stocks on {date_str}")
+        return len(actions)
+    except Exception as e:
+        logger.error(f"Error scoring news sentiment: {str(e)}")
+        return None
+
+@asset
+def transformer_models(daily_prices):
+    """依賴 daily_prices，以增量微調更新全域 Transformer 並發佈到模型登錄（API 端只載入不訓練）
+
+    尚無已登錄版本時才完整訓練；微調後驗證損失退步則保留原版本。
+    """
+    try:
+        path = update_transformer()
+        if path is None:
+            logger.info("No new global Transformer published, serving latest registered version")
+            return get_model_registry().latest_version("transformer", GLOBAL_SCOPE)
+        logger.info(f"Published global Transformer to {path}")
+        return path
+    except Exception as e:
+        logger.error(f"Error updating Transformer models: {str(e)}")
+        return None
+
+@asset
+def nightly_predictions(transformer_models):
+    """依賴 transformer_models，以全域模型一次批次預測全部股票並寫入 Elasticsearch"""
+    try:
+        model, _, metadata = get_model_registry().load("transformer", GLOBAL_SCOPE)
+        if model is None:
+            logger.error("No global Transformer registered, skipping nightly predictions")
+            return None
+        date_str = datetime.today().strftime('%Y-%m-%d')
+        preds = predict_prices_batch(model, fetch_stock_ids())
+        actions = [
+            {
+                "_index": f"price_predictions_{date_str}",
+                "_id": f"{stock_id}_{date_str}",
+                "_source": {
+                    "stock_id": stock_id,
+                    "date": date_str,
+                    "predicted_price": price,
+                    "model_version": metadata["data_version"]
+                }
+            }
+            for stock_id, price in preds.items()
+        ]
+        bulk(es_client, actions)
+        logger.info(f"Stored {len(actions)} nightly predictions for {date_str}")
+        return len(actions)
+    except Exception as e:
+        logger.error(f"Error running nightly predictions: {str(e)}")
+        return None
+
 def fetch_all_news(date_str):
     """從 MongoDB 獲取指定日期的所有新聞（備用函數）"""
     try:
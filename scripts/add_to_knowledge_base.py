@@ -1,9 +1,9 @@
 from pymilvus import connections, Collection, FieldSchema, CollectionSchema, DataType, utility
-from sentence_transformers import SentenceTransformer
 import pymongo
 from dotenv import load_dotenv
 import os
 from monitoring.logging_config import setup_logging
+from services.embedding_service import get_embedding_service
 
 logger = setup_logging()
 load_dotenv()
@@ -16,7 +16,7 @@ mongo_db = mongo_client["stock_news"]
 # Milvus 配置
 MILVUS_HOST = "localhost"
 connections.connect(host=MILVUS_HOST, port="19530")
-embedder = SentenceTransformer('all-MiniLM-L6-v2')
+embedder = get_embedding_service()
 
 def fetch_all_news(date_str):
     """從 MongoDB 獲取指定日期的所有新聞"""
@@ -63,25 +63,18 @@ def add_to_milvus(date_str, batch_size=1000):
     for start in range(0, total_records, batch_size):
         end = min(start + batch_size, total_records)
         batch = news_data[start:end]
-        entities = {"stock_id": [], "date": [], "embedding": []}
-
-        # 處理批次中的每條新聞
-        for i, news in enumerate(batch):
-            stock_id = news["stock_id"]
-            date = news["date"]
-            text = f"{news['title']} {news['content']}"
-            try:
-                embedding = embedder.encode(text).tolist()
-                entities["stock_id"].append(stock_id)
-                entities["date"].append(date)
-                entities["embedding"].append(embedding)
-            except Exception as e:
-                logger.error(f"Error embedding news {news['news_id']}: {str(e)}")
-                continue
-
-            # 每處理 100 條記錄一次進度
-            if (i + 1) % 100 == 0:
-                logger.info(f"Processed {start + i + 1} of {total_records} news items in batch {start}-{end}")
+        # 整批一次編碼
+        try:
+            embeddings = embedder.encode([f"{news['title']} {news['content']}" for news in batch])
+        except Exception as e:
+            logger.error(f"Error embedding news batch {start}-{end}: {str(e)}")
+            continue
+        entities = {
+            "stock_id": [news["stock_id"] for news in batch],
+            "date": [news["date"] for news in batch],
+            "embedding": embeddings.tolist()
+        }
+        logger.info(f"Embedded {end} of {total_records} news items")
 
         # 插入批次數據到 Milvus
         try:
@@ -0,0 +1,155 @@
+import argparse
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date as date_cls
+import numpy as np
+from monitoring.logging_config import setup_logging
+from services.llm_backend import StubBackend, ReplayBackend, XAIBackend, consume_backend_seconds, set_llm_backend
+from services.llm_cache import LLMResponseCache, cached_run, get_llm_cache
+
+logger = setup_logging()
+
+# 與各 agent 相同格式的 prompt 模板，供 --target llm 在不連資料庫的情況下壓測快取與後端
+PROMPTS = {
+    "SentimentAgent": "Analyze the sentiment of the following news for stock {stock_id} on {date}:\nCombined News: {stock_id} news\n"
+                      "Return a JSON string with 'stock_id', 'date', 'sentiment', and 'confidence'.",
+    "PredictionAgent": "Based on a sentiment of 'positive' for stock ID {stock_id}, predict the next day's stock price change "
+                       "as a percentage (e.g., '+5%' or '-3%'). Return ONLY a JSON string with 'stock_id' and 'predicted_change'.",
+    "NewsAgent": "Analyze and summarize the following news items for stock {stock_id}:\n[]\n"
+                 "Return a JSON string with 'stock_id', 'summary', and 'key_insights'.",
+    "StrategyAgent": "Explain in a short paragraph why these trading strategy weights suit stock {stock_id} given VIX (20)."
+}
+
+class _Model:
+    def __init__(self, model_id):
+        self.id = model_id
+
+class PromptAgent:
+    """只具備 cached_run 所需屬性的輕量 agent，用於單獨量測 LLM 路徑（快取、single-flight、後端）"""
+
+    def __init__(self, name, model_id="grok-beta"):
+        self.name = name
+        self.model = _Model(model_id)
+        self.tools = []
+        self.description = f"{name} load test"
+
+    def run(self, prompt):
+        raise RuntimeError("PromptAgent has no model, use the stub or replay backend")
+
+def llm_scenario(cache, agents, stock_ids, day):
+    def run(index, stock_id):
+        agent = agents[index % len(agents)]
+        prompt = PROMPTS[agent.name].format(stock_id=stock_id, date=day)
+        validate = None if agent.name == "StrategyAgent" else json.loads
+        return cached_run(agent, prompt, validate=validate, cache=cache)
+    return run
+
+def agent_scenario(name, day, start_date):
+    """以實際 agent 執行（需要 MongoDB / Milvus / Elasticsearch 等服務，LLM 由後端設定決定）"""
+    if name == "sentiment":
+        from ai_agents.sentiment_agent import SentimentAgent
+        agent = SentimentAgent()
+        return lambda index, stock_id: agent.analyze(stock_id, day)
+    if name == "news":
+        from ai_agents.news_agent import NewsAgent
+        agent = NewsAgent()
+        return lambda index, stock_id: agent.search_news(stock_id, stock_id, day)
+    if name == "report":
+        from ai_agents.report_agent import ReportAgent
+        agent = ReportAgent()
+        return lambda index, stock_id: agent.generate_report(stock_id, start_date, day)
+    if name == "prediction":
+        from ai_agents.prediction_agent import PredictionAgent
+        agent = PredictionAgent()
+        return lambda index, stock_id: agent.predict_with_llm(stock_id, "positive")
+    raise ValueError(f"Unknown agent scenario {name}")
+
+def _percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0}
+    values = np.asarray(values) * 1000
+    return {"p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95)),
+            "p99": float(np.percentile(values, 99)), "mean": float(values.mean())}
+
+def run_load(scenario, stock_ids, requests, concurrency):
+    """以 concurrency 個執行緒送出 requests 次呼叫，回傳延遲分佈、後端時間與 agent 自身開銷
+
+    overhead 為總延遲扣除本執行緒的後端時間；single-flight 跟隨者等待他人呼叫的時間也計入 overhead。
+    """
+    def one(index):
+        stock_id = stock_ids[index % len(stock_ids)]
+        consume_backend_seconds()
+        start = time.perf_counter()
+        error = None
+        try:
+            scenario(index, stock_id)
+        except Exception as e:
+            error = str(e)
+        total = time.perf_counter() - start
+        backend = consume_backend_seconds()
+        return total, backend, error
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(one, range(requests)))
+    wall = time.perf_counter() - start
+
+    totals = [total for total, _, _ in samples]
+    backends = [backend for _, backend, _ in samples if backend > 0]
+    overheads = [max(total - backend, 0.0) for total, backend, _ in samples]
+    errors = [error for _, _, error in samples if error]
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "wall_s": wall,
+        "throughput_rps": requests / wall if wall else 0.0,
+        "errors": len(errors),
+        "latency_ms": _percentiles(totals),
+        "backend_ms": _percentiles(backends),
+        "overhead_ms": _percentiles(overheads),
+        "backend_calls": len(backends)
+    }
+
+def build_backend(args):
+    if args.backend == "stub":
+        return StubBackend(latency=args.latency, error_rate=args.error_rate, seed=args.seed)
+    if args.backend == "replay":
+        return ReplayBackend(path=args.replay_path, latency_scale=args.latency_scale)
+    return XAIBackend()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load driver for the agent paths with a pluggable LLM backend")
+    parser.add_argument("--target", default="llm", help="llm, or an agent scenario: sentiment, news, report, prediction")
+    parser.add_argument("--backend", default="stub", choices=["stub", "replay", "xai"])
+    parser.add_argument("--latency", default="lognormal:800,0.5", help="stub latency distribution in ms")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replay-path", default="llm_recordings.jsonl")
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--stocks", type=int, default=50, help="distinct stocks; fewer stocks means more cache reuse")
+    parser.add_argument("--date", default=date_cls.today().isoformat())
+    parser.add_argument("--start-date", default="2024-01-01")
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+
+    backend = set_llm_backend(build_backend(args))
+    stock_ids = [str(1000 + index) for index in range(args.stocks)]
+    random.Random(args.seed).shuffle(stock_ids)
+
+    for concurrency in args.concurrency:
+        if args.target == "llm":
+            # 每輪使用新的行程內快取（不連 Redis），命中率只反映本輪的重複請求
+            cache = LLMResponseCache(redis_client=None, enabled=not args.no_cache)
+            agents = [PromptAgent(name) for name in PROMPTS]
+            scenario = llm_scenario(cache, agents, stock_ids, args.date)
+        else:
+            cache = get_llm_cache()
+            scenario = agent_scenario(args.target, args.date, args.start_date)
+        result = run_load(scenario, stock_ids, args.requests, concurrency)
+        result["backend"] = backend.name
+        result["cache"] = cache.stats()
+        print(json.dumps(result, indent=2))
@@ -0,0 +1,44 @@
+import sys
+import tempfile
+import torch
+from models.export import export_model
+from monitoring.logging_config import setup_logging
+
+logger = setup_logging()
+
+def build_models(seq_length=30):
+    """建立各推論模型（隨機初始化即可比較延遲）"""
+    from models.transformer import TransformerModel, MODEL_CONFIG
+    from models.rlhf_strategy import SimplePolicy
+    from services.trading_strategies import LSTM
+    models = {
+        "transformer": TransformerModel(**MODEL_CONFIG),
+        "policy": SimplePolicy(seq_length * 2),
+        "lstm": LSTM()
+    }
+    try:
+        from models.mamba_model import MambaModel
+        models["mamba"] = MambaModel(input_dim=2)
+    except Exception as e:
+        logger.warning(f"Skipping Mamba benchmark: {str(e)}")
+    return models
+
+def run_benchmark(batch_sizes=(1, 256), seq_length=30, threads=None):
+    """比較 eager、TorchScript 與動態 int8 量化版本的延遲與吞吐量"""
+    if threads:
+        torch.set_num_threads(threads)
+    rows = []
+    for model_type, model in build_models(seq_length).items():
+        for batch_size in batch_sizes:
+            with tempfile.TemporaryDirectory() as out_dir:
+                report = export_model(model, model_type, out_dir, seq_length=seq_length, batch_size=batch_size)
+            for name, entry in report["artifacts"].items():
+                rows.append({"model": model_type, "batch_size": batch_size, "artifact": name, **entry})
+            logger.info(f"{model_type} batch={batch_size}: fastest valid artifact is {report['best']}")
+    return rows
+
+if __name__ == "__main__":
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    print(f"{'model':<12}{'batch':>6}  {'artifact':<20}{'valid':>6}{'p50 ms':>10}{'p95 ms':>10}{'samples/s':>12}{'max diff':>11}")
+    for row in run_benchmark(threads=threads):
+        print(f"{row['model']:<12}{row['batch_size']:>6}  {row['artifact']:<20}{str(row['valid']):>6}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}{row['samples_per_sec']:>12.0f}{row['max_abs_diff']:>11.2e}")
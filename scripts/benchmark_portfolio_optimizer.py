@@ -0,0 +1,59 @@
+import time
+import numpy as np
+from services.portfolio_optimizer import PortfolioOptimizer
+from monitoring.logging_config import setup_logging
+
+logger = setup_logging()
+
+def simulate_returns(n_assets, n_days=750, n_factors=5, seed=0):
+    """以因子模型產生模擬日報酬"""
+    rng = np.random.default_rng(seed)
+    loadings = rng.normal(0.8, 0.3, size=(n_assets, n_factors))
+    factors = rng.normal(0, 0.01, size=(n_days, n_factors))
+    idio = rng.normal(0, 0.015, size=(n_days, n_assets))
+    return factors @ loadings.T + idio
+
+def time_call(func, *args, repeat=3, **kwargs):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def run_benchmark(sizes=(50, 200, 1000)):
+    """比較冷啟動與熱啟動（前一日權重）下各最佳化方法的耗時"""
+    optimizer = PortfolioOptimizer()
+    results = []
+    for n_assets in sizes:
+        returns = simulate_returns(n_assets)
+        cov = optimizer.estimate_covariance(returns, shrinkage="ledoit_wolf")
+        mu = returns.mean(axis=0)
+        # 模擬隔日：多一天資料後重新估計共變異數
+        next_returns = np.vstack([returns[1:], simulate_returns(n_assets, n_days=1, seed=1)])
+        next_cov = optimizer.estimate_covariance(next_returns, shrinkage="ledoit_wolf")
+
+        methods = {
+            "erc": lambda c, w0: optimizer.equal_risk_contribution(c, initial_weights=w0),
+            "min_variance": lambda c, w0: optimizer.minimum_variance(c, initial_weights=w0),
+            "mean_variance": lambda c, w0: optimizer.mean_variance(c, mu, risk_aversion=5.0, initial_weights=w0)
+        }
+        for name, solve in methods.items():
+            cold_time, prev_weights = time_call(solve, cov, None)
+            warm_cold_time, _ = time_call(solve, next_cov, None)
+            warm_time, _ = time_call(solve, next_cov, prev_weights)
+            row = {
+                "assets": n_assets,
+                "method": name,
+                "cold_ms": cold_time * 1000,
+                "next_day_cold_ms": warm_cold_time * 1000,
+                "next_day_warm_ms": warm_time * 1000
+            }
+            results.append(row)
+            logger.info(f"{n_assets:>5} assets {name:<14} cold={row['cold_ms']:.1f}ms next-day cold={row['next_day_cold_ms']:.1f}ms warm={row['next_day_warm_ms']:.1f}ms")
+    return results
+
+if __name__ == "__main__":
+    for row in run_benchmark():
+        print(row)
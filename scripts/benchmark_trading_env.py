@@ -0,0 +1,37 @@
+import sys
+import time
+import numpy as np
+from models.trading_env import VectorStockTradingEnv
+from monitoring.logging_config import setup_logging
+
+logger = setup_logging()
+
+def simulate_series(n_series=64, length=2500, seed=0):
+    """產生隨機漫步收盤價與情緒分數（不需資料庫即可量測）"""
+    rng = np.random.default_rng(seed)
+    closes = [100 * np.exp(np.cumsum(rng.normal(0, 0.01, length))) for _ in range(n_series)]
+    sentiments = [rng.choice([-1.0, 0.0, 1.0], length) for _ in range(n_series)]
+    return closes, sentiments
+
+def run_benchmark(env_counts=(1, 64, 1024, 4096), steps=2000, seq_length=30, seed=0):
+    """量測不同環境數下的 env steps/sec（隨機動作，含觀測值取出）"""
+    closes, sentiments = simulate_series(seed=seed)
+    rng = np.random.default_rng(seed)
+    rows = []
+    for n_envs in env_counts:
+        env = VectorStockTradingEnv(closes, sentiments, n_envs=n_envs, seq_length=seq_length, random_starts=True, seed=seed)
+        env.reset()
+        actions = rng.integers(0, 3, size=(steps, n_envs))
+        start = time.perf_counter()
+        for i in range(steps):
+            env.step(actions[i])
+        elapsed = time.perf_counter() - start
+        row = {"n_envs": n_envs, "steps_per_sec": n_envs * steps / elapsed, "batch_us": elapsed / steps * 1e6}
+        rows.append(row)
+        logger.info(f"VectorStockTradingEnv K={n_envs}: {row['steps_per_sec']:.0f} steps/sec ({row['batch_us']:.1f}us per step)")
+    return rows
+
+if __name__ == "__main__":
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    for row in run_benchmark(steps=steps):
+        print(f"K={row['n_envs']:>5}  {row['steps_per_sec']:>14,.0f} steps/sec  {row['batch_us']:>8.1f} us/step")
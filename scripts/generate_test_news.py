@@ -1,12 +1,12 @@
 from pymongo import MongoClient
 from elasticsearch import Elasticsearch
 from pymilvus import connections, Collection, FieldSchema, CollectionSchema, DataType, utility
-from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 import os
 import json
 import time
 from monitoring.logging_config import setup_logging
+from services.embedding_service import get_embedding_service
 
 logger = setup_logging()
 load_dotenv()
@@ -22,7 +22,7 @@ es_client = Elasticsearch(
 
 MILVUS_HOST = "localhost"
 connections.connect(host=MILVUS_HOST, port="19530")
-embedder = SentenceTransformer('all-MiniLM-L6-v2')
+embedder = get_embedding_service()
 
 def wait_for_milvus():
     max_attempts = 30
@@ -103,12 +103,11 @@ def generate_test_news():
     milvus_collection = Collection(milvus_collection_name, schema)
     milvus_collection.create_index("embedding", {"index_type": "IVF_FLAT", "metric_type": "L2", "params": {"nlist": 1024}})
 
-    entities = {"stock_id": [], "news_id": [], "embedding": []}
-    for news in test_news:
-        embedding = embedder.encode(news["content"]).tolist()
-        entities["stock_id"].append(news["stock_id"])
-        entities["news_id"].append(news["news_id"])
-        entities["embedding"].append(embedding)
+    entities = {
+        "stock_id": [news["stock_id"] for news in test_news],
+        "news_id": [news["news_id"] for news in test_news],
+        "embedding": embedder.encode([news["content"] for news in test_news]).tolist()
+    }
     
     milvus_collection.insert([entities["stock_id"], entities["news_id"], entities["embedding"]])
     logger.info(f"Generated and stored {len(test_news)} test news items in MongoDB, Elasticsearch, and Milvus")
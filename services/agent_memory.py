@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import threading
+from redis import Redis
+from dotenv import load_dotenv
+from monitoring.logging_config import setup_logging
+
+logger = setup_logging()
+load_dotenv()
+
+AGENT_MEMORY_TTL = int(os.getenv("AGENT_MEMORY_TTL", 7 * 86400))
+AGENT_MEMORY_PREFIX = "agent_memory"
+EMPTY_PART = "_"
+
+def params_digest(params):
+    """參數以排序後的 JSON 取 SHA-1 前 16 碼，不同參數的結果互不覆蓋"""
+    if not params:
+        return EMPTY_PART
+    payload = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+class AgentMemoryStore:
+    """以 agent / stock_id / date / params 分命名空間的 Redis 記憶，取代各 agent 單一固定鍵
+
+    鍵格式為 agent_memory:{agent}:{stock_id}:{date}:{params 摘要}，皆以 SETEX 寫入並帶 TTL；
+    另維護 agent_memory:{agent}:latest 指向最近一次寫入，保留原本 read_memory() 無參數的語意。
+    """
+
+    def __init__(self, redis_client, ttl=AGENT_MEMORY_TTL):
+        self.redis_client = redis_client
+        self.ttl = ttl
+
+    @staticmethod
+    def key(agent, stock_id=None, date=None, params=None):
+        return f"{AGENT_MEMORY_PREFIX}:{agent}:{stock_id or EMPTY_PART}:{date or EMPTY_PART}:{params_digest(params)}"
+
+    @staticmethod
+    def latest_key(agent):
+        return f"{AGENT_MEMORY_PREFIX}:{agent}:latest"
+
+    def get(self, agent, stock_id=None, date=None, params=None):
+        key = self.latest_key(agent) if stock_id is None and date is None and not params else self.key(agent, stock_id, date, params)
+        try:
+            data = self.redis_client.get(key)
+            return json.loads(data) if data else None
+        except Exception as e:
+            logger.error(f"Error reading memory {key}: {str(e)}")
+            return None
+
+    def set(self, agent, data, stock_id=None, date=None, params=None, ttl=None):
+        ttl = ttl or self.ttl
+        payload = json.dumps(data, default=str)
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.setex(self.key(agent, stock_id, date, params), ttl, payload)
+            pipe.setex(self.latest_key(agent), ttl, payload)
+            pipe.execute()
+            logger.info(f"Stored memory for {agent}/{stock_id}/{date}")
+            return True
+        except Exception as e:
+            logger.error(f"Error storing memory for {agent}: {str(e)}")
+            return False
+
+    def get_many(self, agent, requests):
+        """以單一 pipeline 批次讀取；requests 為 (stock_id, date, params) 列表，回傳等長結果（缺值為 None）"""
+        if not requests:
+            return []
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for stock_id, date, params in requests:
+                pipe.get(self.key(agent, stock_id, date, params))
+            return [json.loads(data) if data else None for data in pipe.execute()]
+        except Exception as e:
+            logger.error(f"Error batch reading memory for {agent}: {str(e)}")
+            return [None] * len(requests)
+
+    def set_many(self, agent, entries, ttl=None):
+        """以單一 pipeline 批次寫入；entries 為 (stock_id, date, params, data) 列表"""
+        if not entries:
+            return True
+        ttl = ttl or self.ttl
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for stock_id, date, params, data in entries:
+                pipe.setex(self.key(agent, stock_id, date, params), ttl, json.dumps(data, default=str))
+            pipe.setex(self.latest_key(agent), ttl, json.dumps(entries[-1][3], default=str))
+            pipe.execute()
+            logger.info(f"Stored {len(entries)} memories for {agent}")
+            return True
+        except Exception as e:
+            logger.error(f"Error batch storing memory for {agent}: {str(e)}")
+            return False
+
+    def read_through(self, agent, compute, stock_id=None, date=None, params=None, ttl=None):
+        """記憶中已有相同 agent / 股票 / 日期 / 參數的結果時直接回傳，否則執行 compute() 並寫回；None 結果不寫入"""
+        cached = self.get(agent, stock_id, date, params) if stock_id is not None or date is not None or params else None
+        if cached is not None:
+            logger.info(f"Memory hit for {agent}/{stock_id}/{date}")
+            return cached
+        result = compute()
+        if result is not None:
+            self.set(agent, result, stock_id, date, params, ttl)
+        return result
+
+    def invalidate(self, agent, stock_id=None, date=None, params=None):
+        try:
+            self.redis_client.delete(self.key(agent, stock_id, date, params))
+        except Exception as e:
+            logger.error(f"Error invalidating memory for {agent}: {str(e)}")
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_agent_memory():
+    """取得行程內共用的 AgentMemoryStore"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = AgentMemoryStore(Redis(host=os.getenv("REDIS_HOST", "localhost"), port=6379, db=0))
+    return _store
@@ -0,0 +1,154 @@
+import threading
+import numpy as np
+import pandas as pd
+import psycopg2
+from dotenv import load_dotenv
+import os
+from monitoring.logging_config import setup_logging
+
+logger = setup_logging()
+load_dotenv()
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "port": os.getenv("DB_PORT"),
+    "dbname": os.getenv("DB_NAME"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD")
+}
+
+MARKET_INDEX_ID = os.getenv("MARKET_INDEX_ID", "^TWII")
+NAME_DF_PATH = "data/raw/name_df.csv"
+
+class BenchmarkService:
+    """市場指數與產業因子序列：每個交易日載入一次，之後由記憶體提供唯讀陣列"""
+
+    def __init__(self, market_id=MARKET_INDEX_ID, include_sectors=False, name_df_path=NAME_DF_PATH):
+        self.market_id = market_id
+        self.include_sectors = include_sectors
+        self.name_df_path = name_df_path
+        self._lock = threading.Lock()
+        self._loaded_for = None
+        self.market_closes = None
+        self.market_returns = None
+        self.sector_returns = None
+        self.stock_sectors = {}
+
+    def refresh(self, force=False):
+        """若今日尚未載入（或 force=True）則重新載入市場與產業序列"""
+        today = pd.Timestamp.now().date()
+        if not force and self._loaded_for == today:
+            return
+        with self._lock:
+            if not force and self._loaded_for == today:
+                return
+            try:
+                conn = psycopg2.connect(**DB_CONFIG)
+                try:
+                    closes = self._fetch_closes(conn, [self.market_id])
+                    if closes.empty:
+                        logger.error(f"No market data fetched for {self.market_id}")
+                        return
+                    self.market_closes = closes[self.market_id].dropna()
+                    self.market_returns = self.market_closes.pct_change().dropna()
+                    if self.include_sectors:
+                        self.sector_returns = self._build_sector_returns(conn)
+                finally:
+                    conn.close()
+                self._loaded_for = today
+                logger.info(f"Loaded benchmark {self.market_id} with {len(self.market_returns)} returns for {today}")
+            except Exception as e:
+                logger.error(f"Error loading benchmark data: {str(e)}")
+
+    def _fetch_closes(self, conn, stock_ids):
+        query = """
+        SELECT date, stock_id, close
+        FROM daily_prices
+        WHERE stock_id = ANY(%s)
+        ORDER BY date ASC;
+        """
+        df = pd.read_sql(query, conn, params=(list(stock_ids),))
+        if df.empty:
+            return pd.DataFrame()
+        df["date"] = pd.to_datetime(df["date"])
+        return df.pivot(index="date", columns="stock_id", values="close")
+
+    def _build_sector_returns(self, conn):
+        """依 name_df.csv 的產業別建立等權重產業報酬指數"""
+        name_df = pd.read_csv(self.name_df_path, dtype={"股號": str})
+        self.stock_sectors = dict(zip(name_df["股號"], name_df["產業別"]))
+        closes = self._fetch_closes(conn, list(self.stock_sectors))
+        if closes.empty:
+            logger.warning("No constituent data fetched for sector indices")
+            return pd.DataFrame()
+        returns = closes.pct_change(fill_method=None)
+        sectors = returns.columns.map(lambda stock_id: self.stock_sectors.get(stock_id))
+        sector_returns = returns.T.groupby(sectors).mean().T
+        logger.info(f"Built {sector_returns.shape[1]} sector return series")
+        return sector_returns
+
+    @staticmethod
+    def _align(series, dates):
+        index = pd.DatetimeIndex(pd.to_datetime(dates))
+        values = series.reindex(index).to_numpy(dtype=np.float64)
+        values.setflags(write=False)
+        return values
+
+    def market_returns_for(self, dates):
+        """回傳對齊 dates 的市場日報酬（唯讀，缺值為 NaN）"""
+        self.refresh()
+        if self.market_returns is None:
+            return None
+        return self._align(self.market_returns, dates)
+
+    def market_closes_for(self, dates):
+        """回傳對齊 dates 的市場收盤價（唯讀，缺值為 NaN）"""
+        self.refresh()
+        if self.market_closes is None:
+            return None
+        return self._align(self.market_closes, dates)
+
+    def market_closes_tail(self, length):
+        """回傳最近 length 個交易日的市場收盤價（唯讀）"""
+        self.refresh()
+        if self.market_closes is None:
+            return None
+        values = self.market_closes.to_numpy(dtype=np.float64)[-length:]
+        values.setflags(write=False)
+        return values
+
+    def latest_date(self):
+        """市場收盤價的最後交易日（ISO 字串），尚無資料時回傳 None；供快取鍵判斷基準資料是否更新"""
+        self.refresh()
+        if self.market_closes is None or self.market_closes.empty:
+            return None
+        return pd.Timestamp(self.market_closes.index[-1]).strftime("%Y-%m-%d")
+
+    def sector_returns_for(self, stock_id, dates):
+        """回傳該股票所屬產業、對齊 dates 的等權重產業報酬（唯讀）"""
+        self.refresh()
+        if self.sector_returns is None or self.sector_returns.empty:
+            return None
+        sector = self.stock_sectors.get(stock_id)
+        if sector not in self.sector_returns.columns:
+            logger.warning(f"No sector index available for {stock_id}")
+            return None
+        return self._align(self.sector_returns[sector], dates)
+
+_benchmark_service = None
+_benchmark_lock = threading.Lock()
+
+def get_benchmark_service():
+    """取得行程內共用的 BenchmarkService"""
+    global _benchmark_service
+    if _benchmark_service is None:
+        with _benchmark_lock:
+            if _benchmark_service is None:
+                _benchmark_service = BenchmarkService(include_sectors=os.getenv("BENCHMARK_SECTORS", "false").lower() == "true")
+    return _benchmark_service
+
+if __name__ == "__main__":
+    service = get_benchmark_service()
+    service.refresh(force=True)
+    if service.market_returns is not None:
+        print(service.market_returns.tail())
@@ -0,0 +1,144 @@
+import asyncio
+import importlib
+import threading
+import time
+from dotenv import load_dotenv
+import os
+from monitoring.logging_config import setup_logging
+
+logger = setup_logging()
+load_dotenv()
+
+# 逗號分隔的元件名稱；"all" 表示全部，空值表示不預熱
+COMPONENT_WARMUP = os.getenv("COMPONENT_WARMUP", "")
+
+def _resolve(target):
+    """將 "module:attr" 字串匯入為可呼叫物件，回傳 (物件, 匯入耗時 ms)"""
+    if callable(target):
+        return target, 0.0
+    module_name, attr = target.split(":")
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    return getattr(module, attr), (time.perf_counter() - start) * 1000
+
+class _Component:
+    def __init__(self, name, factory, requires):
+        self.name = name
+        self.factory = factory
+        self.requires = tuple(requires)
+        self.instance = None
+        self.status = "pending"
+        self.error = None
+        self.import_ms = None
+        self.init_ms = None
+        self.lock = threading.Lock()
+
+class ComponentRegistry:
+    """延遲建立的元件登錄：控制器、agent 與模型在第一次使用時才匯入並建構
+
+    factory 為 "module:attr" 字串（延遲匯入後以無參數呼叫）或接收 registry 的函式（可再取得其他元件）；
+    每個元件各自加鎖只建構一次，失敗時記錄錯誤並於下次取用時重試。
+    匯入耗時只計入第一個匯入該模組的元件，共用的重型依賴（torch 等）會算在最先建立者身上。
+    """
+
+    def __init__(self):
+        self._components = {}
+        self._warmup_thread = None
+
+    def register(self, name, factory, requires=()):
+        self._components[name] = _Component(name, factory, requires)
+
+    def __contains__(self, name):
+        return name in self._components
+
+    def is_ready(self, name):
+        return self._components[name].status == "ready"
+
+    def get(self, name):
+        """取得元件，必要時建構（阻塞）；建構失敗時拋出原本的例外"""
+        component = self._components[name]
+        if component.status == "ready":
+            return component.instance
+        for dependency in component.requires:
+            self.get(dependency)
+        with component.lock:
+            if component.status != "ready":
+                self._build(component)
+        return component.instance
+
+    async def aget(self, name):
+        """於事件迴圈中取得元件；尚未建構時改在執行緒中建構，不阻塞其他請求"""
+        component = self._components[name]
+        if component.status == "ready":
+            return component.instance
+        return await asyncio.to_thread(self.get, name)
+
+    def _build(self, component):
+        try:
+            factory, import_ms = _resolve(component.factory)
+            start = time.perf_counter()
+            instance = factory() if isinstance(component.factory, str) else factory(self)
+            component.init_ms = (time.perf_counter() - start) * 1000
+            component.import_ms = import_ms
+            component.instance = instance
+            component.status = "ready"
+            component.error = None
+            logger.info(f"Initialized {component.name} (import {import_ms:.0f}ms, init {component.init_ms:.0f}ms)")
+        except Exception as e:
+            component.status = "error"
+            component.error = str(e)
+            logger.error(f"Error initializing {component.name}: {str(e)}")
+            raise
+
+    def warm_up(self, names=None, background=True):
+        """依序建構指定元件（預設全部）；background 為 True 時在背景執行緒進行，立即返回"""
+        names = [name for name in (names or self._components) if name in self._components]
+
+        def run():
+            start = time.perf_counter()
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception:
+                    continue
+            logger.info(f"Warm-up of {len(names)} components finished in {(time.perf_counter() - start) * 1000:.0f}ms")
+            self.log_report()
+
+        if not background:
+            run()
+            return None
+        self._warmup_thread = threading.Thread(target=run, name="component-warmup", daemon=True)
+        self._warmup_thread.start()
+        return self._warmup_thread
+
+    def report(self):
+        """各元件的狀態與匯入 / 建構耗時，依總耗時排序"""
+        rows = []
+        for component in self._components.values():
+            total = (component.import_ms or 0.0) + (component.init_ms or 0.0)
+            rows.append({
+                "name": component.name,
+                "status": component.status,
+                "import_ms": component.import_ms,
+                "init_ms": component.init_ms,
+                "total_ms": total if component.status == "ready" else None,
+                "error": component.error
+            })
+        rows.sort(key=lambda row: row["total_ms"] or 0.0, reverse=True)
+        return rows
+
+    def log_report(self):
+        for row in self.report():
+            if row["status"] == "ready":
+                logger.info(f"Component {row['name']}: import {row['import_ms']:.0f}ms, init {row['init_ms']:.0f}ms")
+            else:
+                logger.info(f"Component {row['name']}: {row['status']}{' (' + row['error'] + ')' if row['error'] else ''}")
+
+def warmup_names(setting=COMPONENT_WARMUP):
+    """解析 COMPONENT_WARMUP：回傳名稱列表、None（全部）或空列表（不預熱）"""
+    setting = (setting or "").strip()
+    if not setting:
+        return []
+    if setting.lower() == "all":
+        return None
+    return [name.strip() for name in setting.split(",") if name.strip()]
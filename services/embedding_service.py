@@ -0,0 +1,192 @@
+import asyncio
+import queue
+import resource
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from prometheus_client import Histogram, Counter
+from dotenv import load_dotenv
+import os
+from monitoring.logging_config import setup_logging
+
+logger = setup_logging()
+load_dotenv()
+
+# 建索引與查詢必須使用同一個模型，全專案統一為多語 MiniLM（384 維）
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+EMBEDDING_DIM = 384
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", 5))
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", 1))
+EMBEDDING_TORCH_THREADS = int(os.getenv("EMBEDDING_TORCH_THREADS", 0))
+
+ENCODE_BATCH_TEXTS = Histogram("embedding_batch_texts", "Texts per encoded batch", ["model"], buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+ENCODE_LATENCY = Histogram("embedding_batch_latency_seconds", "Encode time per batch", ["model"])
+ENCODE_ERRORS = Counter("embedding_batch_errors_total", "Encode batches that raised", ["model"])
+
+class EmbeddingService:
+    """單一模型的共用句向量服務：不同呼叫端的請求在 max_wait_ms 內合併成一批編碼
+
+    encode() 可由任意執行緒呼叫（阻塞到結果完成），aencode() 供事件迴圈使用；
+    批次在最多 workers 個執行緒中執行，輸出一律為 L2 正規化的 float32。模型於第一次編碼時才載入。
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL, batch_size=EMBEDDING_BATCH_SIZE, max_wait_ms=EMBEDDING_MAX_WAIT_MS,
+                 workers=EMBEDDING_WORKERS, model=None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._model = model
+        self._model_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embedding")
+        self._slots = threading.Semaphore(workers)
+        self._dispatcher = None
+        self._dispatcher_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.load_ms = None
+        self.requests = 0
+        self.texts = 0
+        self.batches = 0
+        self.encode_seconds = 0.0
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    if EMBEDDING_TORCH_THREADS:
+                        import torch
+                        torch.set_num_threads(EMBEDDING_TORCH_THREADS)
+                    start = time.perf_counter()
+                    self._model = SentenceTransformer(self.model_name, device="cpu")
+                    self.load_ms = (time.perf_counter() - start) * 1000
+                    logger.info(f"Loaded embedding model {self.model_name} in {self.load_ms:.0f}ms")
+        return self._model
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or not self._dispatcher.is_alive():
+            with self._dispatcher_lock:
+                if self._dispatcher is None or not self._dispatcher.is_alive():
+                    self._dispatcher = threading.Thread(target=self._dispatch, name="embedding-dispatch", daemon=True)
+                    self._dispatcher.start()
+
+    def submit(self, texts):
+        """送出一組文字，回傳 concurrent.futures.Future，結果為 (len(texts), dim) 陣列"""
+        future = Future()
+        if not texts:
+            future.set_result(np.zeros((0, EMBEDDING_DIM), dtype=np.float32))
+            return future
+        self._ensure_dispatcher()
+        self._queue.put((list(texts), future))
+        return future
+
+    def encode(self, texts):
+        """與 SentenceTransformer.encode 相同的形狀慣例：單一字串回傳 (dim,)，列表回傳 (n, dim)"""
+        if isinstance(texts, str):
+            return self.submit([texts]).result()[0]
+        return self.submit(texts).result()
+
+    async def aencode(self, texts):
+        if isinstance(texts, str):
+            return (await asyncio.wrap_future(self.submit([texts])))[0]
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def _collect(self):
+        """等待第一筆請求，之後在 max_wait 內持續收集直到文字數達 batch_size；單筆過大的請求自成一批"""
+        batch = [self._queue.get()]
+        count = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while count < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+            count += len(request[0])
+        return batch
+
+    def _dispatch(self):
+        while True:
+            # 所有 worker 都忙碌時不再收批，讓請求在佇列中累積成更大的批次
+            self._slots.acquire()
+            batch = self._collect()
+            self._executor.submit(self._run, batch)
+
+    def _run(self, batch):
+        # 標記為執行中後呼叫端就無法再取消；已取消的請求（例如 aencode 的協程被取消）不編碼也不回填
+        batch = [(request_texts, future) for request_texts, future in batch if future.set_running_or_notify_cancel()]
+        texts = [text for request_texts, _ in batch for text in request_texts]
+        if not texts:
+            self._slots.release()
+            return
+        start = time.perf_counter()
+        embeddings = None
+        try:
+            embeddings = self.model.encode(
+                texts, batch_size=self.batch_size, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False
+            ).astype(np.float32, copy=False)
+        except Exception as e:
+            ENCODE_ERRORS.labels(self.model_name).inc()
+            logger.error(f"Embedding batch for {self.model_name} failed: {str(e)}")
+            for _, future in batch:
+                future.set_exception(e)
+        finally:
+            self._slots.release()
+        if embeddings is not None:
+            offset = 0
+            for request_texts, future in batch:
+                future.set_result(embeddings[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+        elapsed = time.perf_counter() - start
+        ENCODE_BATCH_TEXTS.labels(self.model_name).observe(len(texts))
+        ENCODE_LATENCY.labels(self.model_name).observe(elapsed)
+        with self._stats_lock:
+            self.requests += len(batch)
+            self.texts += len(texts)
+            self.batches += 1
+            self.encode_seconds += elapsed
+
+    def memory_bytes(self):
+        """模型參數佔用的記憶體；模型尚未載入時為 0"""
+        if self._model is None or not hasattr(self._model, "parameters"):
+            return 0
+        return sum(param.numel() * param.element_size() for param in self._model.parameters())
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "model": self.model_name,
+                "loaded": self._model is not None,
+                "load_ms": self.load_ms,
+                "parameter_bytes": self.memory_bytes(),
+                "requests": self.requests,
+                "texts": self.texts,
+                "batches": self.batches,
+                "queue_depth": self._queue.qsize(),
+                "mean_batch_texts": self.texts / self.batches if self.batches else 0.0,
+                "texts_per_second": self.texts / self.encode_seconds if self.encode_seconds else 0.0
+            }
+
+_services = {}
+_services_lock = threading.Lock()
+
+def get_embedding_service(model_name=EMBEDDING_MODEL):
+    """取得行程內共用的 EmbeddingService，每個模型名稱只建立一次"""
+    service = _services.get(model_name)
+    if service is None:
+        with _services_lock:
+            service = _services.get(model_name)
+            if service is None:
+                service = _services[model_name] = EmbeddingService(model_name)
+    return service
+
+def embedding_stats():
+    """全部已建立服務的統計與行程最大常駐記憶體（RSS）"""
+    return {
+        "services": [service.stats() for service in list(_services.values())],
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    }
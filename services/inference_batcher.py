@@ -0,0 +1,150 @@
+import asyncio
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from prometheus_client import Gauge, Histogram, Counter
+from dotenv import load_dotenv
+import os
+from monitoring.logging_config import setup_logging
+
+logger = setup_logging()
+load_dotenv()
+
+MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", 64))
+MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", 5))
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+# Prometheus 指標在模組層級註冊一次，以 batcher 名稱與模型鍵區分
+QUEUE_DEPTH = Gauge("inference_queue_depth", "Requests waiting in the micro-batch queue", ["batcher", "model"])
+BATCH_SIZE = Histogram("inference_batch_size", "Requests per executed micro-batch", ["batcher", "model"], buckets=BATCH_SIZE_BUCKETS)
+QUEUE_WAIT = Histogram("inference_queue_wait_seconds", "Time from submit to batch execution", ["batcher", "model"])
+BATCH_LATENCY = Histogram("inference_batch_latency_seconds", "Forward-pass time per micro-batch", ["batcher", "model"])
+BATCH_ERRORS = Counter("inference_batch_errors_total", "Micro-batches that raised", ["batcher", "model"])
+
+class _ModelQueue:
+    def __init__(self, handler, version=None):
+        self.handler = handler
+        self.version = version
+        self.queue = asyncio.Queue()
+        # 每個模型一個執行緒：同一模型的前向傳遞依序執行，不同模型可平行
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.task = None
+        self.requests = 0
+        self.batches = 0
+        self.batch_sizes = {}
+
+class MicroBatcher:
+    """推論請求的微批次佇列：同一模型的請求在 max_wait_ms 內或湊滿 max_batch_size 時合併為一批
+
+    handler 接收一批請求（list）並回傳等長的結果 list，於該模型專屬的執行緒中執行，不阻塞事件迴圈；
+    呼叫端以 await submit(key, item) 取得自己那一筆的結果。
+    """
+
+    def __init__(self, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, name="inference"):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def register(self, key, handler, version=None):
+        """註冊模型鍵與批次處理函式；已註冊時只在 version 較新（如新發佈的資料版本）時替換處理函式
+
+        同一鍵沿用同一個佇列與執行緒，模型換版不會再建立新的佇列；已排隊的請求由下一批的處理函式執行。
+        """
+        with self._lock:
+            model_queue = self._queues.get(key)
+            if model_queue is None:
+                model_queue = self._queues[key] = _ModelQueue(handler, version)
+                logger.info(f"Registered micro-batch queue {self.name}/{key}@{version}")
+            elif version is not None and (model_queue.version is None or version > model_queue.version):
+                model_queue.handler, model_queue.version = handler, version
+                logger.info(f"Swapped micro-batch handler {self.name}/{key} to {version}")
+        return model_queue
+
+    def has(self, key, version=None):
+        """鍵已註冊，且（指定 version 時）處理函式不比 version 舊"""
+        model_queue = self._queues.get(key)
+        if model_queue is None:
+            return False
+        return version is None or (model_queue.version is not None and model_queue.version >= version)
+
+    async def submit(self, key, item):
+        """送出單筆請求並等待批次結果"""
+        model_queue = self._queues[key]
+        if model_queue.task is None or model_queue.task.done():
+            model_queue.task = asyncio.get_running_loop().create_task(self._worker(key, model_queue))
+        future = asyncio.get_running_loop().create_future()
+        await model_queue.queue.put((item, future, time.perf_counter()))
+        QUEUE_DEPTH.labels(self.name, str(key)).set(model_queue.queue.qsize())
+        return await future
+
+    async def _collect(self, model_queue):
+        """等待第一筆請求，之後在 max_wait 內持續收集直到湊滿 max_batch_size"""
+        batch = [await model_queue.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(model_queue.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(model_queue.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self, key, model_queue):
+        label = str(key)
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect(model_queue)
+            QUEUE_DEPTH.labels(self.name, label).set(model_queue.queue.qsize())
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                QUEUE_WAIT.labels(self.name, label).observe(started - enqueued)
+            items = [item for item, _, _ in batch]
+            try:
+                results = await loop.run_in_executor(model_queue.executor, model_queue.handler, items)
+                if len(results) != len(items):
+                    raise ValueError(f"Handler returned {len(results)} results for {len(items)} requests")
+                for (_, future, _), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                BATCH_ERRORS.labels(self.name, label).inc()
+                logger.error(f"Micro-batch for {self.name}/{key} failed: {str(e)}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            size = len(batch)
+            BATCH_SIZE.labels(self.name, label).observe(size)
+            BATCH_LATENCY.labels(self.name, label).observe(time.perf_counter() - started)
+            model_queue.requests += size
+            model_queue.batches += 1
+            model_queue.batch_sizes[size] = model_queue.batch_sizes.get(size, 0) + 1
+
+    def stats(self):
+        """各模型佇列的目前深度、累計請求數、批次數與批次大小分佈"""
+        return {
+            str(key): {
+                "version": model_queue.version,
+                "queue_depth": model_queue.queue.qsize(),
+                "requests": model_queue.requests,
+                "batches": model_queue.batches,
+                "mean_batch_size": model_queue.requests / model_queue.batches if model_queue.batches else 0.0,
+                "batch_size_histogram": dict(sorted(model_queue.batch_sizes.items()))
+            }
+            for key, model_queue in list(self._queues.items())
+        }
+
+    def close(self):
+        for model_queue in self._queues.values():
+            if model_queue.task is not None:
+                model_queue.task.cancel()
+            model_queue.executor.shutdown(wait=False)
+        self._queues = {}
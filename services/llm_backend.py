@@ -0,0 +1,219 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from prometheus_client import Histogram
+from dotenv import load_dotenv
+import os
+from monitoring.logging_config import setup_logging
+
+logger = setup_logging()
+load_dotenv()
+
+# xai：實際呼叫 agent.run；stub：離線產生符合 prompt 要求欄位的 JSON；replay：重播錄製的回應
+LLM_BACKEND = os.getenv("LLM_BACKEND", "xai").lower()
+# 延遲分佈（毫秒）：fixed:ms、uniform:low,high、normal:mean,std、lognormal:median,sigma
+LLM_STUB_LATENCY = os.getenv("LLM_STUB_LATENCY", "lognormal:800,0.5")
+LLM_STUB_ERROR_RATE = float(os.getenv("LLM_STUB_ERROR_RATE", 0.0))
+LLM_STUB_SEED = int(os.getenv("LLM_STUB_SEED", 0))
+# xai 後端設定此路徑時把每次呼叫附加寫入 JSONL，供 replay 使用
+LLM_RECORD_PATH = os.getenv("LLM_RECORD_PATH")
+LLM_REPLAY_PATH = os.getenv("LLM_REPLAY_PATH", LLM_RECORD_PATH or "llm_recordings.jsonl")
+# replay 找不到錄製時：stub 改由 stub 產生，error 拋出例外
+LLM_REPLAY_MISS = os.getenv("LLM_REPLAY_MISS", "stub")
+LLM_REPLAY_LATENCY_SCALE = float(os.getenv("LLM_REPLAY_LATENCY_SCALE", 1.0))
+
+BACKEND_LATENCY = Histogram("llm_backend_latency_seconds", "Latency of LLM backend calls", ["backend", "agent"])
+
+FIELDS_PATTERN = re.compile(r"JSON string with ([^.\n]+)")
+FIELD_PATTERN = re.compile(r"'([^']+)'")
+STOCK_PATTERN = re.compile(r"stock(?: ID)? (\w+)")
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+_local = threading.local()
+
+def consume_backend_seconds():
+    """回傳並歸零本執行緒累計的後端耗時，供壓測區分 LLM 時間與 agent 本身的開銷"""
+    seconds = getattr(_local, "seconds", 0.0)
+    _local.seconds = 0.0
+    return seconds
+
+def parse_latency(spec):
+    """將延遲分佈字串轉為取樣函式（回傳秒）"""
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(",") if value.strip()]
+    if kind == "fixed":
+        return lambda rng: values[0] / 1000.0
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000.0
+    if kind == "normal":
+        return lambda rng: max(rng.gauss(values[0], values[1]), 0.0) / 1000.0
+    if kind == "lognormal":
+        return lambda rng: values[0] * rng.lognormvariate(0.0, values[1]) / 1000.0
+    raise ValueError(f"Unknown latency distribution {spec}")
+
+def requested_fields(prompt):
+    """從 prompt 的 "Return a JSON string with 'a', 'b', and 'c'" 取出欄位；要求 JSON 但未列欄位時回傳空列表，不要求 JSON 時回傳 None"""
+    match = FIELDS_PATTERN.search(prompt)
+    if match:
+        return FIELD_PATTERN.findall(match.group(1))
+    return [] if "JSON" in prompt else None
+
+def _stub_value(field, prompt, rng):
+    if field == "stock_id":
+        match = STOCK_PATTERN.search(prompt)
+        return match.group(1) if match else "0000"
+    if field == "date":
+        match = DATE_PATTERN.search(prompt)
+        return match.group(0) if match else time.strftime("%Y-%m-%d")
+    if field == "sentiment":
+        return rng.choice(["positive", "neutral", "negative"])
+    if field == "confidence":
+        return round(rng.uniform(0.5, 0.95), 2)
+    if field == "predicted_change":
+        return f"{rng.uniform(-3.0, 3.0):+.1f}%"
+    if field == "key_insights":
+        return [f"stub insight {index + 1}" for index in range(rng.randint(1, 3))]
+    return f"stub {field}"
+
+def stub_response(prompt, rng):
+    """依 prompt 要求的欄位產生 JSON；不要求 JSON 的 prompt（例如策略說明）回傳一段文字"""
+    fields = requested_fields(prompt)
+    if fields is None:
+        return "Stub explanation: the weights follow recent strategy performance under the current VIX and sentiment regime."
+    if not fields:
+        fields = ["stock_id", "summary", "key_insights"]
+    return json.dumps({field: _stub_value(field, prompt, rng) for field in fields}, ensure_ascii=False)
+
+class LLMBackend:
+    """LLM 後端介面：complete(agent, prompt, key) 回傳完整回應字串；key 為與後端無關的請求鍵"""
+
+    name = "base"
+    requires_api_key = False
+
+    def complete(self, agent, prompt, key):
+        start = time.perf_counter()
+        try:
+            return self._complete(agent, prompt, key)
+        finally:
+            elapsed = time.perf_counter() - start
+            _local.seconds = getattr(_local, "seconds", 0.0) + elapsed
+            BACKEND_LATENCY.labels(self.name, getattr(agent, "name", None) or "agent").observe(elapsed)
+
+    def _complete(self, agent, prompt, key):
+        raise NotImplementedError
+
+    def cache_model_id(self, model_id):
+        """快取鍵使用的模型 id；非正式後端加上前綴，避免離線回應寫入正式快取"""
+        return model_id if self.name == "xai" else f"{self.name}:{model_id}"
+
+class XAIBackend(LLMBackend):
+    """實際呼叫 phi Assistant.run；設定 record_path 時錄製每次回應與延遲"""
+
+    name = "xai"
+    requires_api_key = True
+
+    def __init__(self, record_path=LLM_RECORD_PATH):
+        self.record_path = record_path
+        self._lock = threading.Lock()
+
+    def _complete(self, agent, prompt, key):
+        start = time.perf_counter()
+        response = agent.run(prompt)
+        text = "".join([chunk for chunk in response if chunk is not None])
+        if self.record_path:
+            record = {
+                "key": key,
+                "agent": getattr(agent, "name", None),
+                "prompt": prompt,
+                "response": text,
+                "latency_ms": (time.perf_counter() - start) * 1000
+            }
+            with self._lock, open(self.record_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return text
+
+class StubBackend(LLMBackend):
+    """離線後端：依延遲分佈等待後回傳符合 prompt 欄位的 JSON，可注入錯誤率；同一 prompt 的內容可重現"""
+
+    name = "stub"
+
+    def __init__(self, latency=LLM_STUB_LATENCY, error_rate=LLM_STUB_ERROR_RATE, seed=LLM_STUB_SEED):
+        self.sample_latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.seed = seed
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _complete(self, agent, prompt, key):
+        with self._lock:
+            delay = self.sample_latency(self._rng)
+            failed = self._rng.random() < self.error_rate
+        time.sleep(delay)
+        if failed:
+            raise RuntimeError("Stub LLM backend injected failure")
+        content_seed = int(hashlib.sha1(f"{self.seed}:{prompt}".encode("utf-8")).hexdigest()[:8], 16)
+        return stub_response(prompt, random.Random(content_seed))
+
+class ReplayBackend(LLMBackend):
+    """重播 XAIBackend 錄製的 JSONL：以請求鍵找回應並依錄製延遲（乘上 latency_scale）等待"""
+
+    name = "replay"
+
+    def __init__(self, path=LLM_REPLAY_PATH, miss=LLM_REPLAY_MISS, latency_scale=LLM_REPLAY_LATENCY_SCALE):
+        self.latency_scale = latency_scale
+        self.miss = miss
+        self.fallback = StubBackend() if miss == "stub" else None
+        self.records = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.records[record["key"]] = record
+            logger.info(f"Loaded {len(self.records)} recorded LLM responses from {path}")
+        except FileNotFoundError:
+            logger.warning(f"LLM recording file {path} not found, replay will use {miss} for every request")
+        self.hits = 0
+        self.misses = 0
+
+    def _complete(self, agent, prompt, key):
+        record = self.records.get(key)
+        if record is None:
+            self.misses += 1
+            if self.fallback is None:
+                raise KeyError(f"No recorded LLM response for request {key[:12]}")
+            return self.fallback._complete(agent, prompt, key)
+        self.hits += 1
+        time.sleep(record.get("latency_ms", 0.0) * self.latency_scale / 1000.0)
+        return record["response"]
+
+BACKENDS = {
+    "xai": XAIBackend,
+    "stub": StubBackend,
+    "replay": ReplayBackend
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_llm_backend():
+    """取得 LLM_BACKEND 設定的行程內共用後端"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if LLM_BACKEND not in BACKENDS:
+                    raise ValueError(f"Unknown LLM backend {LLM_BACKEND}, expected one of {', '.join(BACKENDS)}")
+                _backend = BACKENDS[LLM_BACKEND]()
+                logger.info(f"Using {LLM_BACKEND} LLM backend")
+    return _backend
+
+def set_llm_backend(backend):
+    """以指定後端取代共用後端（壓測腳本使用）"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+    return backend
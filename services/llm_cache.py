@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from redis import Redis
+from prometheus_client import Counter, Histogram
+from dotenv import load_dotenv
+from monitoring.logging_config import setup_logging
+from services.llm_backend import get_llm_backend
+
+logger = setup_logging()
+load_dotenv()
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() != "false"
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 86400))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", 1024))
+LLM_CACHE_PREFIX = "llm_cache:"
+
+CACHE_REQUESTS = Counter("llm_cache_requests_total", "LLM cache lookups by tier outcome", ["agent", "result"])
+LATENCY_SAVED = Counter("llm_cache_latency_saved_seconds_total", "Estimated LLM latency avoided by cache hits", ["agent"])
+LLM_LATENCY = Histogram("llm_call_latency_seconds", "Latency of uncached LLM calls", ["agent"])
+
+def tool_signature(tools):
+    """工具的穩定描述：Toolkit 名稱與其註冊的函式名稱"""
+    signature = []
+    for tool in tools or []:
+        functions = getattr(tool, "functions", None)
+        if isinstance(functions, dict):
+            signature.append({"toolkit": getattr(tool, "name", type(tool).__name__), "functions": sorted(functions)})
+        else:
+            signature.append({"function": getattr(tool, "__name__", type(tool).__name__)})
+    return signature
+
+def cache_key(model_id, prompt, tools=None, system=None):
+    """以 (模型 id, 系統描述, prompt, 工具) 的 SHA-256 作為內容定址鍵"""
+    payload = json.dumps({"model": model_id, "system": system, "prompt": prompt, "tools": tool_signature(tools)},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.response = None
+        self.error = None
+
+class LLMResponseCache:
+    """LLM 回應的兩層快取：行程內 LRU + Redis（TTL），並對同時送出的相同 prompt 做 single-flight
+
+    第一個請求實際呼叫模型，其餘相同鍵的並行請求等待其結果；只有通過 validate 的非空回應會被寫入快取，
+    避免把格式錯誤的回應快取下來。命中時以該模型未命中呼叫的平均延遲估算節省的時間。
+    """
+
+    def __init__(self, redis_client=None, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_SIZE, enabled=LLM_CACHE_ENABLED):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._stats = {"memory_hits": 0, "redis_hits": 0, "misses": 0, "shared": 0, "latency_saved": 0.0}
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            response, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return response
+
+    def _put_local(self, key, response, ttl):
+        with self._lock:
+            self._entries[key] = (response, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_redis(self, key):
+        if self.redis_client is None:
+            return None
+        try:
+            value = self.redis_client.get(LLM_CACHE_PREFIX + key)
+            return value.decode("utf-8") if isinstance(value, bytes) else value
+        except Exception as e:
+            logger.warning(f"LLM cache Redis read failed: {str(e)}")
+            return None
+
+    def _put_redis(self, key, response, ttl):
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.setex(LLM_CACHE_PREFIX + key, ttl, response)
+        except Exception as e:
+            logger.warning(f"LLM cache Redis write failed: {str(e)}")
+
+    def _record_hit(self, agent_name, model_id, tier):
+        # single-flight 的跟隨者仍等待了完整呼叫，只省下成本不省延遲
+        saved = 0.0 if tier == "shared" else self._latency.get(model_id, 0.0)
+        with self._lock:
+            self._stats[f"{tier}_hits" if tier != "shared" else "shared"] += 1
+            self._stats["latency_saved"] += saved
+        CACHE_REQUESTS.labels(agent_name, f"{tier}_hit").inc()
+        LATENCY_SAVED.labels(agent_name).inc(saved)
+
+    def get_or_call(self, key, call, agent_name="agent", model_id=None, ttl=None, validate=None):
+        """查詢快取，未命中時執行 call() 取得回應字串並寫入兩層快取"""
+        ttl = ttl or self.ttl
+        if not self.enabled:
+            return call()
+
+        response = self._get_local(key)
+        if response is not None:
+            self._record_hit(agent_name, model_id, "memory")
+            return response
+        response = self._get_redis(key)
+        if response is not None:
+            self._put_local(key, response, ttl)
+            self._record_hit(agent_name, model_id, "redis")
+            return response
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            self._record_hit(agent_name, model_id, "shared")
+            return flight.response
+
+        try:
+            start = time.perf_counter()
+            response = call()
+            elapsed = time.perf_counter() - start
+            LLM_LATENCY.labels(agent_name).observe(elapsed)
+            CACHE_REQUESTS.labels(agent_name, "miss").inc()
+            with self._lock:
+                self._stats["misses"] += 1
+                previous = self._latency.get(model_id)
+                self._latency[model_id] = elapsed if previous is None else 0.9 * previous + 0.1 * elapsed
+            if response and response.strip() and self._valid(response, validate):
+                self._put_local(key, response, ttl)
+                self._put_redis(key, response, ttl)
+            flight.response = response
+            return response
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    @staticmethod
+    def _valid(response, validate):
+        if validate is None:
+            return True
+        try:
+            validate(response)
+            return True
+        except Exception:
+            logger.warning("LLM response failed validation, not caching")
+            return False
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.redis_client is not None:
+            try:
+                self.redis_client.delete(LLM_CACHE_PREFIX + key)
+            except Exception as e:
+                logger.warning(f"LLM cache Redis delete failed: {str(e)}")
+
+    def stats(self):
+        """命中 / 未命中次數、命中率與估計節省的秒數"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["memory_hits"] + stats["redis_hits"] + stats["shared"] + stats["misses"]
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        return stats
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_llm_cache():
+    """取得行程內共用的 LLMResponseCache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMResponseCache(Redis(host=os.getenv("REDIS_HOST", "localhost"), port=6379, db=0))
+    return _cache
+
+def cached_run(agent, prompt, ttl=None, validate=None, cache=None, backend=None):
+    """以快取包裝 LLM 呼叫（預設由 LLM_BACKEND 選擇後端），回傳串接後的回應字串"""
+    backend = backend or get_llm_backend()
+    model_id = getattr(getattr(agent, "model", None), "id", None)
+    tools, system = getattr(agent, "tools", None), getattr(agent, "description", None)
+    # 請求鍵與後端無關，供錄製 / 重播對應；快取鍵依後端區分，離線回應不會寫入正式快取
+    request_key = cache_key(model_id, prompt, tools, system)
+    cache_model_id = backend.cache_model_id(model_id)
+    key = request_key if cache_model_id == model_id else cache_key(cache_model_id, prompt, tools, system)
+
+    def call():
+        return backend.complete(agent, prompt, request_key)
+
+    return (cache or get_llm_cache()).get_or_call(key, call, getattr(agent, "name", None) or "agent", cache_model_id, ttl, validate)
@@ -0,0 +1,194 @@
+import math
+import re
+import pandas as pd
+from dotenv import load_dotenv
+import os
+from monitoring.logging_config import setup_logging
+
+logger = setup_logging()
+load_dotenv()
+
+NEWS_TOKEN_BUDGET = int(os.getenv("NEWS_TOKEN_BUDGET", 2000))
+NEWS_ITEM_TOKENS = int(os.getenv("NEWS_ITEM_TOKENS", 200))
+NEWS_TOKENIZER = os.getenv("NEWS_TOKENIZER", "cl100k_base")
+DEDUP_THRESHOLD = 0.8
+RECENCY_HALF_LIFE_HOURS = 12.0
+SHINGLE_SIZE = 5
+
+SENTENCE_SPLIT = re.compile(r"(?<=[。！？!?；;])|(?<=\.)\s+|\n+")
+TOKEN_PATTERN = re.compile(r"[一-鿿]|[A-Za-z0-9]+")
+
+_encoding = None
+_encoding_loaded = False
+
+def _get_encoding():
+    """延遲載入 tiktoken 編碼（首次使用可能需要下載），失敗時只記錄一次"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(NEWS_TOKENIZER)
+        except Exception as e:
+            logger.warning(f"tiktoken unavailable, approximating token counts: {str(e)}")
+    return _encoding
+
+def count_tokens(text):
+    """以 tiktoken 計算 token 數；無 tiktoken 時以中文字與英數詞數近似"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(TOKEN_PATTERN.findall(text))
+
+def _normalize(text):
+    return re.sub(r"\s+", "", (text or "").lower())
+
+def _shingles(text, size=SHINGLE_SIZE):
+    text = _normalize(text)
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def _terms(text):
+    return [term.lower() for term in TOKEN_PATTERN.findall(text or "")]
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_SPLIT.split(text or "") if sentence and sentence.strip()]
+
+def compress(text, max_tokens, keywords=()):
+    """抽取式壓縮：依位置（導言優先）、關鍵字與標題詞命中為句子評分，保留高分句並維持原順序直到 max_tokens"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    sentences = split_sentences(text)
+    if not sentences:
+        return ""
+    keywords = {keyword.lower() for keyword in keywords}
+    scored = []
+    for position, sentence in enumerate(sentences):
+        terms = _terms(sentence)
+        hits = sum(1 for term in terms if term in keywords)
+        scored.append((1.0 / (1 + position) + hits / (1 + len(terms)) * 2.0, position, sentence))
+
+    kept, used = [], 0
+    for _, position, sentence in sorted(scored, reverse=True):
+        tokens = count_tokens(sentence)
+        if used + tokens > max_tokens:
+            continue
+        kept.append((position, sentence))
+        used += tokens
+    if not kept:
+        # 第一句就超過上限時，依 token 比例截斷
+        first = sentences[0]
+        return first[:max(1, int(len(first) * max_tokens / max(count_tokens(first), 1)))]
+    return " ".join(sentence for _, sentence in sorted(kept))
+
+def _timestamp(item):
+    value = item.get("timestamp") or item.get("date")
+    try:
+        return pd.to_datetime(value)
+    except Exception:
+        return None
+
+class NewsContextBuilder:
+    """在 token 預算內組出新聞 prompt 上下文：去除近似重複、依相關性與時效排序、抽取式壓縮長文
+
+    近似重複以標題加內文開頭的字元 shingle Jaccard 判定，被合併的報導數計入「報導量」加分；
+    相關性為關鍵字（股票代號等）命中率，時效以半衰期衰減。依排序貪婪裝填，每則內文先壓縮到 item_tokens。
+    """
+
+    def __init__(self, budget=NEWS_TOKEN_BUDGET, item_tokens=NEWS_ITEM_TOKENS, dedup_threshold=DEDUP_THRESHOLD,
+                 half_life_hours=RECENCY_HALF_LIFE_HOURS):
+        self.budget = budget
+        self.item_tokens = item_tokens
+        self.dedup_threshold = dedup_threshold
+        self.half_life_hours = half_life_hours
+
+    def deduplicate(self, items):
+        """回傳 [(代表報導, 重複數)]，保留內文較長的一則"""
+        clusters = []
+        for item in items:
+            signature = _shingles((item.get("title") or "") + (item.get("content") or "")[:300])
+            for cluster in clusters:
+                if _jaccard(signature, cluster["signature"]) >= self.dedup_threshold:
+                    cluster["count"] += 1
+                    if len(item.get("content") or "") > len(cluster["item"].get("content") or ""):
+                        cluster["item"] = item
+                    break
+            else:
+                clusters.append({"item": item, "signature": signature, "count": 1})
+        return [(cluster["item"], cluster["count"]) for cluster in clusters]
+
+    def rank(self, clusters, keywords=(), now=None):
+        """依關鍵字相關性、時效與報導量排序"""
+        keywords = {keyword.lower() for keyword in keywords}
+        timestamps = [_timestamp(item) for item, _ in clusters]
+        valid = [ts for ts in timestamps if ts is not None and not pd.isna(ts)]
+        now = now or (max(valid) if valid else None)
+        ranked = []
+        for (item, count), ts in zip(clusters, timestamps):
+            terms = _terms((item.get("title") or "") + " " + (item.get("content") or ""))
+            title_terms = set(_terms(item.get("title")))
+            relevance = (sum(1 for term in terms if term in keywords) / math.sqrt(len(terms) + 1)) + (0.5 if keywords & title_terms else 0.0)
+            recency = 1.0
+            if now is not None and ts is not None and not pd.isna(ts):
+                age_hours = max((now - ts).total_seconds() / 3600.0, 0.0)
+                recency = 0.5 ** (age_hours / self.half_life_hours)
+            score = (1.0 + relevance) * recency * (1.0 + math.log(count))
+            ranked.append((score, item, count))
+        ranked.sort(key=lambda entry: entry[0], reverse=True)
+        return ranked
+
+    @staticmethod
+    def format_item(item, body):
+        prefix = f"[{item.get('date')}] " if item.get("date") else ""
+        return f"{prefix}{item.get('title') or ''}: {body}".strip()
+
+    def build(self, items, keywords=(), budget=None, exclude=None):
+        """回傳 {"text", "items", "tokens_before", "tokens_after", ...}；exclude 為已放入其他段落的簽章，避免重複"""
+        budget = budget or self.budget
+        tokens_before = count_tokens(" ".join((item.get("title") or "") + " " + (item.get("content") or "") for item in items))
+        clusters = self.deduplicate(items)
+        if exclude:
+            clusters = [
+                (item, count) for item, count in clusters
+                if max((_jaccard(_shingles((item.get("title") or "") + (item.get("content") or "")[:300]), other) for other in exclude), default=0.0) < self.dedup_threshold
+            ]
+
+        lines, packed, used = [], [], 0
+        for _, item, count in self.rank(clusters, keywords):
+            remaining = budget - used
+            if remaining < 20:
+                break
+            body = compress(item.get("content") or "", min(self.item_tokens, remaining - count_tokens(item.get("title") or "") - 8), keywords)
+            line = self.format_item(item, body)
+            tokens = count_tokens(line)
+            if tokens > remaining:
+                continue
+            lines.append(line)
+            packed.append(item)
+            used += tokens
+
+        text = "\n".join(lines)
+        context = {
+            "text": text,
+            "items": packed,
+            "signatures": [_shingles((item.get("title") or "") + (item.get("content") or "")[:300]) for item in packed],
+            "items_in": len(items),
+            "items_unique": len(clusters),
+            "items_packed": len(packed),
+            "tokens_before": tokens_before,
+            "tokens_after": count_tokens(text)
+        }
+        return context
+
+def query_text(context, max_tokens=128):
+    """以排序最前面的報導標題組成向量搜尋的查詢文字，長度固定在 max_tokens 內"""
+    titles = [item.get("title") or "" for item in context["items"]]
+    return compress("。".join(title for title in titles if title), max_tokens)
@@ -0,0 +1,198 @@
+import numpy as np
+import pandas as pd
+from monitoring.logging_config import setup_logging
+
+logger = setup_logging()
+
+class PortfolioOptimizer:
+    """多資產權重最佳化：等風險貢獻、最小變異數與均值-變異數（效率前緣）"""
+
+    def __init__(self, max_iter=1000, tol=1e-8):
+        self.max_iter = max_iter
+        self.tol = tol
+
+    def estimate_covariance(self, returns, shrinkage=None):
+        """估計年化前的共變異數矩陣
+
+        shrinkage 為 None 時使用樣本共變異數；"ledoit_wolf" 使用 Ledoit-Wolf 最適收縮強度
+        （目標為縮放後單位矩陣）；傳入 0~1 的浮點數則使用固定收縮強度。
+        """
+        labels = None
+        if isinstance(returns, pd.DataFrame):
+            returns = returns.dropna()
+            labels = list(returns.columns)
+            returns = returns.values
+        X = np.asarray(returns, dtype=np.float64)
+        n_obs, n_assets = X.shape
+        X = X - X.mean(axis=0)
+        sample = X.T @ X / n_obs
+
+        if shrinkage is None:
+            cov = sample
+            intensity = 0.0
+        else:
+            mu = np.trace(sample) / n_assets
+            target = mu * np.eye(n_assets)
+            if shrinkage == "ledoit_wolf":
+                delta = np.sum((sample - target) ** 2)
+                row_norms = np.sum(X ** 2, axis=1)
+                beta = (np.sum(row_norms ** 2) - n_obs * np.sum(sample ** 2)) / n_obs ** 2
+                intensity = 0.0 if delta == 0 else min(max(beta, 0.0), delta) / delta
+            else:
+                intensity = float(shrinkage)
+            cov = intensity * target + (1 - intensity) * sample
+
+        logger.info(f"Estimated covariance for {n_assets} assets over {n_obs} observations (shrinkage={intensity:.4f})")
+        if labels is not None:
+            return pd.DataFrame(cov, index=labels, columns=labels)
+        return cov
+
+    def equal_risk_contribution(self, cov, initial_weights=None, budgets=None):
+        """等風險貢獻（風險平價）權重，使用循環座標下降法並可由前一日權重熱啟動"""
+        cov, labels = self._unpack(cov)
+        n = cov.shape[0]
+        b = np.full(n, 1.0 / n) if budgets is None else np.asarray(budgets, dtype=np.float64) / np.sum(budgets)
+        diag = np.diag(cov).copy()
+
+        w0 = self._initial_point(initial_weights, labels, n)
+        if w0 is None:
+            w0 = 1.0 / np.sqrt(diag)
+            w0 /= w0.sum()
+        # 最適解滿足 y'Σy = sum(b) = 1，先將起始點縮放到該尺度可大幅減少迭代次數
+        y = w0 / np.sqrt(w0 @ cov @ w0)
+        sigma_y = cov @ y
+
+        iterations = 0
+        for iterations in range(1, self.max_iter + 1):
+            max_change = 0.0
+            for i in range(n):
+                c = sigma_y[i] - diag[i] * y[i]
+                y_new = (-c + np.sqrt(c * c + 4 * diag[i] * b[i])) / (2 * diag[i])
+                delta = y_new - y[i]
+                if delta != 0.0:
+                    sigma_y += cov[:, i] * delta
+                    y[i] = y_new
+                    max_change = max(max_change, abs(delta))
+            if max_change < self.tol:
+                break
+
+        weights = y / y.sum()
+        logger.info(f"ERC converged in {iterations} sweeps for {n} assets")
+        return self._pack(weights, labels)
+
+    def minimum_variance(self, cov, initial_weights=None, long_only=True):
+        """最小變異數權重（權重和為 1，預設不可放空）"""
+        cov, labels = self._unpack(cov)
+        n = cov.shape[0]
+        if not long_only:
+            ones = np.ones(n)
+            x = np.linalg.solve(cov, ones)
+            return self._pack(x / x.sum(), labels)
+        weights = self._projected_gradient(cov, np.zeros(n), 1.0, self._initial_point(initial_weights, labels, n))
+        return self._pack(weights, labels)
+
+    def mean_variance(self, cov, expected_returns, risk_aversion=1.0, initial_weights=None):
+        """均值-變異數權重：最大化 w'μ - (λ/2) w'Σw，權重和為 1 且不可放空"""
+        cov, labels = self._unpack(cov)
+        n = cov.shape[0]
+        mu = self._align_vector(expected_returns, labels)
+        weights = self._projected_gradient(cov, mu, risk_aversion, self._initial_point(initial_weights, labels, n))
+        return self._pack(weights, labels)
+
+    def efficient_frontier(self, cov, expected_returns, risk_aversions=None, initial_weights=None):
+        """沿風險趨避係數掃描效率前緣，每個點由前一個解熱啟動"""
+        cov_arr, labels = self._unpack(cov)
+        mu = self._align_vector(expected_returns, labels)
+        if risk_aversions is None:
+            risk_aversions = np.logspace(3, -1, 20)
+
+        frontier = []
+        weights = self._initial_point(initial_weights, labels, cov_arr.shape[0])
+        for risk_aversion in risk_aversions:
+            weights = self._projected_gradient(cov_arr, mu, risk_aversion, weights)
+            frontier.append({
+                "risk_aversion": float(risk_aversion),
+                "expected_return": float(weights @ mu),
+                "volatility": float(np.sqrt(weights @ cov_arr @ weights)),
+                "weights": self._pack(weights.copy(), labels)
+            })
+        return frontier
+
+    def risk_contributions(self, cov, weights):
+        """各資產對組合波動度的風險貢獻比例"""
+        cov, labels = self._unpack(cov)
+        w = self._align_vector(weights, labels)
+        marginal = cov @ w
+        contributions = w * marginal / (w @ marginal)
+        return self._pack(contributions, labels)
+
+    def _projected_gradient(self, cov, mu, risk_aversion, w0):
+        """FISTA 加速投影梯度法，投影到單純形（權重和為 1、非負）"""
+        n = cov.shape[0]
+        w = np.full(n, 1.0 / n) if w0 is None else self._project_simplex(w0)
+        # Gershgorin 上界與跡皆為半正定矩陣最大特徵值的上界，不需做特徵分解
+        lipschitz = risk_aversion * min(np.abs(cov).sum(axis=1).max(), np.trace(cov))
+        if lipschitz <= 0:
+            return w
+        step = 1.0 / lipschitz
+
+        z = w.copy()
+        t = 1.0
+        iterations = 0
+        for iterations in range(1, self.max_iter + 1):
+            grad = risk_aversion * (cov @ z) - mu
+            w_next = self._project_simplex(z - step * grad)
+            t_next = (1 + np.sqrt(1 + 4 * t * t)) / 2
+            z = w_next + ((t - 1) / t_next) * (w_next - w)
+            change = np.abs(w_next - w).sum()
+            w, t = w_next, t_next
+            if change < self.tol:
+                break
+        logger.info(f"Projected gradient converged in {iterations} iterations for {n} assets")
+        return w
+
+    @staticmethod
+    def _project_simplex(v):
+        """歐氏投影到機率單純形"""
+        u = np.sort(v)[::-1]
+        css = np.cumsum(u) - 1
+        idx = np.arange(1, len(v) + 1)
+        rho = idx[u - css / idx > 0][-1]
+        theta = css[rho - 1] / rho
+        return np.maximum(v - theta, 0.0)
+
+    @staticmethod
+    def _unpack(cov):
+        if isinstance(cov, pd.DataFrame):
+            return cov.values.astype(np.float64), list(cov.columns)
+        return np.asarray(cov, dtype=np.float64), None
+
+    @staticmethod
+    def _pack(weights, labels):
+        if labels is None:
+            return weights
+        return pd.Series(weights, index=labels)
+
+    @staticmethod
+    def _align_vector(values, labels):
+        if isinstance(values, dict):
+            values = pd.Series(values)
+        if isinstance(values, pd.Series):
+            if labels is not None:
+                values = values.reindex(labels).fillna(0.0)
+            values = values.values
+        return np.asarray(values, dtype=np.float64)
+
+    def _initial_point(self, initial_weights, labels, n):
+        """整理熱啟動權重；新加入的資產給予平均權重"""
+        if initial_weights is None:
+            return None
+        if isinstance(initial_weights, dict):
+            initial_weights = pd.Series(initial_weights)
+        if isinstance(initial_weights, pd.Series) and labels is not None:
+            initial_weights = initial_weights.reindex(labels).fillna(1.0 / n)
+        w0 = np.clip(np.asarray(initial_weights, dtype=np.float64), 1e-12, None)
+        if w0.shape != (n,):
+            logger.warning(f"Ignoring initial weights with shape {w0.shape}, expected ({n},)")
+            return None
+        return w0 / w0.sum()
@@ -0,0 +1,224 @@
+import json
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+from numpy.lib.stride_tricks import sliding_window_view
+from monitoring.logging_config import setup_logging
+from services.trading_strategies import LSTM
+
+logger = setup_logging()
+
+TRADING_DAYS = 252
+RISK_FREE_RATE = 0.01
+
+class PriceContext:
+    """單次請求共用的價格上下文：收盤價、對照價格（大盤或配對股票）與日期索引皆為 NumPy 陣列
+
+    報酬率、差分等衍生陣列只計算一次並快取，供十個策略與風險指標共用，不再逐一 json.loads 與建立 pd.Series。
+    """
+
+    def __init__(self, prices, market_prices=None, dates=None):
+        self.closes = np.asarray(prices, dtype=np.float64).reshape(-1)
+        self.market = None if market_prices is None else np.asarray(market_prices, dtype=np.float64).reshape(-1)
+        self.dates = pd.DatetimeIndex(pd.to_datetime(dates)) if dates is not None else None
+        self._cache = {}
+
+    @classmethod
+    def from_json(cls, prices, market_prices=None):
+        """LLM 工具呼叫的邊界：由 JSON 字串建立"""
+        return cls(json.loads(prices), json.loads(market_prices) if market_prices else None)
+
+    def __len__(self):
+        return len(self.closes)
+
+    def _cached(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    @property
+    def returns(self):
+        """日報酬率（等同 pct_change().dropna()）"""
+        return self._cached("returns", lambda: self.closes[1:] / self.closes[:-1] - 1.0)
+
+    @property
+    def diffs(self):
+        return self._cached("diffs", lambda: np.diff(self.closes))
+
+    @property
+    def aligned_pair(self):
+        """以尾端對齊的 (收盤價, 對照價格)，長度取兩者較短者"""
+        def align():
+            n = min(len(self.closes), len(self.market))
+            return self.closes[len(self.closes) - n:], self.market[len(self.market) - n:]
+        return self._cached("aligned_pair", align)
+
+    @property
+    def aligned_returns(self):
+        """尾端對齊的 (個股報酬, 對照報酬)"""
+        def align():
+            closes, market = self.aligned_pair
+            return closes[1:] / closes[:-1] - 1.0, market[1:] / market[:-1] - 1.0
+        return self._cached("aligned_returns", align)
+
+    def rolling_std(self, values, window, key):
+        """完整的 rolling(window).std() 序列（只含完整視窗）"""
+        return self._cached(("rolling_std", key, window), lambda: _rolling(values, window).std(axis=1, ddof=1))
+
+    def series(self):
+        """轉回 pd.Series（相容舊介面）"""
+        return pd.Series(self.closes, index=self.dates)
+
+    def to_json(self):
+        return json.dumps(self.closes.tolist())
+
+def _rolling(values, window):
+    if len(values) < window:
+        return np.empty((0, window))
+    return sliding_window_view(values, window)
+
+def _tail(values, window, reducer, ddof=None):
+    """最後一個完整視窗的統計量；資料不足時為 NaN（與 pandas rolling 相同）"""
+    if len(values) < window:
+        return np.nan
+    tail = values[-window:]
+    return reducer(tail, ddof=ddof) if ddof is not None else reducer(tail)
+
+def _ewm_last(values, span):
+    """pandas ewm(span=span, adjust=True).mean() 的最後一個值"""
+    alpha = 2.0 / (span + 1.0)
+    weights = (1.0 - alpha) ** np.arange(len(values) - 1, -1, -1)
+    return float(np.dot(weights, values) / weights.sum())
+
+def _signal(long_condition, short_condition, expected):
+    if long_condition:
+        return 1, expected
+    if short_condition:
+        return -1, -expected
+    return 0, 0.0
+
+def momentum_breakout(ctx, window=20):
+    closes = ctx.closes
+    if len(closes) < window + 1:
+        return 0, 0.0
+    previous = closes[-window - 1:-1]
+    return _signal(closes[-1] > previous.max(), closes[-1] < previous.min(), 0.02)
+
+def mean_reversion(ctx, window=20):
+    mean, std = _tail(ctx.closes, window, np.mean), _tail(ctx.closes, window, np.std, ddof=1)
+    return _signal(ctx.closes[-1] < mean - std, ctx.closes[-1] > mean + std, 0.015)
+
+def chaos_phase_transition(ctx, window=20):
+    volatility = ctx.rolling_std(ctx.returns, window, "returns")
+    trend = _tail(ctx.diffs, window, np.mean)
+    if len(volatility) and volatility[-1] > volatility.mean() * 1.5:
+        return 0, 0.0
+    return (1, 0.01) if trend > 0 else (-1, -0.01)
+
+def llm_sentiment_trend(ctx, sentiment_score):
+    trend = _tail(ctx.returns, 10, np.mean)
+    return _signal(sentiment_score > 0.5 and trend > 0, sentiment_score < -0.5 and trend < 0, 0.025)
+
+def rlhf_volatility_arbitrage(ctx, window=20):
+    vol = ctx.rolling_std(ctx.returns, window, "returns")
+    if not len(vol):
+        return 0, 0.0
+    return _signal(vol[-1] > vol.mean() * 1.2, vol[-1] < vol.mean() * 0.8, 0.01)
+
+def brownian_diffusion(ctx, window=20):
+    smoothed = _ewm_last(ctx.closes, window)
+    return _signal(ctx.closes[-1] > smoothed, ctx.closes[-1] < smoothed, 0.015)
+
+def quantum_fluctuation(ctx, window=20):
+    draw = np.random.normal(0, 1)
+    signal = 1 if draw > 1 else -1 if draw < -1 else 0
+    return signal, 0.01 if signal != 0 else 0.0
+
+def low_risk_pair_trading(ctx, window=20):
+    if ctx.market is None:
+        return 0, 0.0
+    closes, pair = ctx.aligned_pair
+    spread = closes - pair
+    mean, std = _tail(spread, window, np.mean), _tail(spread, window, np.std, ddof=1)
+    return _signal(spread[-1] < mean - std, spread[-1] > mean + std, 0.01)
+
+def lstm_momentum(ctx, window=20, steps=10):
+    closes = ctx.closes
+    if len(closes) < 2:
+        return 0, 0.0
+    model = LSTM()
+    X = torch.from_numpy(closes[:-1].astype(np.float32)).reshape(-1, 1, 1)
+    y = torch.from_numpy(closes[1:].astype(np.float32)).reshape(-1, 1)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
+    loss_fn = nn.MSELoss()
+    for _ in range(steps):
+        loss = loss_fn(model(X), y)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    with torch.no_grad():
+        pred = model(X[-1:]).item()
+    return (1, 0.02) if pred > closes[-1] else (-1, -0.02)
+
+def sentiment_stat_arb(ctx, sentiment_score):
+    mean = _tail(ctx.closes, 20, np.mean)
+    return _signal(sentiment_score > 0.5 and ctx.closes[-1] < mean, sentiment_score < -0.5 and ctx.closes[-1] > mean, 0.015)
+
+STRATEGIES = {
+    "momentum_breakout": momentum_breakout,
+    "mean_reversion": mean_reversion,
+    "chaos_phase_transition": chaos_phase_transition,
+    "llm_sentiment_trend": llm_sentiment_trend,
+    "rlhf_volatility_arbitrage": rlhf_volatility_arbitrage,
+    "brownian_diffusion": brownian_diffusion,
+    "quantum_fluctuation": quantum_fluctuation,
+    "low_risk_pair_trading": low_risk_pair_trading,
+    "lstm_momentum": lstm_momentum,
+    "sentiment_stat_arb": sentiment_stat_arb
+}
+SENTIMENT_STRATEGIES = {"llm_sentiment_trend", "sentiment_stat_arb"}
+
+def evaluate_strategies(ctx, sentiment_score):
+    """以同一個 PriceContext 計算十個策略，回傳 (signals, expected_returns)；單一策略失敗時記為 (0, 0.0)"""
+    signals, expected_returns = {}, {}
+    for name, strategy in STRATEGIES.items():
+        try:
+            signal, expected = strategy(ctx, sentiment_score) if name in SENTIMENT_STRATEGIES else strategy(ctx)
+        except Exception as e:
+            logger.error(f"Error evaluating {name}: {str(e)}")
+            signal, expected = 0, 0.0
+        signals[name], expected_returns[name] = int(signal), float(expected)
+    return signals, expected_returns
+
+def _safe_ratio(numerator, denominator):
+    return float(numerator / denominator) if denominator not in (0, 0.0) and np.isfinite(denominator) else 0.0
+
+def risk_metrics(ctx, risk_free_rate=RISK_FREE_RATE):
+    """一次計算 VaR、Sharpe、Beta、最大回撤等指標，公式與 RiskManagement.calculate_* 相同"""
+    returns = ctx.returns
+    daily_rf = risk_free_rate / TRADING_DAYS
+    excess = returns - daily_rf
+    var = float(np.quantile(returns, 0.05)) if len(returns) else 0.0
+    tail = returns[returns <= var]
+    downside = returns[returns < 0]
+    roll_max = np.maximum.accumulate(ctx.closes)
+    metrics = {
+        "VaR": var,
+        "Sharpe": _safe_ratio(excess.mean(), excess.std(ddof=1)) * np.sqrt(TRADING_DAYS) if len(returns) > 1 else 0.0,
+        "Beta": 0.0,
+        "MaxDrawdown": float(((ctx.closes - roll_max) / roll_max).min()) if len(ctx.closes) else 0.0,
+        "Volatility": float(returns.std(ddof=1) * np.sqrt(TRADING_DAYS)) if len(returns) > 1 else 0.0,
+        "CVaR": float(tail.mean()) if len(tail) else 0.0,
+        "Sortino": _safe_ratio(excess.mean(), downside.std(ddof=1)) * np.sqrt(TRADING_DAYS) if len(downside) > 1 else 0.0,
+        "JensenAlpha": 0.0,
+        "Treynor": 0.0
+    }
+    if ctx.market is not None:
+        stock_returns, market_returns = ctx.aligned_returns
+        if len(stock_returns) > 1:
+            beta = _safe_ratio(np.cov(stock_returns, market_returns)[0, 1], market_returns.var(ddof=1))
+            metrics["Beta"] = beta
+            metrics["JensenAlpha"] = float(stock_returns.mean() - (risk_free_rate + beta * (market_returns.mean() - risk_free_rate)))
+            metrics["Treynor"] = _safe_ratio((stock_returns - daily_rf).mean(), beta)
+    return {name: float(value) for name, value in metrics.items()}
@@ -5,6 +5,8 @@ from elasticsearch import Elasticsearch
 from dotenv import load_dotenv
 import os
 from monitoring.logging_config import setup_logging
+from services.portfolio_optimizer import PortfolioOptimizer
+from services.benchmark_service import get_benchmark_service
 
 logger = setup_logging()
 load_dotenv()
@@ -25,6 +27,8 @@ ES_CONFIG = {
 class RiskManagement:
     def __init__(self):
         self.es_client = Elasticsearch(**ES_CONFIG)
+        self.optimizer = PortfolioOptimizer()
+        self.benchmark = get_benchmark_service()
 
     def fetch_stock_data(self, stock_id, start_date="2023-01-01", end_date="2024-08-12"):
         """從資料庫獲取股價數據"""
@@ -51,26 +55,37 @@ class RiskManagement:
         """從資料庫獲取市場數據（假設為 TWII）"""
         return self.fetch_stock_data("^TWII", start_date, end_date)
 
+    def align_market_returns(self, returns):
+        """將個股報酬與記憶體中的市場報酬依日期對齊，只保留兩者皆有值的交易日"""
+        market = self.benchmark.market_returns_for(returns.index)
+        if market is None:
+            logger.error("No market returns available from benchmark service")
+            return returns, None
+        valid = ~np.isnan(market)
+        stock_returns = returns[valid]
+        return stock_returns, pd.Series(market[valid], index=stock_returns.index)
+
     def calculate_risk_metrics(self, stock_id, start_date="2023-01-01", end_date="2024-08-12"):
         """計算風險指標並存入 Elasticsearch"""
         stock_df = self.fetch_stock_data(stock_id, start_date, end_date)
-        market_df = self.fetch_market_data(start_date, end_date)
-        if stock_df is None or market_df is None:
+        if stock_df is None:
             return None
 
         returns = stock_df['close'].pct_change().dropna()
-        market_returns = market_df['close'].pct_change().dropna()
+        stock_returns, market_returns = self.align_market_returns(returns)
+        if market_returns is None:
+            return None
 
         metrics = {
             "VaR": self.calculate_var(returns),
             "Sharpe": self.calculate_sharpe(returns),
-            "Beta": self.calculate_beta(returns, market_returns),
+            "Beta": self.calculate_beta(stock_returns, market_returns),
             "MaxDrawdown": self.calculate_max_drawdown(stock_df['close']),
             "Volatility": self.calculate_volatility(returns),
             "CVaR": self.calculate_cvar(returns),
             "Sortino": self.calculate_sortino(returns),
-            "JensenAlpha": self.calculate_jensen_alpha(returns, market_returns),
-            "Treynor": self.calculate_treynor(returns, market_returns)
+            "JensenAlpha": self.calculate_jensen_alpha(stock_returns, market_returns),
+            "Treynor": self.calculate_treynor(stock_returns, market_returns)
         }
 
         # 風險警報與策略風險管理
@@ -78,7 +93,7 @@ class RiskManagement:
         strategy_risk = {
             "StopLoss": self.calculate_stop_loss(stock_df['close']),
             "DynamicPositionSizing": self.calculate_dynamic_position_sizing(stock_df['close'], balance=10000),
-            "RiskParity": self.calculate_risk_parity(returns, market_returns)
+            "RiskParity": self.calculate_risk_parity(stock_returns, market_returns)
         }
         metrics.update(strategy_risk)
 
@@ -203,6 +218,75 @@ class RiskManagement:
             logger.error(f"Error in calculate_risk_parity: {str(e)}")
             return 0.5
 
+    def fetch_previous_weights(self, method, end_date):
+        """從 Elasticsearch 取得最近一次（早於 end_date）的組合權重，供最佳化熱啟動"""
+        try:
+            query = {
+                "query": {
+                    "bool": {
+                        "filter": [
+                            {"term": {"method": method}},
+                            {"range": {"date": {"lt": end_date}}}
+                        ]
+                    }
+                },
+                "sort": [{"date": {"order": "desc"}}],
+                "size": 1
+            }
+            response = self.es_client.search(index="portfolio_weights_*", body=query)
+            hits = response["hits"]["hits"]
+            if not hits:
+                return None
+            return hits[0]["_source"]["weights"]
+        except Exception as e:
+            logger.error(f"Error fetching previous weights: {str(e)}")
+            return None
+
+    def calculate_portfolio_weights(self, stock_ids, method="erc", start_date="2023-01-01", end_date="2024-08-12", shrinkage="ledoit_wolf", risk_aversion=5.0):
+        """計算多檔股票的組合權重（erc / min_variance / mean_variance）並存入 Elasticsearch"""
+        closes = {}
+        for stock_id in stock_ids:
+            df = self.fetch_stock_data(stock_id, start_date, end_date)
+            if df is not None:
+                closes[stock_id] = df['close']
+        if len(closes) < 2:
+            logger.error(f"Need at least 2 stocks with data for portfolio weights, got {len(closes)}")
+            return None
+
+        try:
+            returns = pd.DataFrame(closes).pct_change().dropna()
+            cov = self.optimizer.estimate_covariance(returns, shrinkage=shrinkage)
+            previous = self.fetch_previous_weights(method, end_date)
+
+            if method == "erc":
+                weights = self.optimizer.equal_risk_contribution(cov, initial_weights=previous)
+            elif method == "min_variance":
+                weights = self.optimizer.minimum_variance(cov, initial_weights=previous)
+            elif method == "mean_variance":
+                expected_returns = returns.mean()
+                weights = self.optimizer.mean_variance(cov, expected_returns, risk_aversion=risk_aversion, initial_weights=previous)
+            else:
+                logger.error(f"Unknown portfolio method {method}")
+                return None
+        except Exception as e:
+            logger.error(f"Error in calculate_portfolio_weights: {str(e)}")
+            return None
+
+        weights = {stock_id: float(w) for stock_id, w in weights.items()}
+        doc = {
+            "method": method,
+            "date": end_date,
+            "stock_ids": list(weights),
+            "weights": weights,
+            "timestamp": pd.Timestamp.now().isoformat()
+        }
+        try:
+            self.es_client.index(index=f"portfolio_weights_{end_date}", id=f"{method}_{end_date}", body=doc)
+        except Exception as e:
+            logger.error(f"Error storing portfolio weights: {str(e)}")
+        logger.info(f"Portfolio weights ({method}) for {len(weights)} stocks: {weights}")
+        return weights
+
     def check_risk_alerts(self, stock_id, metrics):
         """檢查風險警報"""
         if metrics["VaR"] < -0.05:
@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+from scipy.optimize import nnls
+from dotenv import load_dotenv
+import os
+from monitoring.logging_config import setup_logging
+from services.price_context import STRATEGIES, TRADING_DAYS
+
+logger = setup_logging()
+load_dotenv()
+
+WEIGHT_METHOD = os.getenv("STRATEGY_WEIGHT_METHOD", "sharpe")
+WEIGHT_LOOKBACK = int(os.getenv("STRATEGY_WEIGHT_LOOKBACK", 120))
+WEIGHT_SHRINKAGE = float(os.getenv("STRATEGY_WEIGHT_SHRINKAGE", 0.3))
+HIGH_VIX = 20
+
+def regime_prior(vix, sentiment_score, strategies=STRATEGIES):
+    """VIX 與情緒情境下的先驗權重（原 generate_strategy 的條件規則）"""
+    weights = {strategy: 1.0 for strategy in strategies}
+    if vix > HIGH_VIX:
+        weights["rlhf_volatility_arbitrage"] *= 1.2
+        weights["quantum_fluctuation"] *= 1.2
+        weights["mean_reversion"] *= 0.8
+    if sentiment_score > 0.5:
+        weights["llm_sentiment_trend"] *= 1.3
+        weights["sentiment_stat_arb"] *= 1.3
+    elif sentiment_score < -0.5:
+        weights["llm_sentiment_trend"] *= 1.1
+        weights["sentiment_stat_arb"] *= 1.1
+    return weights
+
+def _direction(long_condition, short_condition):
+    return np.where(long_condition, 1.0, np.where(short_condition, -1.0, 0.0))
+
+def signal_history(ctx, sentiment_score, window=20):
+    """以向量化 rolling 運算重建各策略每日的歷史信號（只用當日以前的資料）
+
+    quantum_fluctuation（隨機）與 lstm_momentum（每次重新訓練）無法重建歷史，不在結果中；
+    情緒類策略的歷史以目前的情緒分數近似。
+    """
+    prices = pd.Series(ctx.closes)
+    returns = prices.pct_change()
+    rolling_mean = prices.rolling(window).mean()
+    rolling_std = prices.rolling(window).std()
+    vol = returns.rolling(window).std()
+    vol_mean = vol.expanding().mean()
+    trend = prices.diff().rolling(window).mean()
+    short_trend = returns.rolling(10).mean()
+    smoothed = prices.ewm(span=window).mean()
+    history = {
+        "momentum_breakout": _direction(prices > prices.rolling(window).max().shift(1), prices < prices.rolling(window).min().shift(1)),
+        "mean_reversion": _direction(prices < rolling_mean - rolling_std, prices > rolling_mean + rolling_std),
+        "chaos_phase_transition": np.where(vol > vol_mean * 1.5, 0.0, np.where(trend > 0, 1.0, -1.0)),
+        "llm_sentiment_trend": _direction((sentiment_score > 0.5) & (short_trend > 0), (sentiment_score < -0.5) & (short_trend < 0)),
+        "rlhf_volatility_arbitrage": _direction(vol > vol_mean * 1.2, vol < vol_mean * 0.8),
+        "brownian_diffusion": _direction(prices > smoothed, prices < smoothed),
+        "sentiment_stat_arb": _direction((sentiment_score > 0.5) & (prices < rolling_mean), (sentiment_score < -0.5) & (prices > rolling_mean))
+    }
+    if ctx.market is not None:
+        closes, pair = ctx.aligned_pair
+        spread = pd.Series(closes - pair)
+        spread_mean, spread_std = spread.rolling(window).mean(), spread.rolling(window).std()
+        pair_signal = _direction(spread < spread_mean - spread_std, spread > spread_mean + spread_std)
+        history["low_risk_pair_trading"] = np.concatenate([np.zeros(len(prices) - len(pair_signal)), pair_signal])
+    # 前 window 日指標尚未成形，不計入
+    return pd.DataFrame(history).iloc[window:]
+
+def strategy_returns(ctx, history):
+    """前一日信號乘上當日報酬，得到各策略的每日報酬 (T-1, K)"""
+    returns = ctx.returns[history.index[1:] - 1]
+    return pd.DataFrame(history.to_numpy()[:-1] * returns[:, None], columns=history.columns, index=history.index[1:])
+
+def _normalize(weights):
+    total = sum(weights.values())
+    if total <= 0:
+        return {name: 1.0 / len(weights) for name in weights}
+    return {name: value / total for name, value in weights.items()}
+
+class StrategyWeightOptimizer:
+    """以近期回測績效決定十個策略的權重，取代逐次呼叫 LLM 的權重調整
+
+    method="sharpe"：各策略在 lookback 期間的年化 Sharpe（負值截為 0）乘上 VIX / 情緒先驗；
+    method="nnls"：以非負最小平方法找出使策略報酬組合最貼近實際報酬的權重。
+    學到的權重再向先驗收縮（shrinkage），市場越不穩（最大回撤越深）收縮越多；
+    無法回測的策略只保有先驗部分。權重總和縮放為先驗權重的總和（原本的刻度），
+    使 generate_strategy 的 ±0.5 決策門檻維持原意，結果完全可重現。
+    """
+
+    def __init__(self, method=WEIGHT_METHOD, lookback=WEIGHT_LOOKBACK, shrinkage=WEIGHT_SHRINKAGE, window=20):
+        if method not in ("sharpe", "nnls"):
+            raise ValueError(f"Unknown weight method {method}")
+        self.method = method
+        self.lookback = lookback
+        self.shrinkage = shrinkage
+        self.window = window
+
+    def _learned(self, ctx, sentiment_score, prior):
+        history = signal_history(ctx, sentiment_score, self.window)
+        if len(history) < 3:
+            return None, {}
+        daily = strategy_returns(ctx, history).iloc[-self.lookback:]
+        std = daily.std()
+        sharpe = (daily.mean() / std.where(std > 0) * np.sqrt(TRADING_DAYS)).fillna(0.0)
+        if self.method == "sharpe":
+            learned = {name: max(float(sharpe[name]), 0.0) * prior[name] for name in daily.columns}
+        else:
+            signals = history.to_numpy()[:-1][-self.lookback:]
+            realized = ctx.returns[history.index[1:] - 1][-self.lookback:]
+            coefficients, _ = nnls(signals, realized)
+            learned = {name: float(value) * prior[name] for name, value in zip(history.columns, coefficients)}
+        return learned, {name: float(value) for name, value in sharpe.items()}
+
+    def optimize(self, ctx, sentiment_score, vix, risk_metrics=None):
+        """回傳 (weights, diagnostics)；weights 涵蓋全部十個策略"""
+        prior = regime_prior(vix, sentiment_score)
+        prior_weights = _normalize(prior)
+        learned, sharpe = self._learned(ctx, sentiment_score, prior)
+
+        shrinkage = self.shrinkage
+        if risk_metrics:
+            shrinkage = min(1.0, shrinkage + 0.3 * min(1.0, abs(risk_metrics.get("MaxDrawdown", 0.0)) / 0.5))
+        if not learned or sum(learned.values()) <= 0:
+            shrinkage = 1.0
+            learned_weights = {name: 0.0 for name in prior}
+        else:
+            learned_weights = _normalize({name: learned.get(name, 0.0) for name in prior})
+            # 無歷史可回測的策略以先驗比例保留在學到的部分之外
+            untestable = [name for name in prior if name not in learned]
+            share = sum(prior_weights[name] for name in untestable)
+            learned_weights = {
+                name: prior_weights[name] if name in untestable else value * (1.0 - share)
+                for name, value in learned_weights.items()
+            }
+
+        weights = {name: (1.0 - shrinkage) * learned_weights[name] + shrinkage * prior_weights[name] for name in prior}
+        diagnostics = {"method": self.method, "shrinkage": shrinkage, "strategy_sharpe": sharpe, "prior": prior_weights}
+        total = sum(prior.values())
+        return {name: value * total for name, value in _normalize(weights).items()}, diagnostics
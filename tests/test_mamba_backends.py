@@ -0,0 +1,86 @@
+import pytest
+import torch
+from models.mamba_backends import CPUMamba, CudaMamba, chunked_selective_scan, selective_scan_reference, _chunk_bounds
+
+SEQ_LENGTHS = (30, 64, 128, 256, 512)
+BATCH, D_INNER, D_STATE, CHUNK_SIZE = 2, 16, 8, 64
+ATOL = 1e-4
+
+def scan_inputs(seqlen, seed=0, delta_shift=0.0, requires_grad=False):
+    """隨機掃描輸入；delta_shift 加大 Δ，使累積衰減超過上限而觸發多次動態切塊"""
+    generator = torch.Generator().manual_seed(seed)
+    randn = lambda *shape: torch.randn(*shape, generator=generator)
+    inputs = {
+        "u": randn(BATCH, D_INNER, seqlen),
+        "delta": randn(BATCH, D_INNER, seqlen) + delta_shift,
+        "A": -torch.exp(randn(D_INNER, D_STATE)),
+        "B": randn(BATCH, D_STATE, seqlen),
+        "C": randn(BATCH, D_STATE, seqlen),
+        "D": randn(D_INNER),
+        "z": randn(BATCH, D_INNER, seqlen),
+        "delta_bias": randn(D_INNER)
+    }
+    if requires_grad:
+        for name in ("u", "delta", "B", "C"):
+            inputs[name].requires_grad_(True)
+    return inputs
+
+def run_chunked(inputs):
+    return chunked_selective_scan(inputs["u"], inputs["delta"], inputs["A"], inputs["B"], inputs["C"], inputs["D"],
+                                  z=inputs["z"], delta_bias=inputs["delta_bias"], chunk_size=CHUNK_SIZE)
+
+def run_reference(inputs):
+    return selective_scan_reference(inputs["u"], inputs["delta"], inputs["A"], inputs["B"], inputs["C"], inputs["D"],
+                                     inputs["z"], inputs["delta_bias"])
+
+def chunk_count(inputs):
+    delta = torch.nn.functional.softplus(inputs["delta"] + inputs["delta_bias"][..., None])
+    step_decay = (delta.amax(dim=(0, 1)) * (-inputs["A"]).amax()).tolist()
+    return len(_chunk_bounds(step_decay, delta.shape[-1], CHUNK_SIZE))
+
+@pytest.mark.parametrize("delta_shift", [0.0, 4.0])
+@pytest.mark.parametrize("seqlen", SEQ_LENGTHS)
+def test_inplace_scan_matches_reference(seqlen, delta_shift):
+    inputs = scan_inputs(seqlen, delta_shift=delta_shift)
+    with torch.no_grad():
+        actual = run_chunked(inputs)
+        expected = run_reference(inputs)
+    assert torch.isfinite(actual).all()
+    torch.testing.assert_close(actual, expected, atol=ATOL, rtol=1e-4)
+
+@pytest.mark.parametrize("delta_shift", [0.0, 4.0])
+@pytest.mark.parametrize("seqlen", SEQ_LENGTHS)
+def test_autograd_scan_matches_reference(seqlen, delta_shift):
+    inputs = scan_inputs(seqlen, delta_shift=delta_shift, requires_grad=True)
+    actual = run_chunked(inputs)
+    expected = run_reference(inputs)
+    torch.testing.assert_close(actual, expected, atol=ATOL, rtol=1e-4)
+
+    grad_output = torch.randn_like(actual)
+    actual_grads = torch.autograd.grad(actual, [inputs[name] for name in ("u", "delta", "B", "C")], grad_output)
+    expected_grads = torch.autograd.grad(expected, [inputs[name] for name in ("u", "delta", "B", "C")], grad_output)
+    for actual_grad, expected_grad in zip(actual_grads, expected_grads):
+        assert torch.isfinite(actual_grad).all()
+        torch.testing.assert_close(actual_grad, expected_grad, atol=1e-3, rtol=1e-3)
+
+@pytest.mark.parametrize("seqlen", SEQ_LENGTHS)
+def test_large_delta_splits_into_several_chunks(seqlen):
+    inputs = scan_inputs(seqlen, delta_shift=4.0)
+    # 大 Δ 時切塊數必須多於只依 chunk_size 切分的數量
+    assert chunk_count(inputs) > -(-seqlen // CHUNK_SIZE)
+
+@pytest.mark.skipif(CudaMamba is None or not torch.cuda.is_available(), reason="requires mamba_ssm and CUDA")
+@pytest.mark.parametrize("seqlen", SEQ_LENGTHS)
+def test_cpu_mamba_state_dict_round_trip_with_mamba_ssm(seqlen):
+    torch.manual_seed(0)
+    cpu_block = CPUMamba(d_model=64)
+    cuda_block = CudaMamba(d_model=64).cuda()
+    cuda_block.load_state_dict(cpu_block.state_dict())
+    restored = CPUMamba(d_model=64)
+    restored.load_state_dict({name: tensor.cpu() for name, tensor in cuda_block.state_dict().items()})
+
+    x = torch.randn(2, seqlen, 64)
+    with torch.no_grad():
+        expected = cpu_block(x)
+        torch.testing.assert_close(cuda_block(x.cuda()).cpu(), expected, atol=1e-3, rtol=1e-3)
+        torch.testing.assert_close(restored(x), expected, atol=0.0, rtol=0.0)
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+from services.price_context import PriceContext, STRATEGIES, SENTIMENT_STRATEGIES, evaluate_strategies, risk_metrics
+from services.risk_management import RiskManagement
+from services.trading_strategies import TradingStrategies
+
+# 隨機或每次重新訓練的策略無法與原實作逐值比較
+EXCLUDED = {"quantum_fluctuation", "lstm_momentum"}
+SEEDS = range(20)
+
+def random_walk(rng, length, start=100.0, drift=0.0, vol=0.02):
+    return start * np.cumprod(1.0 + rng.normal(drift, vol, length))
+
+def series_pair(seed):
+    """同長度的個股與大盤收盤價；不同種子涵蓋長度、趨勢與波動的變化"""
+    rng = np.random.default_rng(seed)
+    length = int(rng.integers(25, 200))
+    prices = random_walk(rng, length, drift=rng.normal(0.0, 0.003), vol=rng.uniform(0.005, 0.04))
+    market = random_walk(rng, length, start=15000.0, vol=0.01)
+    return prices, market
+
+def original_strategies(prices, market):
+    """原本的 TradingStrategies（以 pandas 逐策略計算），以記憶體序列取代資料庫查詢"""
+    strategies = TradingStrategies.__new__(TradingStrategies)
+    data = {"stock": pd.Series(prices), "market": pd.Series(market)}
+    strategies.fetch_stock_data = lambda stock_id, *args, **kwargs: data[stock_id]
+    return strategies
+
+def original_risk_metrics(prices, market):
+    """原本 StrategyToolkit.calculate_risk_metrics 的計算方式"""
+    rm = RiskManagement.__new__(RiskManagement)
+    prices, market = pd.Series(prices), pd.Series(market)
+    returns = prices.pct_change().dropna()
+    market_returns = market.pct_change().dropna()
+    return {
+        "VaR": rm.calculate_var(returns),
+        "Sharpe": rm.calculate_sharpe(returns),
+        "Beta": rm.calculate_beta(returns, market_returns),
+        "MaxDrawdown": rm.calculate_max_drawdown(prices),
+        "Volatility": rm.calculate_volatility(returns),
+        "CVaR": rm.calculate_cvar(returns),
+        "Sortino": rm.calculate_sortino(returns),
+        "JensenAlpha": rm.calculate_jensen_alpha(returns, market_returns),
+        "Treynor": rm.calculate_treynor(returns, market_returns)
+    }
+
+@pytest.mark.parametrize("sentiment_score", [0.8, 0.0, -0.8])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_evaluate_strategies_matches_original(seed, sentiment_score):
+    prices, market = series_pair(seed)
+    signals, expected_returns = evaluate_strategies(PriceContext(prices, market), sentiment_score)
+    strategies = original_strategies(prices, market)
+    for name in STRATEGIES:
+        if name in EXCLUDED:
+            continue
+        if name == "low_risk_pair_trading":
+            expected = strategies.low_risk_pair_trading("stock", "market")
+        elif name in SENTIMENT_STRATEGIES:
+            expected = getattr(strategies, name)("stock", sentiment_score)
+        else:
+            expected = getattr(strategies, name)("stock")
+        assert (signals[name], expected_returns[name]) == pytest.approx(expected), name
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_risk_metrics_match_original(seed):
+    prices, market = series_pair(seed)
+    metrics = risk_metrics(PriceContext(prices, market))
+    expected = original_risk_metrics(prices, market)
+    assert metrics.keys() == expected.keys()
+    for name, value in expected.items():
+        assert metrics[name] == pytest.approx(float(value), rel=1e-9, abs=1e-12), name